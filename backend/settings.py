@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
+from importlib.util import find_spec
 import os
 from dotenv import load_dotenv
 from datetime import timedelta
@@ -20,6 +21,11 @@ load_dotenv()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# graphene_django is not an installed app so that booting does not import the
+# GraphQL stack; only its GraphiQL template and script are needed, found here
+# without importing the package
+GRAPHENE_DJANGO_DIR = Path(find_spec('graphene_django').origin).parent
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -40,8 +46,7 @@ ALLOWED_HOSTS = [
 INSTALLED_APPS = [
     'rest_framework',
     'rest_framework.authtoken',
-    'graphene_django',
-    'graphql',
+    'helpers',
     'users',
     'posts',
     'django.contrib.admin',
@@ -71,11 +76,65 @@ SIMPLE_JWT = {
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'helpers.startup.LazyJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Views opt in through `throttle_scope`; `<scope>_ip` rates apply per client address
+    'DEFAULT_THROTTLE_CLASSES': [
+        'helpers.throttling.UserTokenBucketThrottle',
+        'helpers.throttling.IPTokenBucketThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'writes': '60/min',
+        'writes_ip': '300/min',
+        'likes': '120/min',
+        'likes_ip': '600/min',
+        'follows': '60/min',
+        'follows_ip': '300/min',
+        'blocks': '30/min',
+        'blocks_ip': '150/min',
+        'contacts': '10/hour',
+        'contacts_ip': '30/hour',
+        'exports': '3/day',
+        'exports_ip': '20/day',
+        # GraphQL is charged one token per selected field
+        'graphql': '3000/min',
+        'graphql_ip': '10000/min',
+    },
+}
+
+# Token buckets live in process memory unless a shared Redis is configured
+THROTTLE_STORE = {
+    'BACKEND': 'helpers.throttling.LocalBucketStore',
+    'OPTIONS': {},
+}
+if os.getenv('THROTTLE_REDIS_URL'):
+    THROTTLE_STORE = {
+        'BACKEND': 'helpers.throttling.RedisBucketStore',
+        'OPTIONS': {'url': os.getenv('THROTTLE_REDIS_URL')},
+    }
+
+# The shared tier of helpers.cache: process memory unless Redis is configured
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+if os.getenv('CACHE_REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_REDIS_URL'),
+    }
+
+# Per-process LRU in front of CACHES['default'] for the GraphQL entry points
+OBJECT_CACHE = {
+    'alias': 'default',
+    'max_entries': 10000,
+    'local_ttl': 5,
+    'timeout': 300,
 }
 
 DATABASES = {
@@ -96,7 +155,7 @@ ROOT_URLCONF = 'backend.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
+        'DIRS': [GRAPHENE_DJANGO_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -115,10 +174,12 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLITE_PATH points a process at another database file, e.g. the one
+# seeded by `manage.py loadtest`
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
@@ -158,9 +219,13 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
 STATIC_URL = 'static/'
+STATICFILES_DIRS = [GRAPHENE_DJANGO_DIR / 'static']
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+
+# Append-only activity event files (one JSONL file per UTC day), see helpers.events
+EVENTS_DIR = Path(os.getenv('EVENTS_DIR', BASE_DIR / 'events'))
 
 
 # Default primary key field type
@@ -173,5 +238,6 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 GRAPHENE = {
-    "SCHEMA": "social_graphql.schema.schema"
+    "SCHEMA": "social_graphql.schema.schema",
+    "MIDDLEWARE": ["social_graphql.flags.ViewerFlagsMiddleware"],
 }
\ No newline at end of file
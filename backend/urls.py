@@ -20,12 +20,16 @@ from django.conf import settings
 from django.urls import path, include
 from django.views.decorators.csrf import csrf_exempt
 
-from graphene_django.views import GraphQLView
+from helpers.startup import lazy_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/user', include('users.urls')),
     path('api/posts', include('posts.urls')),
-    path("graphql", csrf_exempt(GraphQLView.as_view(graphiql=True)))
+    path('api/admin/', include('helpers.urls')),
+    # Imported on the first GraphQL request, see helpers.startup
+    path("graphql", csrf_exempt(lazy_view('social_graphql.views.GraphQLView', graphiql=True))),
+    # Takes a JSON array of operations and answers with an array of results
+    path("graphql/batch", csrf_exempt(lazy_view('social_graphql.views.GraphQLView', batch=True))),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# With a preforking server that loads the app in its master (gunicorn
+# --preload), set DJANGO_WARMUP=1 so workers inherit the imported modules
+if os.environ.get('DJANGO_WARMUP'):
+    from helpers.startup import warmup
+    warmup()
@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Stands in for a cached None, so "no such row" is cached like any other answer
+_NONE = '__none__'
+
+
+class TwoTierCache:
+    """
+    A bounded per-process LRU in front of a shared Django cache.
+
+    Shared entries live under `<namespace>:<key>:<version>`, where the
+    version is a counter kept in the shared cache: invalidate() bumps it, so
+    every process misses on its next shared read and the old entry simply
+    expires. Local entries are trusted for `local_ttl` seconds, which bounds
+    how long other processes may serve a value invalidated elsewhere.
+
+    Concurrent misses for one key are coalesced: within a process a single
+    thread runs the loader while the others wait for its result, and across
+    processes a short lease in the shared cache lets one of them load while
+    the others poll for the entry it stores.
+    """
+
+    def __init__(self, alias='default', max_entries=10000, local_ttl=5, timeout=300, lease=5):
+        self.shared = caches[alias]
+        self.max_entries = max_entries
+        self.local_ttl = local_ttl
+        self.timeout = timeout
+        self.lease = lease
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                return None
+            self._local.move_to_end(key)
+            return entry
+
+    def _local_set(self, key, value):
+        with self._lock:
+            self._local[key] = (value, time.monotonic() + self.local_ttl)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def get_or_set(self, namespace, key, loader):
+        """ The cached value of `namespace:key`, running `loader()` on a miss """
+        local_key = f'{namespace}:{key}'
+        entry = self._local_get(local_key)
+        if entry is not None:
+            return _unwrap(entry[0])
+
+        with self._lock:
+            flight = self._inflight.get(local_key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[local_key] = {'done': threading.Event()}
+        if not leader:
+            flight['done'].wait()
+            if 'error' in flight:
+                raise flight['error']
+            return flight['value']
+
+        try:
+            flight['value'] = self._load(local_key, loader)
+            return flight['value']
+        except Exception as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[local_key]
+            flight['done'].set()
+
+    def _version(self, local_key):
+        version_key = f'v:{local_key}'
+        version = self.shared.get(version_key)
+        if version is None:
+            # Start from the clock rather than 1, so a counter evicted from the
+            # shared cache cannot come back to a version with entries left
+            self.shared.add(version_key, time.time_ns() // 1000, None)
+            version = self.shared.get(version_key)
+        return version
+
+    def _load(self, local_key, loader):
+        shared_key = f'{local_key}:{self._version(local_key)}'
+        value = self.shared.get(shared_key)
+
+        if value is None and not self.shared.add(f'lease:{shared_key}', 1, self.lease):
+            # Another process is loading it; wait for its entry up to the lease
+            deadline = time.monotonic() + self.lease
+            while value is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+                value = self.shared.get(shared_key)
+
+        if value is None:
+            value = loader()
+            value = _NONE if value is None else value
+            self.shared.set(shared_key, value, self.timeout)
+            self.shared.delete(f'lease:{shared_key}')
+        self._local_set(local_key, value)
+        return _unwrap(value)
+
+    def invalidate(self, namespace, key):
+        local_key = f'{namespace}:{key}'
+        with self._lock:
+            self._local.pop(local_key, None)
+        self._version(local_key)
+        try:
+            self.shared.incr(f'v:{local_key}')
+        except ValueError:
+            # Evicted in between; the next read starts a fresh version
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
+
+
+def _unwrap(value):
+    return None if isinstance(value, str) and value == _NONE else value
+
+
+_cache = None
+
+
+def get_cache():
+    """ The TwoTierCache configured by OBJECT_CACHE, created on first use """
+    global _cache
+    if _cache is None:
+        _cache = TwoTierCache(**getattr(settings, 'OBJECT_CACHE', {}))
+    return _cache
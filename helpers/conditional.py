@@ -0,0 +1,30 @@
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def weak_etag(*versions):
+    """ W/"1.4" style validator from the version columns behind a representation """
+    return 'W/"%s"' % '.'.join(str(version) for version in versions)
+
+
+class Validators:
+    """ ETag and Last-Modified of a representation, from its version columns """
+
+    def __init__(self, versions, last_modified):
+        self.etag = weak_etag(*versions)
+        self.last_modified = int(last_modified.timestamp())
+
+    @property
+    def headers(self):
+        return {'ETag': self.etag, 'Last-Modified': http_date(self.last_modified)}
+
+    def not_modified(self, request):
+        """
+        The 304 answering If-None-Match / If-Modified-Since (or 412 for a
+        failed If-Match), or None when the full response is needed.
+        """
+        response = get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+        if response is not None:
+            for name, value in self.headers.items():
+                response[name] = value
+        return response
@@ -0,0 +1,164 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+from helpers.models import EventRollup
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0
+# Rollup rows of this kind count every event, so their actors are the active users
+ALL_EVENTS = '*'
+
+
+def events_dir():
+    return Path(getattr(settings, 'EVENTS_DIR', settings.BASE_DIR / 'events'))
+
+
+def day_path(day):
+    """ The append-only JSONL file holding the events of `day` (UTC) """
+    return events_dir() / f'{day.isoformat()}.jsonl'
+
+
+class EventWriter:
+    """
+    Appends events to one JSONL file per UTC day from a single background
+    thread. Callers only enqueue; the thread writes whatever accumulated,
+    up to `batch_size` lines at a time, with one write call per file.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='events', daemon=True)
+        self._thread.start()
+
+    def put(self, event):
+        self._queue.put(event)
+
+    def flush(self, timeout=5):
+        """ Block until everything enqueued so far is on disk """
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch, waiters = [], []
+            while True:
+                (waiters if isinstance(item, threading.Event) else batch).append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception("Could not write %d events", len(batch))
+            for waiter in waiters:
+                waiter.set()
+
+    def _write(self, batch):
+        lines = defaultdict(list)
+        for event in batch:
+            day = datetime.fromtimestamp(event['ts'], dt_timezone.utc).date()
+            lines[day].append(json.dumps(event, separators=(',', ':')) + '\n')
+        if lines:
+            events_dir().mkdir(parents=True, exist_ok=True)
+        for day, day_lines in lines.items():
+            with open(day_path(day), 'a', encoding='utf-8') as file:
+                file.write(''.join(day_lines))
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = EventWriter(
+                    batch_size=getattr(settings, 'EVENTS_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+                    flush_interval=getattr(settings, 'EVENTS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+                )
+                atexit.register(_writer.flush)
+    return _writer
+
+
+def record(kind, actor_id, target_id=None, **fields):
+    """
+    Append a `kind` event (like, follow, post...) by `actor_id` to the stream
+    once the current transaction commits, so rolled back writes leave no
+    trace. Never touches the database.
+    """
+    if not getattr(settings, 'EVENTS_ENABLED', True):
+        return
+    event = {'ts': time.time(), 'kind': kind, 'actor': actor_id, 'target': target_id, **fields}
+    transaction.on_commit(lambda: get_writer().put(event))
+
+
+def read_events(day):
+    """ Events of `day` as dicts, skipping a partially written last line """
+    path = day_path(day)
+    if not path.exists():
+        return
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def hourly_rollup(events):
+    """
+    {(hour, kind): (events, distinct actors)} for `events`, with hours as
+    UTC datetimes; kind ALL_EVENTS covers every kind.
+    """
+    counts = defaultdict(int)
+    actors = defaultdict(set)
+    for event in events:
+        hour = int(event['ts']) // 3600 * 3600
+        for kind in (event['kind'], ALL_EVENTS):
+            counts[hour, kind] += 1
+            actors[hour, kind].add(event['actor'])
+    return {
+        (datetime.fromtimestamp(hour, dt_timezone.utc), kind): (count, len(actors[hour, kind]))
+        for (hour, kind), count in counts.items()
+    }
+
+
+def rollup_day(day):
+    """
+    Recompute the EventRollup rows of `day` from its event file. Rerunning
+    it (e.g. on the current day) replaces the previous rows. Returns the
+    number of rows written.
+    """
+    rows = [
+        EventRollup(hour=hour, kind=kind, events=count, actors=actors)
+        for (hour, kind), (count, actors) in hourly_rollup(read_events(day)).items()
+    ]
+    start = datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc)
+    with transaction.atomic():
+        EventRollup.objects.filter(hour__gte=start, hour__lt=start + timedelta(days=1)).delete()
+        EventRollup.objects.bulk_create(rows)
+    return len(rows)
@@ -0,0 +1,115 @@
+import functools
+import threading
+from itertools import combinations
+
+HASH_BITS = 64
+_MASK = (1 << HASH_BITS) - 1
+
+
+def to_signed(value):
+    """ A 64-bit hash as the signed integer a BigIntegerField holds """
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value & _MASK
+
+
+def hamming(a, b):
+    return ((a ^ b) & _MASK).bit_count()
+
+
+def dhash(pixels):
+    """
+    The 64-bit difference hash of an RGB uint8 array: the image is reduced
+    to 9x8 grey pixels and each bit says whether a pixel is brighter than
+    its left neighbour. Rescaling, recompression and small edits flip few
+    bits, so near-duplicates are a small Hamming distance apart.
+    """
+    # Pillow and NumPy are only needed on upload, not at boot
+    import numpy as np
+    from PIL import Image
+
+    grey = Image.fromarray(pixels).convert('L').resize((9, 8), Image.BILINEAR)
+    values = np.asarray(grey, dtype=np.int16)
+    bits = np.packbits(values[:, 1:] > values[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+@functools.lru_cache
+def _flips(bits, radius):
+    """ Every `bits`-wide mask with at most `radius` bits set """
+    import numpy as np
+
+    masks = [sum(1 << bit for bit in chosen) for r in range(radius + 1) for chosen in combinations(range(bits), r)]
+    return np.array(masks, dtype=np.uint64)
+
+
+class MultiIndex:
+    """
+    Multi-index hashing over 64-bit hashes: every hash is split into
+    CHUNKS 16-bit chunks with a sorted table each. Two hashes within
+    `radius` bits have at least one chunk within radius // CHUNKS bits, so
+    a search only looks up the handful of chunk values that close to the
+    query's in each table and checks those candidates in full.
+
+    Once radius // CHUNKS reaches 2 the probes cost more than comparing
+    every hash, so wider searches fall back to a vectorised scan. The
+    tables are built once from a snapshot; hashes added afterwards are kept
+    in a short list that every search scans.
+    """
+    CHUNKS = 4
+    CHUNK_BITS = HASH_BITS // CHUNKS
+
+    def __init__(self, rows=()):
+        import numpy as np
+
+        rows = list(rows)
+        self.values = np.fromiter((to_unsigned(value) for value, _ in rows), dtype=np.uint64, count=len(rows))
+        self.items = np.fromiter((item for _, item in rows), dtype=np.int64, count=len(rows))
+        self.tables = []
+        for chunk in range(self.CHUNKS):
+            keys = self._chunk(self.values, chunk)
+            order = np.argsort(keys, kind='stable').astype(np.int32)
+            self.tables.append((keys[order], order))
+        self.recent = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items) + len(self.recent)
+
+    def _chunk(self, values, chunk):
+        import numpy as np
+
+        return (values >> np.uint64(chunk * self.CHUNK_BITS)) & np.uint64((1 << self.CHUNK_BITS) - 1)
+
+    def add(self, value, item):
+        with self._lock:
+            self.recent.append((to_unsigned(value), item))
+
+    def search(self, value, radius):
+        """ (distance, item) of every item within `radius` of `value`, nearest first """
+        import numpy as np
+
+        value = np.uint64(to_unsigned(value))
+        if radius // self.CHUNKS >= 2:
+            distances = np.bitwise_count(self.values ^ value)
+            hits = np.flatnonzero(distances <= radius)
+            found = list(zip(distances[hits].tolist(), self.items[hits].tolist()))
+        else:
+            flips = _flips(self.CHUNK_BITS, radius // self.CHUNKS)
+            ranges = []
+            for chunk, (keys, order) in enumerate(self.tables):
+                probes = self._chunk(value, chunk) ^ flips
+                starts = np.searchsorted(keys, probes, 'left')
+                ends = np.searchsorted(keys, probes, 'right')
+                ranges.extend(order[start:end] for start, end in zip(starts.tolist(), ends.tolist()) if end > start)
+            candidates = np.unique(np.concatenate(ranges)) if ranges else np.empty(0, dtype=np.int32)
+            distances = np.bitwise_count(self.values[candidates] ^ value)
+            close = distances <= radius
+            found = list(zip(distances[close].tolist(), self.items[candidates[close]].tolist()))
+        with self._lock:
+            recent = list(self.recent)
+        found.extend((bits, item) for other, item in recent if (bits := hamming(int(value), other)) <= radius)
+        found.sort(key=lambda pair: pair[0])
+        return found
@@ -0,0 +1,282 @@
+import http.client
+import json
+import math
+import os
+import random
+import signal
+import threading
+import time
+import uuid
+from collections import defaultdict
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from django.db import OperationalError, connection
+from django.urls import reverse
+
+# Relative weights of the virtual user actions
+DEFAULT_MIX = {'graphql': 60, 'like': 20, 'follow': 10, 'post': 10}
+PERCENTILES = (50, 90, 99)
+
+GRAPHQL_QUERIES = {
+    'graphql postById': (
+        "query($id: Int!) { postById(id: $id) "
+        "{ id content author { username } comments { id content } } }"
+    ),
+    'graphql userByUsername': (
+        "query($name: String!) { userByUsername(name: $name) "
+        "{ id username bio posts { id content } } }"
+    ),
+}
+
+_request_state = threading.local()
+
+
+def instrument(application):
+    """
+    Wrap a WSGI application so every response reports its database time,
+    query count and whether SQLite answered "database is locked" in
+    X-Loadtest-* headers, which the virtual users collect. Meant for the
+    single-threaded workers of serve().
+    """
+    def timer(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as e:
+            if 'locked' in str(e):
+                _request_state.locked += 1
+            raise
+        finally:
+            _request_state.queries += 1
+            _request_state.db_time += time.perf_counter() - started
+
+    def instrumented(environ, start_response):
+        _request_state.queries = _request_state.locked = 0
+        _request_state.db_time = 0.0
+
+        def reporting_start_response(status, headers, exc_info=None):
+            headers = headers + [
+                ('X-Loadtest-Queries', str(_request_state.queries)),
+                ('X-Loadtest-DB-ms', f'{_request_state.db_time * 1000:.3f}'),
+                ('X-Loadtest-Locked', str(_request_state.locked)),
+            ]
+            return start_response(status, headers, exc_info)
+
+        with connection.execute_wrapper(timer):
+            return application(environ, reporting_start_response)
+
+    return instrumented
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(application, port=0, workers=4):
+    """
+    A stand-in for a preforking server such as gunicorn: bind once, fork
+    `workers` processes that each accept on the shared socket with wsgiref,
+    print the bound port, and run until SIGTERM.
+    """
+    server = WSGIServer(('127.0.0.1', port), QuietRequestHandler)
+    server.set_app(application)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, lambda *args: os._exit(0))
+            server.serve_forever()
+            os._exit(0)
+        children.append(pid)
+
+    def stop(*args):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    print(server.server_address[1], flush=True)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+def seed(users=200, posts=1000, follows=10, likes=20, seed=0):
+    """
+    Users, posts, follows and likes to run the load against. Returns the
+    user ids, usernames and access tokens and the post ids, as JSON-ready
+    data for the virtual users.
+    """
+    from django.contrib.auth.hashers import make_password
+    from django.db import transaction
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from posts.models import Post
+    from users.models import User
+
+    rng = random.Random(seed)
+    password = make_password('loadtest')
+    with transaction.atomic():
+        User.objects.bulk_create(
+            User(username=f'load{i}', email=f'load{i}@example.com', password=password) for i in range(users)
+        )
+        user_ids = list(User.objects.filter(username__startswith='load').values_list('id', flat=True))
+        Post.objects.bulk_create(
+            Post(author_id=rng.choice(user_ids), content=f"Load test post {i} #load") for i in range(posts)
+        )
+        post_ids = list(Post.objects.values_list('id', flat=True))
+
+        Follow = User.followers.through
+        Follow.objects.bulk_create(
+            [
+                Follow(from_user_id=followed, to_user_id=follower)
+                for follower in user_ids
+                for followed in rng.sample(user_ids, min(follows, len(user_ids)))
+                if followed != follower
+            ],
+            ignore_conflicts=True,
+        )
+        Like = Post.likers.through
+        Like.objects.bulk_create(
+            [
+                Like(user_id=user_id, post_id=post_id)
+                for user_id in user_ids
+                for post_id in rng.sample(post_ids, min(likes, len(post_ids)))
+            ],
+            ignore_conflicts=True,
+        )
+
+    return {
+        'users': [
+            {'id': user.id, 'username': user.username, 'token': str(AccessToken.for_user(user))}
+            for user in User.objects.filter(id__in=user_ids)
+        ],
+        'posts': post_ids,
+    }
+
+
+class VirtualUser:
+    """
+    One simulated client acting as a seeded user: picks actions by weight
+    and records (endpoint, status, latency ms, db ms, queries, lock errors)
+    for every request it makes.
+    """
+
+    def __init__(self, port, fixtures, mix, image, seed):
+        self.port = port
+        self.rng = random.Random(seed)
+        self.fixtures = fixtures
+        self.user = self.rng.choice(fixtures['users'])
+        self.actions = list(mix)
+        self.weights = [mix[action] for action in self.actions]
+        self.image = image
+        self.samples = []
+
+    def request(self, endpoint, method, path, body=None, content_type='application/json'):
+        headers = {'Authorization': f"Bearer {self.user['token']}"}
+        if body is not None:
+            headers['Content-Type'] = content_type
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        client = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        started = time.perf_counter()
+        try:
+            client.request(method, path, body=body, headers=headers)
+            response = client.getresponse()
+            data = response.read()
+            status = response.status
+            db_ms = float(response.getheader('X-Loadtest-DB-ms', 0))
+            queries = int(response.getheader('X-Loadtest-Queries', 0))
+            locked = int(response.getheader('X-Loadtest-Locked', 0))
+        except OSError:
+            data, status, db_ms, queries, locked = b'', 0, 0.0, 0, 0
+        finally:
+            client.close()
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.samples.append((endpoint, status, latency_ms, db_ms, queries, locked))
+        return status, data
+
+    def graphql(self):
+        endpoint = self.rng.choice(list(GRAPHQL_QUERIES))
+        if endpoint == 'graphql postById':
+            variables = {'id': self.rng.choice(self.fixtures['posts'])}
+        else:
+            variables = {'name': self.rng.choice(self.fixtures['users'])['username']}
+        self.request(endpoint, 'POST', '/graphql', {'query': GRAPHQL_QUERIES[endpoint], 'variables': variables})
+
+    def like(self):
+        post_id = self.rng.choice(self.fixtures['posts'])
+        if self.rng.random() < 0.7:
+            self.request('like', 'POST', reverse('post-like', kwargs={'id': post_id}))
+        else:
+            self.request('unlike', 'DELETE', reverse('post-like', kwargs={'id': post_id}))
+
+    def follow(self):
+        user_id = self.rng.choice(self.fixtures['users'])['id']
+        if self.rng.random() < 0.7:
+            self.request('follow', 'POST', reverse('follow', kwargs={'id': user_id}))
+        else:
+            self.request('unfollow', 'DELETE', reverse('follow', kwargs={'id': user_id}))
+
+    def post(self):
+        status, data = self.request('post', 'POST', reverse('post-details'), {'content': f"Posted under load #load {uuid.uuid4().hex[:8]}"})
+        if status != 201:
+            return
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="post"\r\n\r\n{json.loads(data)["id"]}\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="load.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n'
+        ).encode() + self.image + f'\r\n--{boundary}--\r\n'.encode()
+        self.request('upload', 'POST', reverse('post-file'), body, f'multipart/form-data; boundary={boundary}')
+
+    def run(self, duration):
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            getattr(self, self.rng.choices(self.actions, self.weights)[0])()
+        return self.samples
+
+
+def run_virtual_user(args):
+    """ Process pool entry point: (port, fixtures, mix, image, seed, duration) -> samples """
+    *init, duration = args
+    return VirtualUser(*init).run(duration)
+
+
+def percentile(values, q):
+    """ The `q`th percentile of sorted `values` (nearest rank) """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+def summarize(samples, elapsed):
+    """
+    One row per endpoint (plus 'total'): requests, throughput, latency
+    percentiles, error rate (connection failures and 5xx), other 4xx and
+    throttled requests, mean database time and query count, and lock errors.
+    """
+    by_endpoint = defaultdict(list)
+    for sample in samples:
+        by_endpoint[sample[0]].append(sample)
+    by_endpoint['total'] = samples
+
+    rows = []
+    for endpoint, endpoint_samples in sorted(by_endpoint.items(), key=lambda item: item[0] == 'total'):
+        count = len(endpoint_samples)
+        if not count:
+            continue
+        latencies = sorted(sample[2] for sample in endpoint_samples)
+        errors = sum(1 for sample in endpoint_samples if sample[1] == 0 or sample[1] >= 500)
+        rows.append({
+            'endpoint': endpoint,
+            'requests': count,
+            'rps': count / elapsed,
+            **{f'p{q}': percentile(latencies, q) for q in PERCENTILES},
+            'errors': errors / count,
+            'rejected': sum(1 for sample in endpoint_samples if 400 <= sample[1] < 500 and sample[1] != 429),
+            'throttled': sum(1 for sample in endpoint_samples if sample[1] == 429),
+            'db_ms': sum(sample[3] for sample in endpoint_samples) / count,
+            'queries': sum(sample[4] for sample in endpoint_samples) / count,
+            'locked': sum(sample[5] for sample in endpoint_samples),
+        })
+    return rows
@@ -0,0 +1,97 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from posts.models import Comment, Post
+from posts.tags import index_content
+from users.models import User
+
+QUERY = '''
+query {
+  postsByHashtag(tag: "bench", first: %d) {
+    id content postDate
+    author { id username bio pictureBlurhash pictureColor }
+    comments { id content author { id username bio pictureBlurhash pictureColor } }
+  }
+}
+'''
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare the size and encoding time of plain and normalized GraphQL responses"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=50)
+        parser.add_argument('--authors', type=int, default=5)
+        parser.add_argument('--comments', type=int, default=5, help="Comments per post")
+        parser.add_argument('--rounds', type=int, default=50)
+
+    def best_of(self, rounds, call):
+        best = float('inf')
+        for _ in range(rounds):
+            started = time.perf_counter()
+            call()
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    def handle(self, *args, **options):
+        # Seed inside a transaction that is always rolled back
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        from social_graphql import views
+        from social_graphql.normalize import normalize, with_references
+        from social_graphql.schema import schema
+
+        authors = User.objects.bulk_create(
+            User(username=f'bench-author-{i}', email=f'author{i}@example.com', bio="x" * 120)
+            for i in range(options['authors'])
+        )
+        for i in range(options['posts']):
+            post = Post.objects.create(content=f'#bench post {i}', author=authors[i % len(authors)])
+            index_content(post)
+            Comment.objects.bulk_create(
+                Comment(post=post, author=authors[(i + j) % len(authors)], content=f'comment {j}')
+                for j in range(options['comments'])
+            )
+
+        request = RequestFactory().post('/graphql')
+        request.user = authors[0]
+        query = QUERY % options['posts']
+        plain = schema.execute(query, context_value=request)
+        referenced = schema.execute(with_references(query, schema.graphql_schema), context_value=request)
+        assert not plain.errors and not referenced.errors, plain.errors or referenced.errors
+
+        def normalized():
+            # normalize() consumes its input, so each round gets a fresh copy
+            data = json.loads(json.dumps(referenced.data))
+            started = time.perf_counter()
+            data, entities = normalize(data)
+            return {'data': data, 'entities': entities}, time.perf_counter() - started
+
+        response, _ = normalized()
+        normalize_time = min(normalized()[1] for _ in range(options['rounds']))
+
+        encoders = [("json.dumps", lambda d: json.dumps(d, separators=(',', ':')))]
+        if views.orjson is not None:
+            encoders.append(("orjson", lambda d: views.orjson.dumps(d).decode()))
+        for name, encode in encoders:
+            for label, payload, extra in (
+                ("plain", {'data': plain.data}, 0),
+                ("normalized", response, normalize_time),
+            ):
+                size = len(encode(payload).encode())
+                elapsed = self.best_of(options['rounds'], lambda: encode(payload)) + extra
+                self.stdout.write(f"{label} + {name}: {size:,} bytes, {elapsed * 1000:.2f} ms")
@@ -0,0 +1,59 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand
+
+from helpers.placeholders import blurhash, dominant_color, placeholder
+
+
+def synthetic_image(width, height, image_format, seed):
+    """ A gradient with noise, encoded like an upload """
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width)[None, :, None]
+    y = np.linspace(0, 255, height)[:, None, None]
+    pixels = (x * [1, 0.4, 0.1] + y * [0.1, 0.5, 1]) / 2 + rng.normal(0, 20, (height, width, 3))
+    buffer = io.BytesIO()
+    Image.fromarray(pixels.clip(0, 255).astype(np.uint8)).save(buffer, format=image_format, quality=90)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = "Time placeholder computation (decode, downsample, BlurHash, dominant colour) on one core"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=20, help="Distinct images, each timed --repeat times")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--width', type=int, default=2048)
+        parser.add_argument('--height', type=int, default=1536)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        import numpy as np
+
+        for image_format in ('JPEG', 'PNG'):
+            images = [
+                synthetic_image(options['width'], options['height'], image_format, options['seed'] + i)
+                for i in range(options['images'])
+            ]
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                for data in images:
+                    placeholder(io.BytesIO(data))
+            elapsed = (time.perf_counter() - started) / (options['repeat'] * len(images))
+            self.stdout.write(
+                f"{image_format:<5} {options['width']}x{options['height']}: "
+                f"{elapsed * 1000:.2f} ms per image, {1 / elapsed:,.0f} images/s per core"
+            )
+
+        # The transform alone, on the downsampled pixels it actually sees
+        pixels = np.random.default_rng(options['seed']).integers(0, 256, (24, 32, 3), dtype=np.uint8)
+        runs = 2000
+        started = time.perf_counter()
+        for _ in range(runs):
+            blurhash(pixels)
+            dominant_color(pixels)
+        elapsed = (time.perf_counter() - started) / runs
+        self.stdout.write(f"hash of 32x24 pixels: {elapsed * 1e6:.0f} us, {1 / elapsed:,.0f} per second per core")
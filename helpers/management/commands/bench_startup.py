@@ -0,0 +1,76 @@
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Boots the project the way a WSGI worker does, then reports the time taken
+BOOT_SCRIPT = """
+import os, sys, time
+started = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+if {warmup!r}:
+    from helpers.startup import warmup
+    warmup()
+print('boot_ms', (time.perf_counter() - started) * 1000, file=sys.stderr)
+"""
+
+
+def parse_importtime(stderr):
+    """ [(module, self us, cumulative us)] from `python -X importtime` output """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+class Command(BaseCommand):
+    help = "Measure cold-start time and the import cost per package with python -X importtime"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="Boots timed (plus one importtime run)")
+        parser.add_argument('--top', type=int, default=15, help="Packages (or modules) listed")
+        parser.add_argument('--modules', action='store_true', help="List single modules instead of packages")
+        parser.add_argument('--warmup', action='store_true', help="Also run helpers.startup.warmup()")
+        parser.add_argument('--max-boot-ms', type=float, help="Fail if the median boot is slower")
+
+    def boot(self, options, importtime=False):
+        script = BOOT_SCRIPT.format(settings_module=settings.SETTINGS_MODULE, warmup=options['warmup'])
+        command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', script]
+        result = subprocess.run(
+            command, cwd=settings.BASE_DIR, env=os.environ.copy(), capture_output=True, text=True
+        )
+        if result.returncode:
+            raise CommandError(f"Boot failed:\n{result.stderr}")
+        boot_ms = next(float(line.split()[1]) for line in result.stderr.splitlines() if line.startswith('boot_ms'))
+        return boot_ms, result.stderr
+
+    def handle(self, *args, **options):
+        timings = [self.boot(options)[0] for _ in range(options['runs'])]
+        _, stderr = self.boot(options, importtime=True)
+        rows = parse_importtime(stderr)
+
+        costs = defaultdict(int)
+        for name, self_us, _ in rows:
+            costs[name if options['modules'] else name.split('.')[0]] += self_us
+
+        median = statistics.median(timings)
+        self.stdout.write(
+            f"boot: median {median:.1f} ms, min {min(timings):.1f} ms over {len(timings)} runs; "
+            f"{len(rows)} modules imported, {sum(costs.values()) / 1000:.1f} ms in imports"
+        )
+        for name, cost in sorted(costs.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f"  {cost / 1000:8.1f} ms  {name}")
+
+        if options['max_boot_ms'] is not None and median > options['max_boot_ms']:
+            raise CommandError(f"Median boot {median:.1f} ms is over the {options['max_boot_ms']:.1f} ms budget")
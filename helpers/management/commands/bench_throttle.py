@@ -0,0 +1,67 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from helpers.throttling import IPTokenBucketThrottle, LocalBucketStore, parse_rate
+
+
+class _View:
+    throttle_scope = 'bench'
+
+
+class Command(BaseCommand):
+    help = "Measure the per-request overhead of the token-bucket throttles"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200_000)
+        parser.add_argument('--keys', type=int, default=10_000, help="Distinct clients")
+        parser.add_argument('--threads', type=int, default=8)
+
+    def report(self, label, timings):
+        timings.sort()
+        count = len(timings)
+        p50 = timings[count // 2] * 1e6
+        p99 = timings[int(count * 0.99)] * 1e6
+        self.stdout.write(f"{label}: p50 {p50:.2f} us, p99 {p99:.2f} us over {count} calls")
+
+    def time_calls(self, call, args):
+        timings = []
+        for arg in args:
+            started = time.perf_counter()
+            call(arg)
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    def handle(self, *args, **options):
+        capacity, refill_rate = parse_rate('1000/s')
+        keys = [f'bench:user:{i % options["keys"]}' for i in range(options['requests'])]
+
+        store = LocalBucketStore()
+        self.report("store.consume", self.time_calls(
+            lambda key: store.consume(key, capacity, refill_rate), keys
+        ))
+
+        per_thread = [keys[i::options['threads']] for i in range(options['threads'])]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['threads']) as pool:
+            list(pool.map(lambda chunk: [store.consume(k, capacity, refill_rate) for k in chunk], per_thread))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"store.consume with {options['threads']} threads: "
+            f"{len(keys) / elapsed:,.0f} calls/s"
+        )
+
+        factory = APIRequestFactory()
+        requests = [
+            factory.get('/', REMOTE_ADDR=f'10.0.{i // 256 % 256}.{i % 256}')
+            for i in range(min(options['keys'], 65536))
+        ]
+        view = _View()
+        with override_settings(REST_FRAMEWORK={'DEFAULT_THROTTLE_RATES': {'bench_ip': '1000/s'}}):
+            self.report("IPTokenBucketThrottle.allow_request", self.time_calls(
+                lambda i: IPTokenBucketThrottle().allow_request(requests[i % len(requests)], view),
+                range(options['requests']),
+            ))
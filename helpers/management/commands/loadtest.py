@@ -0,0 +1,161 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from helpers.loadtest import DEFAULT_MIX, PERCENTILES, run_virtual_user, summarize
+
+# Creates the schema and the load test fixtures, printing them as JSON
+SEED_SCRIPT = """
+import json, os
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+import django
+django.setup()
+from django.core.management import call_command
+call_command('migrate', interactive=False, verbosity=0)
+from helpers.loadtest import seed
+print(json.dumps(seed(users={users!r}, posts={posts!r}, seed={seed!r})))
+"""
+
+# Serves the instrumented WSGI application from forked workers
+SERVER_SCRIPT = """
+import os
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+os.environ['DJANGO_WARMUP'] = '1'
+import django
+django.setup()
+if not {throttle!r}:
+    from django.conf import settings
+    from rest_framework.settings import api_settings
+    settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] = {{}}
+    api_settings.reload()
+from backend.wsgi import application
+from helpers.loadtest import instrument, serve
+serve(instrument(application), port={port!r}, workers={workers!r})
+"""
+
+
+def parse_mix(value):
+    """ 'graphql=60,like=20' -> {'graphql': 60, 'like': 20} """
+    mix = {}
+    for part in value.split(','):
+        action, _, weight = part.partition('=')
+        if action not in DEFAULT_MIX or not weight.isdigit():
+            raise CommandError(f"Bad --mix entry {part!r}; actions are {', '.join(DEFAULT_MIX)}")
+        mix[action] = int(weight)
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a SQLite database, serve the app from forked workers and drive mixed traffic "
+        "from a process pool of virtual users; reports throughput, latency, errors and lock contention"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Server processes")
+        parser.add_argument('--users', type=int, default=16, help="Virtual users, one process each")
+        parser.add_argument('--duration', type=float, default=20, help="Seconds of traffic")
+        parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help="e.g. graphql=60,like=20,follow=10,post=10")
+        parser.add_argument('--seed-users', type=int, default=200)
+        parser.add_argument('--seed-posts', type=int, default=1000)
+        parser.add_argument('--db', help="SQLite file to seed (a temporary one by default); must not exist yet")
+        parser.add_argument('--port', type=int, default=0)
+        parser.add_argument('--throttle', action='store_true', help="Keep the throttle rates (every virtual user shares one IP)")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def environment(self, db):
+        # Uploads land in a scratch media root rather than the project's
+        return {
+            **os.environ, 'SQLITE_PATH': str(db), 'MEDIA_ROOT': str(Path(db).parent / 'media'),
+            'APP_HOST': '127.0.0.1',
+        }
+
+    def seed_database(self, db, options):
+        script = SEED_SCRIPT.format(
+            settings_module=settings.SETTINGS_MODULE,
+            users=options['seed_users'], posts=options['seed_posts'], seed=options['seed'],
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, env=self.environment(db),
+            capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"Seeding failed:\n{result.stderr}")
+        return json.loads(result.stdout.splitlines()[-1])
+
+    def start_server(self, db, options):
+        script = SERVER_SCRIPT.format(
+            settings_module=settings.SETTINGS_MODULE, throttle=options['throttle'],
+            port=options['port'], workers=options['workers'],
+        )
+        server = subprocess.Popen(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, env=self.environment(db),
+            stdout=subprocess.PIPE, text=True,
+        )
+        port = server.stdout.readline().strip()
+        if not port.isdigit():
+            server.kill()
+            raise CommandError("The server did not start")
+        return server, int(port)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(prefix='loadtest-') as scratch:
+            db = Path(options['db'] or Path(scratch) / 'loadtest.sqlite3')
+            if db.exists():
+                raise CommandError(f"{db} already exists")
+
+            started = time.perf_counter()
+            fixtures = self.seed_database(db, options)
+            self.stdout.write(
+                f"seeded {len(fixtures['users'])} users and {len(fixtures['posts'])} posts "
+                f"in {time.perf_counter() - started:.1f} s"
+            )
+
+            image = io.BytesIO()
+            Image.new('RGB', (256, 256), color=(40, 120, 200)).save(image, format='JPEG')
+
+            server, port = self.start_server(db, options)
+            try:
+                jobs = [
+                    (port, fixtures, options['mix'], image.getvalue(), options['seed'] + i, options['duration'])
+                    for i in range(options['users'])
+                ]
+                started = time.perf_counter()
+                with ProcessPoolExecutor(max_workers=options['users']) as pool:
+                    samples = [sample for user_samples in pool.map(run_virtual_user, jobs) for sample in user_samples]
+                elapsed = time.perf_counter() - started
+            finally:
+                server.terminate()
+                server.wait()
+
+        rows = summarize(samples, elapsed)
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+
+        self.stdout.write(
+            f"{options['users']} virtual users against {options['workers']} workers for {elapsed:.1f} s"
+        )
+        percentiles = ''.join(f"{f'p{q} ms':>9}" for q in PERCENTILES)
+        self.stdout.write(
+            f"{'endpoint':<26}{'reqs':>7}{'req/s':>8}{percentiles}{'errors':>8}{'4xx':>6}{'429s':>6}"
+            f"{'db ms':>8}{'queries':>8}{'locked':>7}"
+        )
+        for row in rows:
+            self.stdout.write(
+                f"{row['endpoint']:<26}{row['requests']:>7}{row['rps']:>8.1f}"
+                + ''.join(f"{row[f'p{q}']:>9.1f}" for q in PERCENTILES)
+                + f"{row['errors']:>8.1%}{row['rejected']:>6}{row['throttled']:>6}{row['db_ms']:>8.2f}"
+                f"{row['queries']:>8.1f}{row['locked']:>7}"
+            )
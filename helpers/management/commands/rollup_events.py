@@ -0,0 +1,22 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from helpers.events import rollup_day
+
+
+class Command(BaseCommand):
+    help = "Aggregate the activity event files into hourly EventRollup rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--day', type=date.fromisoformat, action='append', dest='days',
+            help="UTC day to roll up, YYYY-MM-DD (can be repeated; default yesterday and today)",
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        for day in options['days'] or [today - timedelta(days=1), today]:
+            rows = rollup_day(day)
+            self.stdout.write(self.style.SUCCESS(f"{day}: {rows} hourly rows"))
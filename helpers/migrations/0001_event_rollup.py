@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('kind', models.CharField(max_length=30)),
+                ('events', models.PositiveIntegerField(default=0)),
+                ('actors', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('hour', 'kind'), name='unique_event_rollup')],
+            },
+        ),
+    ]
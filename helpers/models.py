@@ -0,0 +1,22 @@
+from django.db import models
+
+
+class EventRollup(models.Model):
+    """
+    Hourly aggregate of the activity event stream, built by the
+    rollup_events command so analytics never scan the primary tables.
+    """
+    hour = models.DateTimeField()
+    # Event kind, or '*' for all events together
+    kind = models.CharField(max_length=30)
+    events = models.PositiveIntegerField(default=0)
+    # Distinct users behind those events
+    actors = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'kind'], name='unique_event_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} at {self.hour}: {self.events}"
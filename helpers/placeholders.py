@@ -0,0 +1,111 @@
+import math
+
+# BlurHash components along x and y; 4x3 gives a 28 character hash
+COMPONENTS = (4, 3)
+# Images are scaled to fit this box before the transform, which is plenty
+# for a hash that keeps only the lowest frequencies
+SAMPLE_SIZE = 32
+BLURHASH_MAX_LENGTH = 6 + 2 * (9 * 9 - 1)
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def encode83(value, length):
+    return ''.join(BASE83[value // 83 ** (length - i - 1) % 83] for i in range(length))
+
+
+def _srgb_to_linear(np, pixels):
+    values = pixels / 255.0
+    return np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4)
+
+
+def _linear_to_srgb(value):
+    value = min(max(value, 0.0), 1.0)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(pixels, components=COMPONENTS):
+    """
+    The BlurHash of an (height, width, 3) uint8 RGB array. The cosine
+    transform of every component is a single einsum over the image rather
+    than a Python loop per pixel.
+    """
+    import numpy as np
+
+    x_components, y_components = components
+    height, width = pixels.shape[:2]
+    linear = _srgb_to_linear(np, pixels.astype(np.float64))
+
+    basis_x = np.cos(np.pi * np.arange(x_components)[:, None] * np.arange(width)[None, :] / width)
+    basis_y = np.cos(np.pi * np.arange(y_components)[:, None] * np.arange(height)[None, :] / height)
+    # factors[j, i] is the (r, g, b) weight of the component i along x, j along y
+    factors = np.einsum('jy,ix,yxc->jic', basis_y, basis_x, linear) / (width * height)
+    factors[1:, :] *= 2
+    factors[0, 1:] *= 2
+    factors = factors.reshape(-1, 3)
+    dc, ac = factors[0], factors[1:]
+
+    result = encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if len(ac):
+        quantised_max = int(max(0, min(82, math.floor(np.abs(ac).max() * 166 - 0.5))))
+        maximum = (quantised_max + 1) / 166
+        result += encode83(quantised_max, 1)
+    else:
+        maximum = 1
+        result += encode83(0, 1)
+
+    r, g, b = (_linear_to_srgb(value) for value in dc)
+    result += encode83((r << 16) + (g << 8) + b, 4)
+
+    scaled = ac / maximum
+    quantised = np.clip(np.floor(np.sign(scaled) * np.abs(scaled) ** 0.5 * 9 + 9.5), 0, 18).astype(int)
+    for r, g, b in quantised.tolist():
+        result += encode83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def dominant_color(pixels, bits=4):
+    """
+    '#rrggbb' of the most common colour of an RGB array: pixels are bucketed
+    on the top `bits` of each channel and the fullest bucket is averaged.
+    """
+    import numpy as np
+
+    pixels = pixels.reshape(-1, 3)
+    shift = 8 - bits
+    buckets = pixels >> shift
+    keys = (buckets[:, 0].astype(np.int64) << (2 * bits)) | (buckets[:, 1].astype(np.int64) << bits) | buckets[:, 2]
+    fullest = np.bincount(keys, minlength=1 << (3 * bits)).argmax()
+    r, g, b = pixels[keys == fullest].mean(axis=0).round().astype(int).tolist()
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def sample_pixels(source):
+    """
+    The image in the file object `source` scaled to fit SAMPLE_SIZE, as an
+    RGB uint8 array, or None when it is not an image Pillow can decode (a
+    video, say).
+    """
+    # Pillow and NumPy are only needed on upload, not at boot
+    import numpy as np
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(source) as image:
+            # Lets JPEG decode straight at a fraction of its size
+            image.draft('RGB', (SAMPLE_SIZE * 2, SAMPLE_SIZE * 2))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE), Image.BILINEAR)
+            return np.asarray(image)
+    except (UnidentifiedImageError, OSError):
+        return None
+
+
+def placeholder(source):
+    """ (blurhash, dominant colour) of the image in `source`, or None if it is not one """
+    pixels = sample_pixels(source)
+    if pixels is None:
+        return None
+    return blurhash(pixels), dominant_color(pixels)
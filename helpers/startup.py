@@ -0,0 +1,75 @@
+import importlib
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.authentication import BaseAuthentication
+
+# Imported by warmup() rather than at boot: the GraphQL stack, the schema and
+# everything it pulls in (NumPy through suggestions), Pillow and simplejwt
+DEFAULT_WARMUP_MODULES = [
+    'social_graphql.views',
+    'social_graphql.schema',
+    'rest_framework_simplejwt.views',
+    'rest_framework_simplejwt.authentication',
+    'PIL.Image',
+]
+
+
+def lazy_view(dotted_path, **initkwargs):
+    """
+    A view function that imports the class-based view at `dotted_path` and
+    builds it on the first request, so the URLconf does not import it at boot.
+    """
+    view = None
+    lock = threading.Lock()
+
+    def dispatch(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            with lock:
+                if view is None:
+                    view = import_string(dotted_path).as_view(**initkwargs)
+        return view(request, *args, **kwargs)
+
+    dispatch.lazy_view_path = dotted_path
+    return dispatch
+
+
+class LazyJWTAuthentication(BaseAuthentication):
+    """
+    simplejwt's JWTAuthentication, imported on the first authenticated request.
+    Listing it directly would import simplejwt (and django.test) while the
+    URLconf loads, since DRF views read the authentication classes then.
+    """
+    _backend = None
+
+    def backend(self):
+        if LazyJWTAuthentication._backend is None:
+            from rest_framework_simplejwt.authentication import JWTAuthentication
+            LazyJWTAuthentication._backend = JWTAuthentication()
+        return LazyJWTAuthentication._backend
+
+    def authenticate(self, request):
+        return self.backend().authenticate(request)
+
+    def authenticate_header(self, request):
+        return self.backend().authenticate_header(request)
+
+
+def warmup():
+    """
+    Import everything deferred at boot and build the GraphQL schema. Call it
+    in a preforking server's master (e.g. from the WSGI module with
+    gunicorn --preload) so workers share the loaded modules instead of each
+    paying for them on their first request. It opens no database connection,
+    which would not survive the fork.
+    """
+    for name in getattr(settings, 'WARMUP_MODULES', DEFAULT_WARMUP_MODULES):
+        importlib.import_module(name)
+
+    from django.urls import get_resolver
+    from graphene_django.settings import graphene_settings
+
+    get_resolver().url_patterns
+    graphene_settings.SCHEMA.graphql_schema
@@ -0,0 +1,172 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def parse_rate(rate):
+    """
+    Turn a DRF style rate such as "60/min" into (capacity, tokens per second).
+    The bucket holds a full period's worth of requests as burst.
+    """
+    if rate is None:
+        return None
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / PERIODS[period]
+
+
+class LocalBucketStore:
+    """
+    Token buckets held in process memory. Keys are spread over independently
+    locked shards so concurrent requests rarely wait on each other. Each
+    shard keeps its buckets in use order and drops the least recently used
+    one beyond `max_keys_per_shard`: that bucket has had the longest to
+    refill, so the limit costs little accuracy and holds however many keys
+    a client sprays.
+    """
+
+    def __init__(self, shards=64, max_keys_per_shard=10000):
+        self._shards = [(OrderedDict(), threading.Lock()) for _ in range(shards)]
+        self._max_keys = max_keys_per_shard
+
+    def consume(self, key, capacity, refill_rate, cost=1):
+        """ Take `cost` tokens from the bucket. Returns (allowed, seconds to wait) """
+        buckets, lock = self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+        now = time.monotonic()
+        with lock:
+            tokens, updated = buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            buckets[key] = (tokens, now)
+            buckets.move_to_end(key)
+            if len(buckets) > self._max_keys:
+                buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (cost - tokens) / refill_rate
+
+    def clear(self):
+        for buckets, lock in self._shards:
+            with lock:
+                buckets.clear()
+
+
+class RedisBucketStore:
+    """
+    Token buckets shared by every worker through a Redis compatible server.
+    The refill and take happen atomically inside a Lua script.
+    """
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local cost = tonumber(ARGV[3])
+    local now = tonumber(ARGV[4])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, client=None, url=None, prefix='throttle'):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def consume(self, key, capacity, refill_rate, cost=1):
+        allowed, tokens = self.client.eval(
+            self.SCRIPT, 1, f'{self.prefix}:{key}', capacity, refill_rate, cost, time.time()
+        )
+        tokens = float(tokens)
+        return bool(allowed), 0.0 if allowed else (cost - tokens) / refill_rate
+
+    def clear(self):
+        for key in self.client.scan_iter(f'{self.prefix}:*'):
+            self.client.delete(key)
+
+
+_store = None
+
+
+def get_store():
+    """ The bucket store configured by THROTTLE_STORE, created on first use """
+    global _store
+    if _store is None:
+        config = getattr(settings, 'THROTTLE_STORE', {})
+        backend = import_string(config.get('BACKEND', 'helpers.throttling.LocalBucketStore'))
+        _store = backend(**config.get('OPTIONS', {}))
+    return _store
+
+
+def consume(key, rate, cost=1):
+    """ Charge `cost` tokens against `key` at `rate`. Returns (allowed, seconds to wait) """
+    capacity, refill_rate = parse_rate(rate)
+    return get_store().consume(key, capacity, refill_rate, cost)
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle views by their `throttle_scope`, looking the rate up in
+    DEFAULT_THROTTLE_RATES under `scope + rate_suffix`. Views without a scope
+    or rate are not throttled.
+    """
+    rate_suffix = ''
+
+    def __init__(self):
+        self.wait_time = None
+
+    def get_ident_key(self, request):
+        # Subclasses pick the bucket; the client address is the fallback
+        return self.get_ident(request)
+
+    def get_cost(self, request, view):
+        # Views can weigh a request, e.g. GraphQL charges per selected field
+        return getattr(view, 'throttle_cost', 1)
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(f'{scope}{self.rate_suffix}') if scope else None
+        ident = self.get_ident_key(request)
+        if rate is None or ident is None:
+            return True
+
+        allowed, self.wait_time = consume(f'{scope}:{ident}', rate, self.get_cost(request, view))
+        return allowed
+
+    def wait(self):
+        return self.wait_time
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """ One bucket per authenticated user """
+
+    def get_ident_key(self, request):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        return None
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """ One bucket per client address, rated under `<scope>_ip` """
+    rate_suffix = '_ip'
+
+    def get_ident_key(self, request):
+        return f'ip:{self.get_ident(request)}'
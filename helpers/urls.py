@@ -0,0 +1,6 @@
+from django.urls import path
+from .views import EventRollupView
+
+urlpatterns = [
+    path('events/', EventRollupView.as_view(), name='event-rollups'),
+]
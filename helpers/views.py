@@ -0,0 +1,26 @@
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from helpers.models import EventRollup
+
+
+class EventRollupView(APIView):
+    """ Hourly activity aggregates for staff, read from the rollup table only """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        rollups = EventRollup.objects.order_by('hour', 'kind')
+        if request.query_params.get('kind'):
+            rollups = rollups.filter(kind__in=request.query_params['kind'].split(','))
+        for param, lookup in (('since', 'hour__gte'), ('until', 'hour__lt')):
+            if request.query_params.get(param):
+                value = parse_datetime(request.query_params[param])
+                if value is None:
+                    raise ParseError(f"'{param}' must be an ISO 8601 datetime")
+                rollups = rollups.filter(**{lookup: value})
+
+        return Response(list(rollups.values('hour', 'kind', 'events', 'actors')), status=status.HTTP_200_OK)
@@ -0,0 +1,51 @@
+import copy
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from helpers.cache import get_cache
+from users.cache import cached_user
+from users.models import is_anonymous, relation
+from .models import Post
+
+
+def visible_post(post_id, viewer):
+    """
+    Post.objects.visible_to(viewer).filter(pk=post_id).first(), with the post
+    and its author served from the cache. Only a logged in viewer looking at
+    someone else's post costs a query, for the block and follow checks.
+    """
+    post = get_cache().get_or_set('post', post_id, lambda: Post.objects.filter(pk=post_id).first())
+    if post is None:
+        return None
+    author = cached_user(post.author_id)
+    if author is None:
+        return None
+    if is_anonymous(viewer):
+        hidden = author.private_account
+    elif viewer.id == author.id:
+        hidden = False
+    else:
+        blocked, following = relation(viewer, author.id)
+        hidden = blocked or (author.private_account and not following)
+    if hidden:
+        return None
+    post = copy.copy(post)
+    post.author = author
+    return post
+
+
+def invalidate_post(post_id):
+    def invalidate():
+        get_cache().invalidate('post', post_id)
+    # Again after commit, in case a concurrent read cached the old row meanwhile
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+def _post_changed(sender, instance, **kwargs):
+    invalidate_post(instance.pk)
+
+
+post_save.connect(_post_changed, sender=Post, dispatch_uid='posts.cache.save')
+post_delete.connect(_post_changed, sender=Post, dispatch_uid='posts.cache.delete')
@@ -0,0 +1,91 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.signals import post_save
+
+from helpers.imagehash import MultiIndex
+from .models import PostFile
+
+DEFAULT_DISTANCE = 4
+DEFAULT_MAX_AGE = 600
+# Beyond this, unrelated images start to match
+MAX_DISTANCE = 12
+
+
+def snapshot():
+    """ A MultiIndex of the perceptual hash of every file on a live post, holding the file ids """
+    rows = PostFile.objects.filter(dhash__isnull=False, post__deleted_at__isnull=True).values_list(
+        'dhash', 'id'
+    ).iterator(chunk_size=10000)
+    index = MultiIndex(rows)
+    index.built_at = time.monotonic()
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = False
+
+
+def _rebuild():
+    global _index, _rebuilding
+    try:
+        _index = snapshot()
+    finally:
+        _rebuilding = False
+        connections.close_all()
+
+
+def get_index():
+    """
+    The index of this process, built from a snapshot on first use and
+    rebuilt in the background once older than DUPLICATE_INDEX_MAX_AGE
+    seconds, which picks up the uploads of other processes.
+    """
+    global _index, _rebuilding
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = snapshot()
+    elif time.monotonic() - _index.built_at > getattr(settings, 'DUPLICATE_INDEX_MAX_AGE', DEFAULT_MAX_AGE):
+        with _index_lock:
+            if not _rebuilding:
+                _rebuilding = True
+                threading.Thread(target=_rebuild, name='dedup', daemon=True).start()
+    return _index
+
+
+def reset_index():
+    global _index
+    _index = None
+
+
+def near_duplicates(dhash, distance=None, exclude=None):
+    """
+    [(distance, PostFile)] of the files on live posts whose hash is within
+    `distance` bits of `dhash` (DUPLICATE_IMAGE_DISTANCE by default),
+    nearest first. `exclude` leaves out the files of a queryset, e.g. the
+    uploader's own.
+    """
+    if distance is None:
+        distance = getattr(settings, 'DUPLICATE_IMAGE_DISTANCE', DEFAULT_DISTANCE)
+    matches = get_index().search(dhash, min(distance, MAX_DISTANCE))
+    if not matches:
+        return []
+    # The index only grows, so files deleted since it was built are dropped here
+    files = PostFile.objects.filter(post__deleted_at__isnull=True).select_related('post')
+    if exclude is not None:
+        files = files.exclude(pk__in=exclude.values('pk'))
+    files = files.in_bulk([file_id for _, file_id in matches])
+    return [(bits, files[file_id]) for bits, file_id in matches if file_id in files]
+
+
+def _file_saved(sender, instance, created=False, **kwargs):
+    # Only an index this process already built needs the new hash
+    if _index is not None and created and instance.dhash is not None:
+        _index.add(instance.dhash, instance.pk)
+
+
+post_save.connect(_file_saved, sender=PostFile, dispatch_uid='posts.dedup.save')
@@ -0,0 +1,99 @@
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException, NotFound, PermissionDenied
+
+from users.serializer import requested_fields
+from .cache import invalidate_post
+from .models import EditHistory, Post
+from .tags import index_content
+
+EDIT_FIELDS = ('id', 'content', 'edited', 'edited_at', 'version')
+
+_datetime = serializers.DateTimeField()
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = "The content was edited since you last read it."
+    default_code = 'precondition_failed'
+
+
+def parse_if_match(header):
+    """ Versions accepted by an If-Match header, or None when any version will do """
+    if not header or header.strip() == '*':
+        return None
+    versions = []
+    for tag in header.split(','):
+        # GET answers W/"<post version>.<author version>"; only the first part is ours
+        tag = tag.strip().removeprefix('W/').strip('"').split('.')[0]
+        if tag.isdigit():
+            versions.append(int(tag))
+    # A header naming no version of ours can never match
+    return versions
+
+
+def clean_content(serializer_class, content):
+    """ `content` run through the serializer's own field, errors keyed by 'content' """
+    try:
+        return serializer_class().fields['content'].run_validation(content)
+    except serializers.ValidationError as e:
+        raise serializers.ValidationError({'content': e.detail})
+
+
+def _save_history(model, rows, edited_at):
+    """ Copy the current content of `rows` into EditHistory with INSERT ... SELECT """
+    sql, params = rows.values_list('id', 'version', 'content').query.sql_with_params()
+    table = connection.ops.quote_name(EditHistory._meta.db_table)
+    column = connection.ops.quote_name(EditHistory._meta.get_field(model._meta.model_name).column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({column}, version, content, edited_at) "
+            f"SELECT previous.*, %s FROM ({sql}) AS previous",
+            (connection.ops.adapt_datetimefield_value(edited_at), *params),
+        )
+
+
+def _rejection(model, pk, user):
+    """ Why the conditional UPDATE matched nothing """
+    author_id = model.objects.filter(pk=pk).values_list('author_id', flat=True).first()
+    if author_id is None:
+        return NotFound()
+    if author_id != user.id:
+        return PermissionDenied(f"You cannot edit other users' {model.__name__}")
+    return PreconditionFailed()
+
+
+def edit_content(model, pk, user, content, versions=None):
+    """
+    Replace the content of the `model` row `pk` with one conditional UPDATE
+    that only matches when `user` is the author and, if `versions` is given,
+    the row is still at one of them. The replaced content goes to
+    EditHistory. Returns the edited row.
+    """
+    rows = model.objects.filter(pk=pk, author_id=user.id)
+    if versions is not None:
+        rows = rows.filter(version__in=versions)
+    now = timezone.now()
+
+    with transaction.atomic():
+        _save_history(model, rows, now)
+        updated = rows.update(content=content, edited=True, edited_at=now, version=F('version') + 1)
+        if not updated:
+            # Also rolls back the history row
+            raise _rejection(model, pk, user)
+        obj = model.objects.get(pk=pk)
+        index_content(obj)
+        if model is Post:
+            invalidate_post(pk)
+    return obj
+
+
+def edit_representation(obj, request=None):
+    """ The edited fields of `obj`, narrowed by ?fields= """
+    requested = requested_fields(request)
+    data = {name: getattr(obj, name) for name in EDIT_FIELDS if requested is None or name in requested}
+    if 'edited_at' in data:
+        data['edited_at'] = _datetime.to_representation(data['edited_at'])
+    return data
@@ -0,0 +1,148 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from helpers.hyperloglog import HyperLogLog
+from .models import Post, PostImpressions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 10.0
+
+
+def viewer_key(request):
+    """ What tells viewers apart: the user, or the client address when anonymous """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f"ip:{request.META.get('REMOTE_ADDR')}"
+
+
+def write_impressions(pending):
+    """
+    Add {post id: (views, HyperLogLog of viewers)} to the stored counters:
+    view counts are incremented in SQL and each sketch is merged into the
+    post's stored one, whose estimate becomes the unique viewer count.
+    Posts purged in the meantime are skipped. Cached posts are left alone:
+    their counters are read with impressions_of().
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        live = set(Post.all_objects.filter(id__in=pending).values_list('id', flat=True))
+        stored = PostImpressions.objects.select_for_update().in_bulk(live)
+        created, updated, posts = [], [], []
+        for post_id in live:
+            views, sketch = pending[post_id]
+            row = stored.get(post_id)
+            if row is None:
+                row = PostImpressions(post_id=post_id)
+                created.append(row)
+            else:
+                sketch = HyperLogLog.from_bytes(row.sketch).merge(sketch)
+                updated.append(row)
+            row.sketch, row.updated_at = sketch.to_bytes(), now
+            posts.append(Post(id=post_id, impressions_count=F('impressions_count') + views, unique_viewers=sketch.count()))
+
+        PostImpressions.objects.bulk_create(created)
+        PostImpressions.objects.bulk_update(updated, ['sketch', 'updated_at'])
+        Post.all_objects.bulk_update(posts, ['impressions_count', 'unique_viewers'])
+    return len(posts)
+
+
+class ImpressionBuffer:
+    """
+    Views recorded by this process since the last flush: per post, a view
+    count and a HyperLogLog sketch of the viewers, so memory stays at a
+    few KB per post however many views it gets. A background thread writes
+    them out every `flush_interval` seconds with one transaction.
+    """
+
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='impressions', daemon=True)
+        self._thread.start()
+
+    def record(self, post_id, viewer):
+        with self._lock:
+            entry = self._pending.get(post_id)
+            if entry is None:
+                entry = self._pending[post_id] = [0, HyperLogLog()]
+            entry[0] += 1
+            entry[1].add(viewer)
+
+    def pending_views(self, post_id):
+        with self._lock:
+            entry = self._pending.get(post_id)
+            return entry[0] if entry else 0
+
+    def flush(self):
+        """ Write out everything recorded so far; on failure it is kept for the next flush """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            return write_impressions(pending)
+        except Exception:
+            logger.exception("Could not flush the impressions of %d posts", len(pending))
+            with self._lock:
+                for post_id, (views, sketch) in pending.items():
+                    entry = self._pending.setdefault(post_id, [0, HyperLogLog()])
+                    entry[0] += views
+                    entry[1].merge(sketch)
+            return 0
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            finally:
+                connections.close_all()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = ImpressionBuffer(
+                    flush_interval=getattr(settings, 'IMPRESSIONS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def impressions_of(post_id):
+    """
+    (views, unique viewers) of a post, read from its row rather than a
+    cached copy, which flushes would otherwise have to evict every time a
+    popular post is viewed. Views include this process's unflushed ones.
+    """
+    views, unique_viewers = Post.all_objects.filter(id=post_id).values_list(
+        'impressions_count', 'unique_viewers'
+    ).first() or (0, 0)
+    return views + get_buffer().pending_views(post_id), unique_viewers
+
+
+def record_impression(post_id, request):
+    """
+    Count a view of `post_id` once the current transaction commits. Only
+    this process's memory is touched on the request path.
+    """
+    if not getattr(settings, 'IMPRESSIONS_ENABLED', True):
+        return
+    viewer = viewer_key(request)
+    transaction.on_commit(lambda: get_buffer().record(post_id, viewer))
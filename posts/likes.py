@@ -0,0 +1,26 @@
+from django.db import transaction
+
+from helpers import events
+from users.stats import record_post_like
+from .models import Post
+
+
+def set_like(obj, user, liked=True):
+    """
+    Like or unlike a post, comment or reply. Post likes also move the
+    author's `likes_received`, but only when a like row is actually created
+    or removed. Returns whether anything changed.
+    """
+    model = type(obj)
+    likes = model.likers.through.objects
+    lookup = {model._meta.model_name: obj, 'user': user}
+    with transaction.atomic():
+        if liked:
+            _, changed = likes.get_or_create(**lookup)
+        else:
+            changed = likes.filter(**lookup).delete()[0] > 0
+        if changed and model is Post:
+            record_post_like(obj.author_id, 1 if liked else -1)
+        if changed:
+            events.record('like' if liked else 'unlike', user.id, obj.id, target_type=model._meta.model_name)
+    return changed
@@ -0,0 +1,52 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from helpers.imagehash import MultiIndex
+
+
+class Command(BaseCommand):
+    help = "Compare near-duplicate search in a multi-index of perceptual hashes with a linear scan"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hashes', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--distances', default='2,4,8')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        import numpy as np
+
+        rng = random.Random(options['seed'])
+        hashes = [rng.getrandbits(64) for _ in range(options['hashes'])]
+
+        started = time.perf_counter()
+        index = MultiIndex((value, i) for i, value in enumerate(hashes))
+        self.stdout.write(f"indexed {len(index)} hashes in {time.perf_counter() - started:.1f} s")
+
+        # Queries are slight variations of stored hashes, as reposts would be
+        queries = []
+        for _ in range(options['queries']):
+            value = rng.choice(hashes)
+            for bit in rng.sample(range(64), rng.randint(0, 3)):
+                value ^= 1 << bit
+            queries.append(value)
+
+        stored = np.array(hashes, dtype=np.uint64)
+        for distance in map(int, options['distances'].split(',')):
+            started = time.perf_counter()
+            index_results = [index.search(value, distance) for value in queries]
+            index_ms = (time.perf_counter() - started) / len(queries) * 1000
+
+            started = time.perf_counter()
+            for value, expected in zip(queries[:20], index_results):
+                found = np.flatnonzero(np.bitwise_count(stored ^ np.uint64(value)) <= distance)
+                assert sorted(found.tolist()) == sorted(i for _, i in expected)
+            scan_ms = (time.perf_counter() - started) / 20 * 1000
+
+            matches = sum(map(len, index_results)) / len(queries)
+            self.stdout.write(
+                f"distance {distance}: multi-index {index_ms:.2f} ms, NumPy linear scan {scan_ms:.2f} ms "
+                f"per query ({matches:.1f} matches)"
+            )
@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework import serializers
+
+from posts.models import Post
+from posts.serializer import PostSerializer, post_rows
+from users.models import User
+from users.serializer import UserSerializer
+
+
+class FullAuthorPostSerializer(serializers.ModelSerializer):
+    """ The previous PostSerializer, embedding every UserSerializer field """
+    author = UserSerializer(read_only=True)
+
+    class Meta:
+        model = Post
+        fields = ['id', 'content', 'author', 'post_date', 'edited']
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare post serialization throughput of the DRF serializers and the .values() path"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--authors', type=int, default=100)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def best_of(self, rounds, call):
+        best = float('inf')
+        for _ in range(rounds):
+            started = time.perf_counter()
+            call()
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    def handle(self, *args, **options):
+        # Seed inside a transaction that is always rolled back
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        authors = User.objects.bulk_create(
+            User(username=f'bench-author-{i}', email=f'author{i}@example.com') for i in range(options['authors'])
+        )
+        Post.objects.bulk_create(
+            Post(content=f'Post {i}', author=authors[i % len(authors)]) for i in range(options['posts'])
+        )
+        posts = Post.objects.filter(author__in=authors).order_by('id')
+        count = options['posts']
+
+        cases = [
+            ("PostSerializer + full UserSerializer", lambda: FullAuthorPostSerializer(posts.select_related('author'), many=True).data),
+            ("PostSerializer + UserCardSerializer", lambda: PostSerializer(posts.select_related('author'), many=True).data),
+            ("post_rows (.values())", lambda: list(post_rows(posts))),
+        ]
+        for label, call in cases:
+            elapsed = self.best_of(options['rounds'], call)
+            self.stdout.write(f"{label}: {count / elapsed:,.0f} posts/s ({elapsed * 1000:.1f} ms)")
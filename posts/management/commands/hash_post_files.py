@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import PostFile
+
+
+class Command(BaseCommand):
+    help = "Compute the placeholders and perceptual hash of post files uploaded before they existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        hashed = skipped = last_id = 0
+        while True:
+            # Keyset over the ids, so files that stay unhashed (videos) are not read twice
+            batch = list(
+                PostFile.objects.filter(id__gt=last_id, dhash__isnull=True).exclude(file='')
+                .order_by('id')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            done = []
+            for post_file in batch:
+                try:
+                    post_file.compute_hashes()
+                except OSError:
+                    self.stderr.write(f"Missing file {post_file.file.name}")
+                finally:
+                    post_file.file.close()
+                if post_file.dhash is not None:
+                    done.append(post_file)
+            PostFile.objects.bulk_update(done, ['blurhash', 'dominant_color', 'dhash'])
+            hashed += len(done)
+            skipped += len(batch) - len(done)
+
+        self.stdout.write(f"hashed {hashed} files, {skipped} are not images or are missing")
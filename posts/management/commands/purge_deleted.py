@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import PurgeJob
+from posts.purge import run_purge_job
+
+
+class Command(BaseCommand):
+    help = "Run or resume every unfinished purge of soft-deleted users and posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        jobs = PurgeJob.objects.exclude(status=PurgeJob.Status.DONE).order_by('id')
+        for job_id in jobs.values_list('id', flat=True):
+            job = run_purge_job(job_id, batch_size=options['batch_size'])
+            style = self.style.SUCCESS if job.status == PurgeJob.Status.DONE else self.style.ERROR
+            self.stdout.write(style(f"{job}: {job.deleted_rows} rows deleted"))
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+PATH_SEGMENT_WIDTH = 10
+BATCH_SIZE = 1000
+
+
+def segment(pk):
+    return f"{pk:0{PATH_SEGMENT_WIDTH}d}"
+
+
+def build_paths(apps, schema_editor):
+    # Existing replies all answer a comment directly, so they sit at depth 1
+    Comment = apps.get_model('posts', 'Comment')
+    Reply = apps.get_model('posts', 'Reply')
+
+    batch = []
+    for comment in Comment.objects.only('id', 'post_id').iterator(chunk_size=BATCH_SIZE):
+        comment.path = f"{segment(comment.post_id)}.{segment(comment.id)}"
+        batch.append(comment)
+        if len(batch) >= BATCH_SIZE:
+            Comment.objects.bulk_update(batch, ['path'])
+            batch = []
+    Comment.objects.bulk_update(batch, ['path'])
+
+    batch = []
+    replies = Reply.objects.values_list('id', 'comment_id', 'comment__post_id')
+    for reply_id, comment_id, post_id in replies.iterator(chunk_size=BATCH_SIZE):
+        path = f"{segment(post_id)}.{segment(comment_id)}.{segment(reply_id)}"
+        batch.append(Reply(id=reply_id, path=path, depth=1))
+        if len(batch) >= BATCH_SIZE:
+            Reply.objects.bulk_update(batch, ['path', 'depth'])
+            batch = []
+    Reply.objects.bulk_update(batch, ['path', 'depth'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_soft_delete_and_purge_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='posts.reply'),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_edit_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postfile',
+            name='blurhash',
+            field=models.CharField(blank=True, editable=False, max_length=166),
+        ),
+        migrations.AddField(
+            model_name='postfile',
+            name='dominant_color',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+    ]
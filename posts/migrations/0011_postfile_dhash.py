@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_placeholders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postfile',
+            name='dhash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
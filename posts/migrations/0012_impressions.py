@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_postfile_dhash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostImpressions',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='impression_sketch', serialize=False, to='posts.post')),
+                ('sketch', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='impressions_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='unique_viewers',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_impressions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='purgejob',
+            name='step',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+    ]
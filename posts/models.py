@@ -1,8 +1,11 @@
 from django.db import models
-from users.models import User
+from django.db.models import Q
+from users.models import User, blocked_between, follows, is_anonymous
 from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator
 from django.utils.translation import gettext_lazy as _
+from helpers.imagehash import dhash, to_signed
+from helpers.placeholders import BLURHASH_MAX_LENGTH, blurhash, dominant_color, sample_pixels
 
 def validate_file_size(value):
     file_size = value.size  # File size in bytes
@@ -18,6 +21,53 @@ def validate_file_type(value):
     if ext not in allowed_extensions:
         raise ValidationError(_('Unsupported file type. Only images and videos are allowed.'))
 
+# Materialized paths are dot-joined, zero-padded ids so that string order is
+# tree order: "<post>.<comment>" for comments, "<comment path>.<reply>..." for replies
+PATH_SEGMENT_WIDTH = 10
+
+
+def path_segment(pk):
+    return f"{pk:0{PATH_SEGMENT_WIDTH}d}"
+
+
+def join_path(*segments):
+    return '.'.join(segments)
+
+
+class AuthoredQuerySet(models.QuerySet):
+    def visible_to(self, viewer):
+        """
+        Rows whose author is not deleted and not on either side of a block
+        with `viewer`
+        """
+        queryset = self.filter(author__deleted_at__isnull=True)
+        if is_anonymous(viewer):
+            return queryset
+        return queryset.exclude(blocked_between(viewer, models.OuterRef('author_id')))
+
+
+class PostQuerySet(AuthoredQuerySet):
+    def visible_to(self, viewer):
+        """
+        Posts `viewer` may see: no block between them and the author, and the
+        author is public, followed by the viewer, or the viewer themselves.
+        """
+        queryset = super().visible_to(viewer)
+        if is_anonymous(viewer):
+            return queryset.filter(author__private_account=False)
+        return queryset.filter(
+            Q(author_id=viewer.id)
+            | Q(author__private_account=False)
+            | Q(follows(viewer, models.OuterRef('author_id')))
+        )
+
+
+class PostManager(models.Manager.from_queryset(PostQuerySet)):
+    def get_queryset(self):
+        # Soft-deleted posts stay hidden until they are purged
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 # Create your models here.
 class Post(models.Model):
     content = models.TextField(blank=True, null=True)
@@ -25,11 +75,32 @@ class Post(models.Model):
     post_date = models.DateTimeField(auto_now_add=True)
     likers = models.ManyToManyField(User, related_name="post_likes", blank=True)
     edited = models.BooleanField(default=False)
+    edited_at = models.DateTimeField(null=True, blank=True)
+    # Bumped by every edit, served as the ETag for If-Match
+    version = models.PositiveIntegerField(default=1)
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Flushed from posts.impressions: every view, and the estimated distinct viewers
+    impressions_count = models.PositiveBigIntegerField(default=0)
+    unique_viewers = models.PositiveIntegerField(default=0)
+
+    objects = PostManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return f"Post {self.id}"
     
 
+class PostImpressions(models.Model):
+    """ The HyperLogLog sketch of a post's viewers, merged into by every flush """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='impression_sketch')
+    # helpers.hyperloglog.HyperLogLog.to_bytes()
+    sketch = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Impressions of post {self.post_id}"
+
+
 class PostFile(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="files")
     file = models.FileField(
@@ -38,6 +109,29 @@ class PostFile(models.Model):
         blank=True,
         validators=[validate_file_size, validate_file_type]
     )
+    # Painted by clients while the file loads; empty for videos
+    blurhash = models.CharField(max_length=BLURHASH_MAX_LENGTH, blank=True, editable=False)
+    dominant_color = models.CharField(max_length=7, blank=True, editable=False)
+    # Perceptual hash (helpers.imagehash.dhash) as a signed 64-bit integer, see posts.dedup
+    dhash = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    def compute_hashes(self):
+        """ Fill the placeholder and perceptual hash from the file, decoding it once """
+        self._hashed = True
+        if not self.file:
+            return
+        # The upload is still in memory or a temporary file here
+        self.file.open('rb')
+        pixels = sample_pixels(self.file)
+        self.file.seek(0)
+        if pixels is not None:
+            self.blurhash, self.dominant_color = blurhash(pixels), dominant_color(pixels)
+            self.dhash = to_signed(dhash(pixels))
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and not getattr(self, '_hashed', False):
+            self.compute_hashes()
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"File for post {self.post.id}"
@@ -50,6 +144,19 @@ class Comment(models.Model):
     likers = models.ManyToManyField(User, related_name="comment_likes", blank=True)
     comment_date = models.DateTimeField(auto_now_add=True)
     edited = models.BooleanField(default=False)
+    edited_at = models.DateTimeField(null=True, blank=True)
+    # Bumped by every edit, served as the ETag for If-Match
+    version = models.PositiveIntegerField(default=1)
+    # Materialized path "<post id>.<comment id>"
+    path = models.CharField(max_length=255, blank=True, db_index=True)
+
+    objects = AuthoredQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if not self.path:
+            self.path = join_path(path_segment(self.post_id), path_segment(self.pk))
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
 
     def __str__(self):
         return f"Comment {self.id}"
@@ -58,11 +165,118 @@ class Reply(models.Model):
     content = models.TextField()
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="replies")
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name="replies")
+    # Set when answering another reply rather than the comment itself
+    parent = models.ForeignKey("self", on_delete=models.CASCADE, related_name="children", null=True, blank=True)
     likers = models.ManyToManyField(User, related_name="reply_likes", blank=True)
     reply_date = models.DateTimeField(auto_now_add=True)
     edited = models.BooleanField(default=False)
+    edited_at = models.DateTimeField(null=True, blank=True)
+    # Bumped by every edit, served as the ETag for If-Match
+    version = models.PositiveIntegerField(default=1)
+    # Materialized path "<parent path>.<reply id>"; direct replies to a comment have depth 1
+    path = models.CharField(max_length=255, blank=True, db_index=True)
+    depth = models.PositiveSmallIntegerField(default=1)
+
+    objects = AuthoredQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.parent_id:
+            self.depth = self.parent.depth + 1
+        super().save(*args, **kwargs)
+        if not self.path:
+            parent_path = self.parent.path if self.parent_id else self.comment.path
+            self.path = join_path(parent_path, path_segment(self.pk))
+            Reply.objects.filter(pk=self.pk).update(path=self.path)
 
     def __str__(self):
         return f"Reply {self.id}"
 
 
+class PurgeJob(models.Model):
+    """
+    Progress of the background purge of a soft-deleted user or post. The
+    purge runs as a list of steps, each deleting one kind of descendant row
+    in descending id order, so `step` (the name of the current one) and
+    `last_id` are enough to resume it.
+    """
+    class Kind(models.TextChoices):
+        USER = 'user', _('User')
+        POST = 'post', _('Post')
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        RUNNING = 'running', _('Running')
+        DONE = 'done', _('Done')
+        FAILED = 'failed', _('Failed')
+
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    target_id = models.BigIntegerField()
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING, db_index=True)
+    step = models.CharField(max_length=50, blank=True)
+    last_id = models.BigIntegerField(default=0)
+    deleted_rows = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Purge {self.kind} {self.target_id} ({self.status})"
+
+
+class EditHistory(models.Model):
+    """ The content a post, comment or reply had at `version`, before it was edited """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="history", null=True, blank=True)
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name="history", null=True, blank=True)
+    reply = models.ForeignKey(Reply, on_delete=models.CASCADE, related_name="history", null=True, blank=True)
+    version = models.PositiveIntegerField()
+    content = models.TextField(blank=True, null=True)
+    edited_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Version {self.version} of {self.post or self.comment or self.reply}"
+
+
+class Hashtag(models.Model):
+    """ A normalized (casefolded) hashtag and the number of live posts using it """
+    name = models.CharField(max_length=100, unique=True)
+    post_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"#{self.name}"
+
+
+class PostHashtag(models.Model):
+    """ Inverted index from a hashtag to the posts using it, read newest post first """
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name="post_links")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="hashtag_links")
+
+    class Meta:
+        constraints = [
+            # Also serves the (hashtag_id, post_id) keyset scans
+            models.UniqueConstraint(fields=['hashtag', 'post'], name='unique_post_hashtag'),
+        ]
+
+    def __str__(self):
+        return f"{self.hashtag} on post {self.post_id}"
+
+
+class Mention(models.Model):
+    """
+    An @mention of `user` by `author` in a post, comment or reply. `post` is
+    the post of the thread either way, so visibility follows the post.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="mentions")
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="mentions_made")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="mentions")
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name="mentions", null=True, blank=True)
+    reply = models.ForeignKey(Reply, on_delete=models.CASCADE, related_name="mentions", null=True, blank=True)
+
+    objects = AuthoredQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-id'], name='mention_user_keyset'),
+        ]
+
+    def __str__(self):
+        return f"Mention of {self.user_id} in post {self.post_id}"
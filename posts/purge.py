@@ -0,0 +1,247 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Exists, OuterRef, Value
+from django.db.models.functions import Concat
+from django.db.models.lookups import StartsWith
+from django.utils import timezone
+
+from users.autocomplete import forget_user
+from users.avatars import rendition_names
+from users.cache import invalidate_user
+from users.models import User, SuggestedUser, DataExport
+from users.stats import record_post_deleted, record_user_deleted
+from .models import Post, PostFile, Comment, Reply, PurgeJob, PostHashtag, Mention, EditHistory, PostImpressions
+from .cache import invalidate_post
+from .tags import unindex_posts
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+_executor = None
+
+
+def _posts(lookup):
+    """ Purge steps for every post matching `lookup` (relative to Post), children first """
+    def prefixed(prefix):
+        return {f'{prefix}__{key}': value for key, value in lookup.items()}
+
+    return [
+        ('post_hashtags', lambda: PostHashtag.objects.filter(**prefixed('post')), None),
+        ('post_mentions', lambda: Mention.objects.filter(**prefixed('post')), None),
+        ('post_likes', lambda: Post.likers.through.objects.filter(**prefixed('post')), None),
+        ('reply_likes', lambda: Reply.likers.through.objects.filter(**prefixed('reply__comment__post')), None),
+        ('reply_history', lambda: EditHistory.objects.filter(**prefixed('reply__comment__post')), None),
+        ('replies', lambda: Reply.objects.filter(**prefixed('comment__post')), None),
+        ('comment_likes', lambda: Comment.likers.through.objects.filter(**prefixed('comment__post')), None),
+        ('comment_history', lambda: EditHistory.objects.filter(**prefixed('comment__post')), None),
+        ('comments', lambda: Comment.objects.filter(**prefixed('post')), None),
+        ('post_history', lambda: EditHistory.objects.filter(**prefixed('post')), None),
+        ('post_files', lambda: PostFile.objects.filter(**prefixed('post')), 'file'),
+        ('post_impressions', lambda: PostImpressions.objects.filter(**prefixed('post')), None),
+        ('posts', lambda: Post.all_objects.filter(**lookup), None),
+    ]
+
+
+def _below_replies_by(user_id):
+    """ Replies nested under a reply by `user_id`, matched on the materialized path """
+    ancestors = Reply.objects.filter(author_id=user_id).filter(
+        StartsWith(OuterRef('path'), Concat('path', Value('.')))
+    )
+    return Reply.objects.filter(Exists(ancestors))
+
+
+def _user_steps(user_id):
+    follows = User.followers.through.objects
+    blocks = User.blocked_users.through.objects
+    return _posts({'author_id': user_id}) + [
+        # Content the user left on other people's posts, with any answers to it
+        ('nested_reply_mentions', lambda: Mention.objects.filter(reply__in=_below_replies_by(user_id)), None),
+        ('comment_reply_mentions', lambda: Mention.objects.filter(reply__comment__author_id=user_id), None),
+        ('mentions_made', lambda: Mention.objects.filter(author_id=user_id), None),
+        ('mentions_received', lambda: Mention.objects.filter(user_id=user_id), None),
+        ('nested_reply_likes', lambda: Reply.likers.through.objects.filter(reply__in=_below_replies_by(user_id)), None),
+        ('nested_reply_history', lambda: EditHistory.objects.filter(reply__in=_below_replies_by(user_id)), None),
+        ('nested_replies', lambda: _below_replies_by(user_id), None),
+        ('own_reply_likes', lambda: Reply.likers.through.objects.filter(reply__author_id=user_id), None),
+        ('comment_reply_likes', lambda: Reply.likers.through.objects.filter(reply__comment__author_id=user_id), None),
+        ('own_reply_history', lambda: EditHistory.objects.filter(reply__author_id=user_id), None),
+        ('comment_reply_history', lambda: EditHistory.objects.filter(reply__comment__author_id=user_id), None),
+        ('comment_replies', lambda: Reply.objects.filter(comment__author_id=user_id), None),
+        ('own_replies', lambda: Reply.objects.filter(author_id=user_id), None),
+        ('own_comment_likes', lambda: Comment.likers.through.objects.filter(comment__author_id=user_id), None),
+        ('own_comment_history', lambda: EditHistory.objects.filter(comment__author_id=user_id), None),
+        ('own_comments', lambda: Comment.objects.filter(author_id=user_id), None),
+        # Likes, follows, blocks and suggestions pointing either way
+        ('liked_posts', lambda: Post.likers.through.objects.filter(user_id=user_id), None),
+        ('liked_comments', lambda: Comment.likers.through.objects.filter(user_id=user_id), None),
+        ('liked_replies', lambda: Reply.likers.through.objects.filter(user_id=user_id), None),
+        ('follow_rows_from', lambda: follows.filter(from_user_id=user_id), None),
+        ('follow_rows_to', lambda: follows.filter(to_user_id=user_id), None),
+        ('block_rows_from', lambda: blocks.filter(from_user_id=user_id), None),
+        ('block_rows_to', lambda: blocks.filter(to_user_id=user_id), None),
+        ('suggestions', lambda: SuggestedUser.objects.filter(user_id=user_id), None),
+        ('suggested_to', lambda: SuggestedUser.objects.filter(suggested_id=user_id), None),
+        ('exports', lambda: DataExport.objects.filter(user_id=user_id), 'archive'),
+    ]
+
+
+def purge_steps(job):
+    if job.kind == PurgeJob.Kind.USER:
+        return _user_steps(job.target_id)
+    return _posts({'id': job.target_id})
+
+
+def _delete_ids(model, ids):
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk = connection.ops.quote_name(model._meta.pk.column)
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {pk} IN ({placeholders})", ids)
+        return cursor.rowcount
+
+
+def _delete_files(model, field_name, names):
+    storage = model._meta.get_field(field_name).storage
+    for name in names:
+        if not name:
+            continue
+        try:
+            storage.delete(name)
+        except OSError:
+            logger.warning("Could not delete purged file %s", name)
+
+
+def _purge_batch(job, queryset, file_field, batch_size):
+    """
+    Delete the next batch of rows below `job.last_id` (0 meaning the start).
+    Going from the highest id down removes replies to replies before the
+    rows they answer. Returns False once the step has nothing left.
+    """
+    fields = ('pk', file_field) if file_field else ('pk',)
+    if job.last_id:
+        queryset = queryset.filter(pk__lt=job.last_id)
+    rows = list(queryset.order_by('-pk').values_list(*fields)[:batch_size])
+    if not rows:
+        return False
+
+    ids = [row[0] for row in rows]
+    with transaction.atomic():
+        deleted = _delete_ids(queryset.model, ids)
+        job.last_id = ids[-1]
+        job.deleted_rows += deleted
+        job.save(update_fields=['last_id', 'deleted_rows', 'updated_at'])
+
+    # Files go only once their rows are gone for good
+    if file_field:
+        _delete_files(queryset.model, file_field, [row[1] for row in rows])
+    return True
+
+
+def _purge_root(job):
+    """ Remove the soft-deleted row itself once its descendants are gone """
+    if job.kind == PurgeJob.Kind.USER:
+        user = User.all_objects.filter(id=job.target_id).first()
+        if user is None:
+            return
+        pictures = [user.profile_picture.name] + rendition_names(user)
+        # Only small leftovers (tokens, admin log entries) remain for the collector
+        user.delete()
+        _delete_files(User, 'profile_picture', pictures)
+    else:
+        Post.all_objects.filter(id=job.target_id).delete()
+
+
+def run_purge_job(job_id, batch_size=None):
+    """
+    Run (or resume) a purge job until it is done. Every batch commits its own
+    progress, so an interrupted job picks up where it stopped.
+    """
+    batch_size = batch_size or getattr(settings, 'PURGE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    job = PurgeJob.objects.get(id=job_id)
+    if job.status == PurgeJob.Status.DONE:
+        return job
+
+    job.status = PurgeJob.Status.RUNNING
+    job.save(update_fields=['status', 'updated_at'])
+    try:
+        steps = purge_steps(job)
+        names = [name for name, _, _ in steps]
+        # Steps are found by name, so a job saved before new steps were
+        # inserted resumes on the right one. An unknown name starts over,
+        # which only repeats deletes that find nothing left.
+        start = names.index(job.step) if job.step in names else 0
+        for name, queryset, file_field in steps[start:]:
+            if job.step != name:
+                job.step, job.last_id = name, 0
+                job.save(update_fields=['step', 'last_id', 'updated_at'])
+            while _purge_batch(job, queryset(), file_field, batch_size):
+                pass
+
+        with transaction.atomic():
+            _purge_root(job)
+            job.status = PurgeJob.Status.DONE
+            job.save(update_fields=['status', 'updated_at'])
+    except Exception as e:
+        logger.exception("Purge job %s failed", job.id)
+        job.status = PurgeJob.Status.FAILED
+        job.error = str(e)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+    return job
+
+
+def _run_in_background(job_id):
+    try:
+        run_purge_job(job_id)
+    finally:
+        connections.close_all()
+
+
+def _submit(job_id):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='purge')
+    _executor.submit(_run_in_background, job_id)
+
+
+def soft_delete(obj):
+    """
+    Hide a user (with all their posts) or a post right away and schedule the
+    purge of everything below it once the transaction commits.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        if isinstance(obj, User):
+            unindex_posts(Post.objects.filter(author_id=obj.pk))
+            User.all_objects.filter(pk=obj.pk).update(deleted_at=now, is_active=False)
+            Post.all_objects.filter(author_id=obj.pk, deleted_at__isnull=True).update(deleted_at=now)
+            record_user_deleted(obj)
+            invalidate_user(obj)
+            forget_user(obj.pk)
+            kind = PurgeJob.Kind.USER
+        else:
+            unindex_posts(Post.objects.filter(pk=obj.pk))
+            Post.all_objects.filter(pk=obj.pk).update(deleted_at=now)
+            record_post_deleted(obj)
+            invalidate_post(obj.pk)
+            kind = PurgeJob.Kind.POST
+        obj.deleted_at = now
+
+        job = PurgeJob.objects.create(kind=kind, target_id=obj.pk)
+        transaction.on_commit(lambda: _submit(job.id))
+    return job
+
+
+def delete_content(obj):
+    """
+    What an author's delete of a post, comment or reply does, over REST and
+    GraphQL alike: a post is soft-deleted and its subtree purged in the
+    background, while comments and replies are deleted inline.
+    """
+    if isinstance(obj, Post):
+        soft_delete(obj)
+    else:
+        obj.delete()
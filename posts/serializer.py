@@ -1,45 +1,93 @@
 from .models import *
-from users.serializer import UserSerializer
+from users.serializer import SparseFieldsMixin, UserCardSerializer, absolute_media_url, requested_fields
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied
+from .threads import MAX_REPLY_DEPTH
+from .tags import index_content
+from helpers import events
 
-class BaseSerializer(serializers.ModelSerializer):
+class BaseSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     def create(self, validated_data):
         validated_data['author'] = self.context['request'].user
-        return super().create(validated_data)
+        instance = super().create(validated_data)
+        index_content(instance)
+        events.record(self.Meta.model._meta.model_name, instance.author_id, instance.id)
+        return instance
     
     def update(self, instance, validated_data):
         # Ensure the logged-in user is the author before updating the post
-        if instance.author != self.context['request'].user:
+        if instance.author_id != self.context['request'].user.id:
             raise PermissionDenied("You cannot edit other users' replies")
 
+        # A row cannot move to another thread once its path is set
+        for name in getattr(self.Meta, 'immutable_fields', ()):
+            validated_data.pop(name, None)
+
         # Proceed with the update if the author matches the logged-in user
         instance = super().update(instance, validated_data)
+        index_content(instance)
         return instance
     
 
+class VisibleRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    A related post, comment or reply the requesting user may see; anything
+    else is reported as not existing. `post` is the lookup from the row to
+    its post, whose visibility is checked too.
+    """
+    def __init__(self, post=None, **kwargs):
+        self.post_lookup = post
+        super().__init__(**kwargs)
+
+    def get_queryset(self):
+        user = self.context['request'].user
+        queryset = super().get_queryset().visible_to(user)
+        if self.post_lookup is not None:
+            queryset = queryset.filter(**{f'{self.post_lookup}__in': Post.objects.visible_to(user)})
+        return queryset
+
+
 class PostSerializer(BaseSerializer):
-    author = UserSerializer(read_only=True)
+    author = UserCardSerializer(read_only=True)
 
     class Meta:
         model = Post
-        fields = ['id', 'content', 'author', 'post_date', 'edited']
+        fields = ['id', 'content', 'author', 'post_date', 'edited', 'edited_at', 'version']
+        read_only_fields = ['edited', 'edited_at', 'version']
 
 class CommentSerializer(BaseSerializer):
-    author = UserSerializer(read_only=True)
-    post = serializers.PrimaryKeyRelatedField(queryset=Post.objects.all())
+    author = UserCardSerializer(read_only=True)
+    post = VisibleRelatedField(queryset=Post.objects.all())
 
     class Meta:
         model = Comment
-        fields = ['id', 'content', 'author', 'post', 'comment_date', 'edited']
+        fields = ['id', 'content', 'author', 'post', 'comment_date', 'edited', 'edited_at', 'version']
+        read_only_fields = ['edited', 'edited_at', 'version']
+        immutable_fields = ['post']
 
 class ReplySerializer(BaseSerializer):
-    author = UserSerializer(read_only=True)
-    comment = serializers.PrimaryKeyRelatedField(queryset=Comment.objects.all())
+    author = UserCardSerializer(read_only=True)
+    comment = VisibleRelatedField(queryset=Comment.objects.all(), post='post', required=False)
+    parent = VisibleRelatedField(queryset=Reply.objects.all(), post='comment__post', required=False, allow_null=True)
 
     class Meta:
         model = Reply
-        fields = ['id', 'content', 'author', 'comment', 'reply_date', 'edited']
+        fields = ['id', 'content', 'author', 'comment', 'parent', 'depth', 'reply_date', 'edited', 'edited_at', 'version']
+        read_only_fields = ['depth', 'edited', 'edited_at', 'version']
+        immutable_fields = ['comment', 'parent']
+
+    def validate(self, attrs):
+        parent = attrs.get('parent')
+        if parent is not None:
+            # Answering a reply implies its comment
+            attrs.setdefault('comment', parent.comment)
+            if attrs['comment'] != parent.comment:
+                raise serializers.ValidationError({'parent': "The parent reply belongs to another comment"})
+            if parent.depth >= MAX_REPLY_DEPTH:
+                raise serializers.ValidationError({'parent': "This thread cannot be nested any deeper"})
+        elif self.instance is None and attrs.get('comment') is None:
+            raise serializers.ValidationError({'comment': "This field is required."})
+        return attrs
 
 class PostFileSerializer(serializers.ModelSerializer):
     post = serializers.PrimaryKeyRelatedField(queryset=Post.objects.all())
@@ -47,3 +95,31 @@ class PostFileSerializer(serializers.ModelSerializer):
     class Meta:
         model = PostFile
         fields = ['id', 'post', 'file']
+
+
+_datetime = serializers.DateTimeField()
+
+
+def post_rows(queryset, request=None):
+    """
+    Fast read path: the PostSerializer representation built from a single
+    .values() query joined to the author, without model instances.
+    """
+    requested = requested_fields(request)
+    fields = [name for name in PostSerializer.Meta.fields if requested is None or name in requested]
+    columns = [name for name in fields if name != 'author']
+    if 'author' in fields:
+        columns += ['author_id', 'author__username', 'author__profile_picture']
+    storage = User._meta.get_field('profile_picture').storage
+
+    for row in queryset.values(*columns):
+        for name in ('post_date', 'edited_at'):
+            if name in row:
+                row[name] = _datetime.to_representation(row[name])
+        if 'author' in fields:
+            row['author'] = {
+                'id': row.pop('author_id'),
+                'username': row.pop('author__username'),
+                'profile_image_url': absolute_media_url(request, row.pop('author__profile_picture'), storage),
+            }
+        yield {name: row[name] for name in fields}
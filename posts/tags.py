@@ -0,0 +1,123 @@
+import re
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from users.models import User
+from .models import Post, Comment, Hashtag, PostHashtag, Mention
+
+HASHTAG_RE = re.compile(r'(?<![\w#&])#(\w+)')
+# Same characters as Django usernames
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.@+-]+)')
+HASHTAG_MAX_LENGTH = Hashtag._meta.get_field('name').max_length
+DEFAULT_PAGE_SIZE = 20
+
+
+def normalize_hashtag(name):
+    return name.lstrip('#').casefold()
+
+
+def extract_hashtags(text):
+    """ Normalized hashtags of `text` in order of first use """
+    names = (normalize_hashtag(name) for name in HASHTAG_RE.findall(text or ''))
+    return list(dict.fromkeys(name for name in names if len(name) <= HASHTAG_MAX_LENGTH))
+
+
+def extract_mentions(text):
+    """ Mentioned usernames of `text` in order of first use """
+    # A trailing dot ends the sentence rather than the username
+    return list(dict.fromkeys(name.rstrip('.') for name in MENTION_RE.findall(text or '')))
+
+
+def _index_hashtags(post):
+    names = set(extract_hashtags(post.content))
+    current = dict(PostHashtag.objects.filter(post=post).values_list('hashtag__name', 'id'))
+    removed = set(current) - names
+    added = names - set(current)
+
+    if removed:
+        PostHashtag.objects.filter(id__in=[current[name] for name in removed]).delete()
+        Hashtag.objects.filter(name__in=removed).update(post_count=F('post_count') - 1)
+    if added:
+        Hashtag.objects.bulk_create([Hashtag(name=name) for name in added], ignore_conflicts=True)
+        hashtags = Hashtag.objects.filter(name__in=added)
+        PostHashtag.objects.bulk_create([PostHashtag(hashtag=hashtag, post=post) for hashtag in hashtags])
+        hashtags.update(post_count=F('post_count') + 1)
+
+
+def _mention_source(obj):
+    """ (post id, lookup of the mention rows written by `obj`) """
+    if isinstance(obj, Post):
+        return obj.id, {'post_id': obj.id, 'comment': None, 'reply': None}
+    if isinstance(obj, Comment):
+        return obj.post_id, {'comment_id': obj.id}
+    return obj.comment.post_id, {'reply_id': obj.id}
+
+
+def _index_mentions(obj):
+    post_id, lookup = _mention_source(obj)
+    user_ids = set(
+        User.objects.filter(username__in=extract_mentions(obj.content))
+        .exclude(id=obj.author_id)
+        .values_list('id', flat=True)
+    )
+    rows = Mention.objects.filter(**lookup)
+    rows.exclude(user_id__in=user_ids).delete()
+
+    fields = {key: value for key, value in lookup.items() if value is not None and key != 'post_id'}
+    new_ids = user_ids - set(rows.values_list('user_id', flat=True))
+    Mention.objects.bulk_create([
+        Mention(user_id=user_id, author_id=obj.author_id, post_id=post_id, **fields)
+        for user_id in sorted(new_ids)
+    ])
+
+
+def index_content(obj):
+    """
+    Bring the hashtag and mention rows of a post, comment or reply in line
+    with its content. Only the differences are written.
+    """
+    with transaction.atomic():
+        _index_mentions(obj)
+        if isinstance(obj, Post):
+            _index_hashtags(obj)
+
+
+def unindex_posts(posts):
+    """ Take the posts of the `posts` queryset out of the hashtag counts """
+    counts = (
+        PostHashtag.objects.filter(post__in=posts)
+        .values_list('hashtag_id')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    for hashtag_id, count in counts:
+        Hashtag.objects.filter(id=hashtag_id).update(post_count=F('post_count') - count)
+
+
+def posts_by_hashtag(name, viewer=None, first=DEFAULT_PAGE_SIZE, after=None):
+    """
+    Newest first page of the posts tagged `name` that `viewer` may see,
+    continuing below post id `after`. Walks the (hashtag, post) index.
+    """
+    hashtag = Hashtag.objects.filter(name=normalize_hashtag(name)).first()
+    if hashtag is None:
+        return Post.objects.none()
+    # One filter() call, so the cursor and the ordering use the same join
+    links = {'hashtag_links__hashtag_id': hashtag.id}
+    if after is not None:
+        links['hashtag_links__post_id__lt'] = after
+    return Post.objects.visible_to(viewer).filter(**links).order_by('-hashtag_links__post_id')[:first]
+
+
+def mentions_of(user, viewer=None, first=DEFAULT_PAGE_SIZE, after=None):
+    """
+    Newest first page of the mentions of `user` that `viewer` may see,
+    continuing below mention id `after`. Walks the (user, -id) index.
+    """
+    mentions = Mention.objects.visible_to(viewer).filter(
+        user_id=user.id, post__in=Post.objects.visible_to(viewer)
+    )
+    if after is not None:
+        mentions = mentions.filter(id__lt=after)
+    return mentions.select_related('post', 'comment', 'reply', 'author').order_by('-id')[:first]
@@ -1,9 +1,26 @@
 from rest_framework.test import APITestCase
 from rest_framework import status
+from django.db import connection
 from django.urls import reverse
-from .models import Post, Comment, Reply, PostFile
+from unittest import mock
+from io import StringIO
+from django.core.management import call_command
+import json
+from .models import Post, Comment, Reply, PostFile, PurgeJob, Hashtag, Mention, EditHistory, PostImpressions
+from . import purge
+from .purge import run_purge_job, soft_delete
+from .serializer import PostSerializer
+from .threads import load_thread
+from .dedup import reset_index
+from .impressions import ImpressionBuffer
+from helpers.hyperloglog import HyperLogLog, relative_error
+from .tags import extract_hashtags, extract_mentions, index_content, posts_by_hashtag, mentions_of
 from users.models import User
+from helpers.imagehash import MultiIndex, hamming, to_signed
+from helpers.placeholders import blurhash, dominant_color
 from helpers.util import *
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
 
 class PostViewTest(APITestCase):
 
@@ -30,6 +47,29 @@ class PostViewTest(APITestCase):
         self.assertEqual(response.data['content'], 'New Post')
         self.assertEqual(response.data['author']['id'], self.user1.id)
 
+    def test_embedded_author_is_a_user_card(self):
+        response = self.client.post(reverse('post-details'), {'content': 'New Post'}, format='multipart')
+
+        self.assertEqual(set(response.data['author']), {'id', 'username', 'profile_image_url'})
+
+    def test_get_post_matches_serializer_output(self):
+        url = reverse('post-details', kwargs={'id': self.post.id})
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        request = response.wsgi_request
+        expected = PostSerializer(self.post, context={'request': request}).data
+        self.assertEqual(response.json(), json.loads(json.dumps(expected)))
+
+    def test_sparse_fieldsets(self):
+        response = self.client.get(reverse('post-details', kwargs={'id': self.post.id}), {'fields': 'id,content'})
+        self.assertEqual(response.json(), {'id': self.post.id, 'content': 'Test Post'})
+
+        response = self.client.put(
+            reverse('post-details', kwargs={'id': self.post.id}) + '?fields=content', {'content': 'Edited'}, format='json'
+        )
+        self.assertEqual(response.data, {'content': 'Edited'})
+
     def test_update_post_as_author(self):
         url = reverse('post-details', kwargs={'id': self.post.id})
         data = {
@@ -50,6 +90,48 @@ class PostViewTest(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    def test_edit_flags_post_and_keeps_history(self):
+        url = reverse('post-details', kwargs={'id': self.post.id})
+        response = self.client.put(url, {'content': 'Edited'}, format='json')
+
+        self.assertEqual(response['ETag'], 'W/"2"')
+        self.assertEqual(response.data['version'], 2)
+        self.assertTrue(response.data['edited'])
+        self.post.refresh_from_db()
+        self.assertTrue(self.post.edited)
+        self.assertIsNotNone(self.post.edited_at)
+        self.assertEqual(list(self.post.history.values_list('version', 'content')), [(1, 'Test Post')])
+
+    def test_edit_with_stale_if_match_is_rejected(self):
+        url = reverse('post-details', kwargs={'id': self.post.id})
+        etag = self.client.get(url)['ETag']
+        self.client.put(url, {'content': 'First'}, format='json', HTTP_IF_MATCH=etag)
+
+        response = self.client.put(url, {'content': 'Lost update'}, format='json', HTTP_IF_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.content, self.post.version), ('First', 2))
+        self.assertEqual(EditHistory.objects.count(), 1)
+
+    def test_conditional_get(self):
+        url = reverse('post-details', kwargs={'id': self.post.id})
+        first = self.client.get(url)
+
+        with self.assertNumQueries(2):
+            # One indexed lookup after the authentication query
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+        self.user1.bio = "Renamed"
+        self.user1.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, status.HTTP_200_OK)
+
+    def test_edit_missing_post(self):
+        response = self.client.put(reverse('post-details', kwargs={'id': 999999}), {'content': 'x'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_delete_post_as_author(self):
         url = reverse('post-details', kwargs={'id': self.post.id})
         response = self.client.delete(url)
@@ -169,6 +251,25 @@ class ReplyViewTest(APITestCase):
         self.assertEqual(response.data['content'], 'New Reply')
         self.assertEqual(response.data['author']['id'], self.user1.id)
 
+    def test_reply_to_a_reply(self):
+        url = reverse('reply-details')
+        response = self.client.post(url, {'content': 'Nested', 'parent': self.reply.id}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['comment'], self.comment.id)
+        self.assertEqual(response.data['depth'], 2)
+        nested = Reply.objects.get(id=response.data['id'])
+        self.assertEqual(nested.path, f"{self.reply.path}.{nested.id:010d}")
+
+    def test_reply_parent_must_share_the_comment(self):
+        other_comment = Comment.objects.create(content="Other", author=self.user1, post=self.post)
+        url = reverse('reply-details')
+        data = {'content': 'Nested', 'comment': other_comment.id, 'parent': self.reply.id}
+        response = self.client.post(url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('parent', response.data)
+
     def test_update_reply_as_author(self):
         url = reverse('reply-details', kwargs={'id': self.reply.id})
         data = {
@@ -250,6 +351,18 @@ class LikeTestCase(APITestCase):
         self.assertEqual(self.post.likers.count(), 1)
         self.assertEqual(response2.status_code, status.HTTP_201_CREATED)
 
+    def test_hidden_content_cannot_be_liked(self):
+        self.user2.blocked_users.add(self.user1)
+        response = self.client.post(reverse('reply-like', kwargs={'id': self.reply.id}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.user2.blocked_users.remove(self.user1)
+        self.user2.private_account = True
+        self.user2.save()
+        response = self.client.post(reverse('post-like', kwargs={'id': self.post.id}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(self.post.likers.exists() or self.reply.likers.exists())
+
     def test_unlike_post(self):
         # add user1 to post likers
         self.post.likers.add(self.user1)
@@ -346,6 +459,26 @@ class PostFileTestCase(APITestCase):
         self.post.refresh_from_db()
 
         self.assertEqual(self.post.files.count(), 1)
+        post_file = self.post.files.get()
+        self.assertEqual(len(post_file.blurhash), 28)
+        self.assertEqual(post_file.dominant_color, '#fe0000')
+
+    def test_placeholder_of_video_is_empty(self):
+        video = SimpleUploadedFile('clip.mp4', b'\x00\x00\x00\x18ftypmp42', content_type='video/mp4')
+        post_file = PostFile.objects.create(post=self.post, file=video)
+
+        self.assertEqual((post_file.blurhash, post_file.dominant_color), ('', ''))
+        self.assertEqual(post_file.file.read(), b'\x00\x00\x00\x18ftypmp42')
+
+    def test_blurhash_matches_the_reference_encoding(self):
+        # Red with a blue band on the right, checked against a per-pixel implementation
+        pixels = np.zeros((6, 8, 3), dtype=np.uint8)
+        pixels[:] = (255, 0, 0)
+        pixels[:, 6:] = (0, 0, 255)
+
+        self.assertEqual(blurhash(pixels), 'L~P*de|UJq$9,cwuWro2fQfQfQfQ')
+        self.assertEqual(blurhash(pixels, (1, 1)), '00P*de')
+        self.assertEqual(dominant_color(pixels), '#ff0000')
 
     def test_remove_post_file(self):
         post_file = PostFile.objects.create(post=self.post, file=self.image)
@@ -358,3 +491,461 @@ class PostFileTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertNotIn(post_file, self.post.files.all())
 
+
+
+class VisibilityTest(APITestCase):
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username="viewer", password="password")
+        self.public = User.objects.create_user(username="public", password="password")
+        self.private = User.objects.create_user(username="private", password="password", private_account=True)
+        self.blocker = User.objects.create_user(username="blocker", password="password")
+
+        self.public_post = Post.objects.create(content="public", author=self.public)
+        self.private_post = Post.objects.create(content="private", author=self.private)
+        self.blocker_post = Post.objects.create(content="blocker", author=self.blocker)
+        self.own_post = Post.objects.create(content="own", author=self.viewer)
+        self.blocker.blocked_users.add(self.viewer)
+
+    def visible_posts(self, viewer):
+        return set(Post.objects.visible_to(viewer).values_list('content', flat=True))
+
+    def test_private_and_blocked_posts_are_hidden(self):
+        self.assertEqual(self.visible_posts(self.viewer), {"public", "own"})
+
+    def test_followers_see_private_posts(self):
+        self.private.followers.add(self.viewer)
+
+        self.assertEqual(self.visible_posts(self.viewer), {"public", "private", "own"})
+
+    def test_blocks_apply_in_both_directions(self):
+        self.viewer.blocked_users.add(self.public)
+
+        self.assertEqual(self.visible_posts(self.viewer), {"own"})
+        self.assertNotIn(self.viewer, User.objects.visible_to(self.public))
+        self.assertNotIn(self.viewer, User.objects.visible_to(self.blocker))
+
+    def test_anonymous_viewer_only_sees_public_accounts(self):
+        self.assertEqual(self.visible_posts(None), {"public", "blocker", "own"})
+
+    def test_visibility_subqueries_are_index_backed(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("query plan assertions are written for SQLite")
+
+        users = User.objects.bulk_create(User(username=f"user{i}") for i in range(300))
+        User.followers.through.objects.bulk_create(
+            User.followers.through(from_user_id=u.id, to_user_id=users[(i + 1) % 300].id) for i, u in enumerate(users)
+        )
+        User.blocked_users.through.objects.bulk_create(
+            User.blocked_users.through(from_user_id=u.id, to_user_id=users[(i + 7) % 300].id) for i, u in enumerate(users)
+        )
+        Post.objects.bulk_create(Post(content="bulk", author=u) for u in users)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        for queryset in (Post.objects.visible_to(self.viewer), User.objects.visible_to(self.viewer)):
+            plan = queryset.explain()
+            for table in (User.followers.through._meta.db_table, User.blocked_users.through._meta.db_table):
+                self.assertNotRegex(plan, rf"SCAN {table}\b")
+            self.assertNotRegex(plan, r"SCAN U0\b")
+            self.assertIn("USING COVERING INDEX users_user_blocked_users", plan)
+
+
+class PurgeTest(APITestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="password")
+        self.other = User.objects.create_user(username="other", password="password")
+
+        self.post = Post.objects.create(content="Doomed", author=self.author)
+        self.post.likers.add(self.other)
+        self.post_file = PostFile.objects.create(post=self.post, file=create_dummy_image())
+        for i in range(3):
+            comment = Comment.objects.create(content=f"Comment {i}", author=self.other, post=self.post)
+            comment.likers.add(self.author)
+            reply = Reply.objects.create(content=f"Reply {i}", author=self.author, comment=comment)
+            reply.likers.add(self.other)
+
+        self.other_post = Post.objects.create(content="Survivor", author=self.other)
+        self.other_comment = Comment.objects.create(content="On other post", author=self.author, post=self.other_post)
+        self.other_post.likers.add(self.author)
+        self.other.followers.add(self.author)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.author))
+
+    def test_delete_post_hides_it_and_schedules_purge(self):
+        response = self.client.delete(reverse('post-details', kwargs={'id': self.post.id}))
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Post.objects.filter(id=self.post.id).exists())
+        self.assertTrue(Post.all_objects.filter(id=self.post.id).exists())
+        job = PurgeJob.objects.get(kind=PurgeJob.Kind.POST, target_id=self.post.id)
+        self.assertEqual(job.status, PurgeJob.Status.PENDING)
+
+    def test_post_purge_removes_subtree_and_files(self):
+        file_name = self.post_file.file.name
+        job = soft_delete(self.post)
+
+        job = run_purge_job(job.id, batch_size=2)
+
+        self.assertEqual(job.status, PurgeJob.Status.DONE)
+        self.assertFalse(Post.all_objects.filter(id=self.post.id).exists())
+        self.assertFalse(Comment.objects.filter(post_id=self.post.id).exists())
+        self.assertFalse(Reply.objects.filter(comment__post_id=self.post.id).exists())
+        self.assertFalse(PostFile.objects.filter(post_id=self.post.id).exists())
+        self.assertFalse(self.post_file.file.storage.exists(file_name))
+        self.assertTrue(Post.objects.filter(id=self.other_post.id).exists())
+
+    def test_user_purge_removes_everything_they_touched(self):
+        response = self.client.delete(reverse('user-details', kwargs={'id': self.author.id}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(User.objects.filter(id=self.author.id).exists())
+        self.assertFalse(Post.objects.filter(author_id=self.author.id).exists())
+
+        job = PurgeJob.objects.get(kind=PurgeJob.Kind.USER, target_id=self.author.id)
+        job = run_purge_job(job.id, batch_size=2)
+
+        self.assertEqual(job.status, PurgeJob.Status.DONE)
+        self.assertFalse(User.all_objects.filter(id=self.author.id).exists())
+        self.assertFalse(Comment.objects.filter(author_id=self.author.id).exists())
+        self.assertFalse(self.other_post.likers.exists())
+        self.assertFalse(self.other.followers.exists())
+        self.assertTrue(Post.objects.filter(id=self.other_post.id).exists())
+
+    def test_user_purge_removes_answers_to_their_replies(self):
+        comment = Comment.objects.create(content="Not mine", author=self.other, post=self.other_post)
+        own_reply = Reply.objects.create(content="Mine", author=self.author, comment=comment)
+        answer = Reply.objects.create(content="Answer", author=self.other, comment=comment, parent=own_reply)
+        answer.likers.add(self.other)
+        job = soft_delete(self.author)
+
+        job = run_purge_job(job.id, batch_size=1)
+
+        self.assertEqual(job.status, PurgeJob.Status.DONE)
+        self.assertFalse(Reply.objects.filter(id=answer.id).exists())
+        self.assertTrue(Comment.objects.filter(id=comment.id).exists())
+
+    def test_interrupted_purge_resumes(self):
+        job = soft_delete(self.post)
+        calls = []
+
+        def fail_on_third_batch(model, ids):
+            calls.append(ids)
+            if len(calls) == 3:
+                raise RuntimeError("connection lost")
+            return real_delete_ids(model, ids)
+
+        real_delete_ids = purge._delete_ids
+        with mock.patch.object(purge, '_delete_ids', side_effect=fail_on_third_batch), \
+                self.assertLogs('posts.purge', level='ERROR'):
+            job = run_purge_job(job.id, batch_size=1)
+
+        self.assertEqual(job.status, PurgeJob.Status.FAILED)
+        self.assertGreater(job.deleted_rows, 0)
+        # The post's like went in the first batch, the reply likes follow
+        self.assertEqual(job.step, 'reply_likes')
+
+        job = run_purge_job(job.id, batch_size=1)
+        self.assertEqual(job.status, PurgeJob.Status.DONE)
+        self.assertFalse(Post.all_objects.filter(id=self.post.id).exists())
+
+    def test_job_at_an_unknown_step_starts_over(self):
+        # e.g. a step position saved before steps were keyed by name
+        job = soft_delete(self.post)
+        PurgeJob.objects.filter(id=job.id).update(step='3', last_id=1)
+
+        job = run_purge_job(job.id)
+        self.assertEqual((job.status, job.step), (PurgeJob.Status.DONE, 'posts'))
+        self.assertFalse(Reply.likers.through.objects.exists())
+        self.assertFalse(Post.all_objects.filter(id=self.post.id).exists())
+
+
+class ThreadTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.post = Post.objects.create(content="Thread", author=self.user)
+        self.first = Comment.objects.create(content="c1", author=self.user, post=self.post)
+        self.second = Comment.objects.create(content="c2", author=self.user, post=self.post)
+        self.third = Comment.objects.create(content="c3", author=self.user, post=self.post)
+
+        self.r1 = Reply.objects.create(content="r1", author=self.user, comment=self.first)
+        self.r1a = Reply.objects.create(content="r1a", author=self.user, comment=self.first, parent=self.r1)
+        self.r1a1 = Reply.objects.create(content="r1a1", author=self.user, comment=self.first, parent=self.r1a)
+        self.r2 = Reply.objects.create(content="r2", author=self.user, comment=self.second)
+        # Created last but must still come back under its own branch
+        self.r1b = Reply.objects.create(content="r1b", author=self.user, comment=self.first, parent=self.r1)
+        Reply.objects.create(content="r3", author=self.user, comment=self.third)
+
+        other_post = Post.objects.create(content="Other", author=self.user)
+        Comment.objects.create(content="elsewhere", author=self.user, post=other_post)
+
+    def flatten(self, nodes):
+        return [(node.content, node.depth, [c.content for c in node.children], node.collapsed_count)
+                for node in nodes] + [entry for node in nodes for entry in self.flatten(node.children)]
+
+    def test_full_thread_loads_in_tree_order(self):
+        with self.assertNumQueries(3):
+            roots = load_thread(self.post)
+
+        self.assertEqual([node.content for node in roots], ["c1", "c2", "c3"])
+        self.assertEqual([c.content for c in roots[0].children[0].children], ["r1a", "r1b"])
+        self.assertEqual(roots[0].children[0].children[0].children[0].content, "r1a1")
+        self.assertEqual(roots[0].author, self.user)
+
+    def test_first_and_depth_collapse_branches(self):
+        with self.assertNumQueries(4):
+            roots = load_thread(self.post, depth=1, first=2)
+
+        self.assertEqual(self.flatten(roots), [
+            ("c1", 0, ["r1"], 0),
+            ("c2", 0, ["r2"], 0),
+            ("r1", 1, [], 3),
+            ("r2", 1, [], 0),
+        ])
+
+    def test_blocked_authors_hide_their_subtree(self):
+        blocked = User.objects.create_user(username="blocked", password="password")
+        hidden = Reply.objects.create(content="hidden", author=blocked, comment=self.second)
+        Reply.objects.create(content="under hidden", author=self.user, comment=self.second, parent=hidden)
+        self.user.blocked_users.add(blocked)
+
+        roots = load_thread(self.post, viewer=self.user)
+
+        self.assertEqual([c.content for c in roots[1].children], ["r2"])
+
+
+class HashtagMentionTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.friend = User.objects.create_user(username="friend.name", password="password")
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.user))
+
+    def counts(self):
+        return dict(Hashtag.objects.values_list('name', 'post_count'))
+
+    def test_extraction(self):
+        self.assertEqual(extract_hashtags("#Django and #django, not a#b or &#39; #Ünïcode"), ['django', 'ünïcode'])
+        self.assertEqual(extract_mentions("hi @friend.name. and @user, not me@example.com"), ['friend.name', 'user'])
+
+    def test_post_writes_maintain_the_index(self):
+        response = self.client.post(reverse('post-details'), {'content': '#one #Two for @friend.name'}, format='multipart')
+        post_id = response.data['id']
+        self.assertEqual(self.counts(), {'one': 1, 'two': 1})
+        self.assertEqual(list(Mention.objects.values_list('user__username', 'post_id')), [('friend.name', post_id)])
+
+        self.client.put(reverse('post-details', kwargs={'id': post_id}), {'content': '#two #three'}, format='multipart')
+        self.assertEqual(self.counts(), {'one': 0, 'two': 1, 'three': 1})
+        self.assertFalse(Mention.objects.exists())
+
+        self.client.delete(reverse('post-details', kwargs={'id': post_id}))
+        self.assertEqual(self.counts(), {'one': 0, 'two': 0, 'three': 0})
+
+    def test_keyset_pages(self):
+        posts = [Post.objects.create(author=self.user, content=f"#tag {i}") for i in range(5)]
+        for post in posts:
+            index_content(post)
+
+        first_page = list(posts_by_hashtag('#TAG', first=2))
+        self.assertEqual(first_page, posts[:2:-1][:2])
+        self.assertEqual(list(posts_by_hashtag('tag', first=2, after=first_page[-1].id)), [posts[2], posts[1]])
+
+    def test_keyset_pages_of_multi_tag_posts(self):
+        posts = [Post.objects.create(author=self.user, content=content) for content in ("#a #b #c", "#a", "#a #b")]
+        for post in posts:
+            index_content(post)
+
+        self.assertEqual(list(posts_by_hashtag('a')), posts[::-1])
+        self.assertEqual(list(posts_by_hashtag('a', after=posts[2].id + 1)), posts[::-1])
+        self.assertEqual(list(posts_by_hashtag('a', after=posts[2].id)), [posts[1], posts[0]])
+
+    def test_mentions_follow_post_visibility(self):
+        self.user.private_account = True
+        self.user.save()
+        post = Post.objects.create(author=self.user, content="post")
+        comment = Comment.objects.create(author=self.user, post=post, content="hey @friend.name")
+        index_content(comment)
+
+        self.assertEqual(list(mentions_of(self.friend, self.user)), [comment.mentions.get()])
+        self.assertEqual(list(mentions_of(self.friend, self.friend)), [])
+
+    def test_user_purge_removes_their_mentions(self):
+        post = Post.objects.create(author=self.friend, content="post")
+        comment = Comment.objects.create(author=self.friend, post=post, content="comment")
+        reply = Reply.objects.create(author=self.friend, comment=comment, content="@user hi")
+        index_content(reply)
+        index_content(Reply.objects.create(author=self.user, comment=comment, content="@friend.name hi"))
+
+        job = run_purge_job(soft_delete(self.user).id, batch_size=1)
+
+        self.assertEqual(job.status, PurgeJob.Status.DONE)
+        self.assertFalse(Mention.objects.exists())
+        self.assertTrue(Reply.objects.filter(id=reply.id).exists())
+
+
+def pattern_image(seed, size=(320, 240), quality=90, name='pattern.jpg'):
+    """ A JPEG of random coloured blocks, distinct per seed """
+    from PIL import Image
+    import io
+
+    blocks = np.random.default_rng(seed).integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    image = Image.fromarray(blocks).resize(size, Image.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class DuplicateImageTest(APITestCase):
+    def setUp(self):
+        reset_index()
+        self.addCleanup(reset_index)
+        self.spammer = User.objects.create_user(username="spammer", password="password")
+        self.author = User.objects.create_user(username="author", password="password")
+        self.staff = User.objects.create_user(username="staff", password="password", is_staff=True)
+        self.original = PostFile.objects.create(
+            post=Post.objects.create(content="original", author=self.author), file=pattern_image(1),
+        )
+        self.spam_post = Post.objects.create(content="spam", author=self.spammer)
+
+    def test_multi_index_matches_a_linear_scan(self):
+        rng = np.random.default_rng(0)
+        values = [int(v) for v in rng.integers(0, 2 ** 63, 2000, dtype=np.int64)] + [2 ** 64 - 1]
+        index = MultiIndex((to_signed(v), i) for i, v in enumerate(values[:1500]))
+        for i, v in enumerate(values[1500:], 1500):
+            index.add(v, i)
+
+        for query in values[::97]:
+            query ^= 0b1011
+            for radius in (3, 5, 9):
+                expected = sorted((hamming(query, v), i) for i, v in enumerate(values) if hamming(query, v) <= radius)
+                self.assertEqual(sorted(index.search(query, radius)), expected)
+
+    def test_hash_survives_resizing_and_recompression(self):
+        copy = PostFile.objects.create(post=self.spam_post, file=pattern_image(1, size=(200, 150), quality=40))
+        other = PostFile.objects.create(post=self.spam_post, file=pattern_image(2))
+
+        self.assertLessEqual(hamming(self.original.dhash, copy.dhash), 4)
+        self.assertGreater(hamming(self.original.dhash, other.dhash), 12)
+
+    def test_upload_check_rejects_copies_of_other_authors(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.spammer))
+        url = reverse('post-file')
+        with self.settings(REJECT_DUPLICATE_IMAGES=True):
+            response = self.client.post(url, {'file': pattern_image(1, quality=60), 'post': self.spam_post.id}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+            response = self.client.post(url, {'file': pattern_image(3), 'post': self.spam_post.id}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            # The spammer's own image again is not a copy of someone else's
+            response = self.client.post(url, {'file': pattern_image(3), 'post': self.spam_post.id}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(self.spam_post.files.count(), 2)
+
+    def test_admin_query(self):
+        copy = PostFile.objects.create(post=self.spam_post, file=pattern_image(1, size=(256, 192)))
+        PostFile.objects.create(post=self.spam_post, file=pattern_image(2))
+        url = reverse('post-file-duplicates', kwargs={'id': self.original.id})
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.author))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.staff))
+        response = self.client.get(url)
+        self.assertEqual([(match['id'], match['author']) for match in response.data], [(copy.id, self.spammer.id)])
+        self.assertEqual(self.client.get(url, {'distance': 99}).status_code, status.HTTP_400_BAD_REQUEST)
+
+        with self.captureOnCommitCallbacks():
+            soft_delete(self.spam_post)
+        self.assertEqual(self.client.get(url).data, [])
+
+    def test_backfill_command(self):
+        PostFile.objects.filter(id=self.original.id).update(dhash=None, blurhash='', dominant_color='')
+        out = StringIO()
+        call_command('hash_post_files', stdout=out)
+
+        self.assertIn("hashed 1 files", out.getvalue())
+        self.original.refresh_from_db()
+        self.assertIsNotNone(self.original.dhash)
+        self.assertEqual(len(self.original.blurhash), 28)
+
+
+class ImpressionsTest(APITestCase):
+    def setUp(self):
+        # A private buffer whose thread never flushes on its own during the test
+        self.buffer = ImpressionBuffer(flush_interval=3600)
+        patcher = mock.patch('posts.impressions._buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.author = User.objects.create_user(username="author", password="password")
+        self.viewers = [User.objects.create_user(username=f"viewer{i}", password="password") for i in range(3)]
+        self.post = Post.objects.create(content="Seen", author=self.author)
+
+    def view(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(user))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse('post-details', kwargs={'id': self.post.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_estimates_stay_within_the_error_bound(self):
+        # Three standard errors: a synthetic stream lands outside about once in 370 runs
+        bound = 3 * relative_error()
+        for distinct in (1, 40, 1000, 10_000, 60_000):
+            sketch = HyperLogLog()
+            for i in range(distinct):
+                sketch.add(f'viewer-{distinct}-{i}')
+                # Repeat views must not count again
+                sketch.add(f'viewer-{distinct}-{i}')
+            self.assertLessEqual(abs(sketch.count() - distinct), max(bound * distinct, 1), distinct)
+
+    def test_merge_estimates_the_union(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(30_000):
+            first.add(i)
+        for i in range(20_000, 50_000):
+            second.add(i)
+
+        merged = HyperLogLog.from_bytes(first.to_bytes()).merge(second)
+        self.assertLessEqual(abs(merged.count() - 50_000), 3 * relative_error() * 50_000)
+        self.assertEqual(HyperLogLog.from_bytes(first.to_bytes()).registers, first.registers)
+        with self.assertRaises(ValueError):
+            first.merge(HyperLogLog(precision=10))
+
+    def test_views_are_flushed_to_the_post(self):
+        for user in (*self.viewers, self.viewers[0], self.author, self.author):
+            self.view(user)
+        self.assertEqual(self.buffer.pending_views(self.post.id), 6)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.impressions_count, 0)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.impressions_count, self.post.unique_viewers), (6, 4))
+
+        # A later flush merges into the stored sketch
+        self.view(self.viewers[1])
+        self.view(User.objects.create_user(username="late", password="password"))
+        self.buffer.flush()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.impressions_count, self.post.unique_viewers), (8, 5))
+        self.assertLess(len(PostImpressions.objects.get(post=self.post).sketch), 200)
+
+    def test_failed_flush_is_retried(self):
+        self.view(self.viewers[0])
+        with mock.patch('posts.impressions.write_impressions', side_effect=RuntimeError), \
+                self.assertLogs('posts.impressions', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.view(self.viewers[1])
+        self.buffer.flush()
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.impressions_count, self.post.unique_viewers), (2, 2))
+
+    def test_purge_removes_the_sketch(self):
+        self.view(self.viewers[0])
+        self.buffer.flush()
+        with self.captureOnCommitCallbacks():
+            job = soft_delete(self.post)
+        self.assertEqual(run_purge_job(job.id).status, PurgeJob.Status.DONE)
+        self.assertFalse(PostImpressions.objects.exists())
@@ -0,0 +1,96 @@
+from django.db.models import Count, F
+from django.db.models.functions import Substr
+
+from users.models import User
+from .models import Comment, Reply, PATH_SEGMENT_WIDTH, path_segment
+
+# Deepest reply nesting; keeps paths within the 255 character column
+MAX_REPLY_DEPTH = 20
+
+
+def subtree(path):
+    """ Lookup for every row strictly below `path`, as an index range on `path` """
+    # '/' is the character right after '.', so this is a plain range scan
+    return {'path__gt': path + '.', 'path__lt': path + '/'}
+
+
+def path_length(depth):
+    """ Length of a path at `depth` (0 for comments) """
+    return (PATH_SEGMENT_WIDTH + 1) * (depth + 2) - 1
+
+
+class ThreadNode:
+    """ A comment (depth 0) or reply in a loaded thread """
+
+    def __init__(self, kind, row):
+        self.kind = kind
+        self.id = row['id']
+        self.path = row['path']
+        self.depth = row.get('depth', 0)
+        self.content = row['content']
+        self.author_id = row['author_id']
+        self.date = row['date']
+        self.edited = row['edited']
+        self.author = None
+        self.children = []
+        self.collapsed_count = 0
+
+
+def load_thread(post, viewer=None, depth=None, first=None):
+    """
+    Load the comment tree of `post` as a list of top-level ThreadNodes in
+    chronological order.
+
+    `first` keeps only the first N comments and `depth` the first N levels
+    of replies below them; nodes with hidden replies report how many in
+    `collapsed_count`. Comments, replies, collapsed counts and authors are
+    each fetched with a single query, whatever the size of the thread.
+    """
+    post_path = path_segment(post.id)
+    comments = (
+        Comment.objects.visible_to(viewer)
+        .filter(**subtree(post_path))
+        .order_by('path')
+        .values('id', 'path', 'content', 'author_id', 'edited', date=F('comment_date'))
+    )
+    if first is not None:
+        comments = comments[:first]
+    comments = list(comments)
+    if not comments:
+        return []
+
+    # Replies of the selected comments form one contiguous range of paths
+    reply_range = {'path__gt': comments[0]['path'] + '.', 'path__lt': comments[-1]['path'] + '/'}
+    replies = Reply.objects.visible_to(viewer).filter(**reply_range)
+    shown = replies if depth is None else replies.filter(depth__lte=depth)
+    shown = shown.order_by('path').values(
+        'id', 'path', 'depth', 'content', 'author_id', 'edited', date=F('reply_date')
+    )
+
+    nodes = {}
+    roots = []
+    for row in comments:
+        node = nodes[row['path']] = ThreadNode('comment', row)
+        roots.append(node)
+    for row in shown:
+        parent = nodes.get(row['path'][:-(PATH_SEGMENT_WIDTH + 1)])
+        # A missing parent was hidden from the viewer, and so is its subtree
+        if parent is not None:
+            node = nodes[row['path']] = ThreadNode('reply', row)
+            parent.children.append(node)
+
+    if depth is not None:
+        hidden = (
+            replies.filter(depth__gt=depth)
+            .annotate(ancestor=Substr('path', 1, path_length(depth)))
+            .values('ancestor')
+            .annotate(count=Count('id'))
+        )
+        for row in hidden:
+            if row['ancestor'] in nodes:
+                nodes[row['ancestor']].collapsed_count = row['count']
+
+    authors = User.objects.in_bulk({node.author_id for node in nodes.values()})
+    for node in nodes.values():
+        node.author = authors.get(node.author_id)
+    return roots
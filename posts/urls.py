@@ -12,5 +12,6 @@ urlpatterns = [
     path('comment/like/<int:id>/', CommentLikeView.as_view(), name='comment-like'),
     path('reply/like/<int:id>/', ReplyLikeView.as_view(), name='reply-like'),
     path('file/<int:id>/', PostFileView.as_view(), name='post-file'),
-    path('file/', PostFileView.as_view(), name='post-file')
+    path('file/', PostFileView.as_view(), name='post-file'),
+    path('file/<int:id>/duplicates/', DuplicateFileView.as_view(), name='post-file-duplicates'),
 ]
@@ -1,39 +1,57 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.parsers import MultiPartParser, FormParser
 from .models import *
 from .serializer import *
-
-# All the get methods are handled with the GraphQL endpoint
+from django.conf import settings
+from django.db import transaction
+from .purge import delete_content
+from .edits import clean_content, edit_content, edit_representation, parse_if_match
+from users.stats import record_post
+from .likes import set_like
+from .dedup import MAX_DISTANCE, near_duplicates
+from .impressions import record_impression
+from helpers.conditional import Validators, weak_etag
+
+# Reads are mostly handled by the GraphQL endpoint; PostView.get serves single posts
 class BaseView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'writes'
     Serializer = None
     Model = None
 
+    def get_throttles(self):
+        # Only writes count against the 'writes' bucket
+        if self.request.method == 'GET':
+            return []
+        return super().get_throttles()
+
+    def created(self, obj):
+        """ Hook run in the creating transaction, e.g. to update counters """
+
     def post(self, request, *args, **kwargs):
         serializer = self.Serializer(data=request.data, context={'request': request})
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                self.created(serializer.save())
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     def put(self, request, *args, **kwargs):
-        try:
-            id = kwargs.get('id')
-            obj = self.Model.objects.get(id=id)
-        except self.Model.DoesNotExist:
-            raise NotFound()
-        except KeyError:
-            raise ParseError()
-        
-        serializer = self.Serializer(obj, data=request.data, context={'request': request})
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_403_FORBIDDEN)
+        """
+        Edit the content. Authorization and the write are a single conditional
+        UPDATE; send the ETag you read as If-Match to avoid lost updates.
+        """
+        if 'content' not in request.data:
+            raise ParseError("'content' was not provided")
+        content = clean_content(self.Serializer, request.data['content'])
+
+        versions = parse_if_match(request.headers.get('If-Match'))
+        obj = edit_content(self.Model, kwargs.get('id'), request.user, content, versions)
+        return Response(edit_representation(obj, request), status=status.HTTP_200_OK, headers={'ETag': weak_etag(obj.version)})
 
     def delete(self, request, *args, **kwargs):
         try:
@@ -43,7 +61,7 @@ class BaseView(APIView):
             if obj.author != request.user:
                 raise PermissionDenied(f"You cannot delete other users' {self.Model.__name__}")
             
-            obj.delete()
+            delete_content(obj)
             return Response(status=status.HTTP_204_NO_CONTENT)
         except self.Model.DoesNotExist:
             raise NotFound()
@@ -55,6 +73,30 @@ class PostView(BaseView):
     Model = Post
     Serializer = PostSerializer
 
+    def created(self, obj):
+        record_post(obj.author_id, 1)
+
+    def get(self, request, *args, **kwargs):
+        """
+        Retrieve a post by ID. The validators cover the post and its author
+        card, and conditional requests are answered without serializing.
+        """
+        posts = Post.objects.visible_to(request.user).filter(id=kwargs.get('id'))
+        state = posts.values_list('version', 'author__version', 'post_date', 'edited_at', 'author__updated_at').first()
+        if state is None:
+            raise NotFound()
+        # A revalidated copy is a view too
+        record_impression(int(kwargs.get('id')), request)
+        validators = Validators(state[:2], max(date for date in state[2:] if date is not None))
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+
+        post = next(post_rows(posts, request), None)
+        if post is None:
+            raise NotFound()
+        return Response(post, status=status.HTTP_200_OK, headers=validators.headers)
+
 
 class CommentView(BaseView):
     Model = Comment
@@ -66,14 +108,16 @@ class ReplyView(BaseView):
 
 class LikeView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'likes'
     Model = None
 
     def post(self, request, *args, **kwargs):
         try:
             id = kwargs.get('id')
-            obj = self.Model.objects.get(id=id)
+            # Only what the user can see may be liked; the rest is not found
+            obj = self.Model.objects.visible_to(request.user).get(id=id)
 
-            obj.likers.add(request.user)
+            set_like(obj, request.user)
 
             return Response({"message": f"{self.Model.__name__} liked!"}, status=status.HTTP_201_CREATED)
         except self.Model.DoesNotExist:
@@ -86,7 +130,7 @@ class LikeView(APIView):
             id = kwargs.get('id')
             obj = self.Model.objects.get(id=id)
 
-            obj.likers.remove(request.user)
+            set_like(obj, request.user, liked=False)
             return Response(status=status.HTTP_204_NO_CONTENT)
         except self.Model.DoesNotExist:
             raise NotFound()
@@ -116,7 +160,14 @@ class PostFileView(APIView):
             serializer = PostFileSerializer(data=request.data)
 
             if serializer.is_valid():
-                serializer.save()
+                post_file = PostFile(**serializer.validated_data)
+                post_file.compute_hashes()
+                if post_file.dhash is not None and getattr(settings, 'REJECT_DUPLICATE_IMAGES', False):
+                    # Reposting one's own image is fine; copying someone else's is what spam does
+                    others = near_duplicates(post_file.dhash, exclude=PostFile.objects.filter(post__author=request.user))
+                    if others:
+                        return Response({'file': ["This image was already posted."]}, status=status.HTTP_400_BAD_REQUEST)
+                post_file.save()
             return Response({"message":"File added successfully"}, status=status.HTTP_201_CREATED)
         except Post.DoesNotExist:
             raise NotFound()
@@ -135,3 +186,26 @@ class PostFileView(APIView):
             raise NotFound("File not found")
         except KeyError:
             raise ParseError("'id' was not provided")
+
+
+class DuplicateFileView(APIView):
+    """ Files near-duplicating a given one, for staff chasing reposting spam """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        post_file = PostFile.objects.filter(id=kwargs.get('id')).first()
+        if post_file is None:
+            raise NotFound("File not found")
+        if post_file.dhash is None:
+            return Response([], status=status.HTTP_200_OK)
+        distance = request.query_params.get('distance')
+        if distance is not None:
+            if not distance.isdigit() or int(distance) > MAX_DISTANCE:
+                raise ParseError(f"'distance' must be an integer from 0 to {MAX_DISTANCE}")
+            distance = int(distance)
+
+        matches = near_duplicates(post_file.dhash, distance, exclude=PostFile.objects.filter(id=post_file.id))
+        return Response([
+            {'id': match.id, 'post': match.post_id, 'author': match.post.author_id, 'file': match.file.name, 'distance': bits}
+            for bits, match in matches
+        ], status=status.HTTP_200_OK)
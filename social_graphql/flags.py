@@ -0,0 +1,98 @@
+from collections import defaultdict
+
+from django.db.models import Model, QuerySet
+
+from posts.models import Post, Comment, Reply
+from users.models import User
+
+LIKED = {model: ('liked', model) for model in (Post, Comment, Reply)}
+FOLLOWED = 'followed'
+BLOCKED = 'blocked'
+
+
+def _liked(model):
+    field = model._meta.model_name
+
+    def load(user, ids):
+        rows = model.likers.through.objects.filter(user_id=user.id, **{f'{field}_id__in': ids})
+        return rows.values_list(f'{field}_id', flat=True)
+    return load
+
+
+# relation -> function(viewer, ids) returning the ids the relation holds for.
+# In the follow table from_user is the followed account and to_user the follower.
+LOADERS = {
+    **{relation: _liked(model) for model, relation in LIKED.items()},
+    FOLLOWED: lambda user, ids: User.followers.through.objects.filter(
+        to_user_id=user.id, from_user_id__in=ids
+    ).values_list('from_user_id', flat=True),
+    BLOCKED: lambda user, ids: User.blocked_users.through.objects.filter(
+        from_user_id=user.id, to_user_id__in=ids
+    ).values_list('to_user_id', flat=True),
+}
+
+
+class ViewerFlags:
+    """
+    Which posts, comments and replies the viewer liked and which users they
+    follow or block, for one request. Ids of every page resolved so far are
+    queued, and the first flag looked up loads the whole queue with one
+    `IN (...)` query per relation.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.clear()
+
+    def clear(self):
+        self.pending = defaultdict(set)
+        self.loaded = defaultdict(set)
+        self.hits = defaultdict(set)
+
+    def prime(self, objects):
+        for obj in objects:
+            if isinstance(obj, User):
+                self.pending[FOLLOWED].add(obj.id)
+                self.pending[BLOCKED].add(obj.id)
+            elif type(obj) in LIKED:
+                self.pending[LIKED[type(obj)]].add(obj.id)
+                self.pending[FOLLOWED].add(obj.author_id)
+                self.pending[BLOCKED].add(obj.author_id)
+
+    def lookup(self, relation, id):
+        if not self.user.is_authenticated:
+            return False
+        if id not in self.loaded[relation]:
+            ids = (self.pending.pop(relation, set()) | {id}) - self.loaded[relation]
+            self.hits[relation].update(LOADERS[relation](self.user, ids))
+            self.loaded[relation] |= ids
+        return id in self.hits[relation]
+
+    def liked(self, obj):
+        return self.lookup(LIKED[type(obj)], obj.id)
+
+    def followed(self, user):
+        return self.lookup(FOLLOWED, user.id)
+
+    def blocked(self, user):
+        return self.lookup(BLOCKED, user.id)
+
+
+def viewer_flags(info):
+    """ The ViewerFlags of the current request, created on first use """
+    request = info.context
+    if not hasattr(request, '_viewer_flags'):
+        request._viewer_flags = ViewerFlags(request.user)
+    return request._viewer_flags
+
+
+class ViewerFlagsMiddleware:
+    """ Queues the ids of every list of posts, comments, replies or users a field resolves to """
+
+    def resolve(self, next, root, info, **args):
+        result = next(root, info, **args)
+        if isinstance(result, QuerySet) and (result.model is User or result.model in LIKED):
+            result = list(result)
+        if isinstance(result, list) and result and isinstance(result[0], Model):
+            viewer_flags(info).prime(result)
+        return result
@@ -0,0 +1,88 @@
+from graphql import GraphQLError, TypeInfo, TypeInfoVisitor, get_named_type, is_object_type, parse, print_ast, visit
+from graphql.language import FieldNode, NameNode, SelectionSetNode, Visitor
+
+# Response keys of the fields added to every selection of a model type.
+# Aliases, so they can never clash with what the client selected.
+TYPE_KEY = '_ref_type'
+ID_KEY = '_ref_id'
+
+
+def _field(alias, name):
+    return FieldNode(alias=NameNode(value=alias), name=NameNode(value=name), arguments=(), directives=())
+
+
+def is_model_type(graphql_type):
+    """
+    Whether a type is a DjangoObjectType, whose ids are primary keys of a
+    single table. Plain object types may mix ids from several, as comment
+    tree nodes do with comments and replies, so they are left inline.
+    """
+    graphene_type = getattr(graphql_type, 'graphene_type', None)
+    return getattr(getattr(graphene_type, '_meta', None), 'model', None) is not None
+
+
+class _AddReferenceFields(Visitor):
+    def __init__(self, type_info):
+        super().__init__()
+        self.type_info = type_info
+
+    def enter_selection_set(self, node, *args):
+        parent = get_named_type(self.type_info.get_type())
+        if not is_object_type(parent) or 'id' not in parent.fields or not is_model_type(parent):
+            return None
+        return SelectionSetNode(selections=(*node.selections, _field(TYPE_KEY, '__typename'), _field(ID_KEY, 'id')))
+
+
+def with_references(query, schema):
+    """
+    `query` with the typename and id of every model object added
+    under reserved aliases, for normalize() to key the objects by. Returns
+    the query unchanged if it does not parse, so the usual error comes out.
+    """
+    try:
+        document = parse(query)
+    except GraphQLError:
+        return query
+    type_info = TypeInfo(schema)
+    return print_ast(visit(document, TypeInfoVisitor(type_info, _AddReferenceFields(type_info))))
+
+
+def _merge(target, fields):
+    # Occurrences may select different fields, down to nested plain objects
+    for key, value in fields.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def normalize(data):
+    """
+    Split a result of a with_references() query into (data, entities):
+    every object with a typename and id is stored once in `entities` under
+    "<typename>:<id>", with the fields of all its occurrences merged, and
+    replaced by {"__ref": "<typename>:<id>"} wherever it appeared.
+    """
+    entities = {}
+
+    # Rewrites the result in place rather than copying it
+    def walk(value):
+        if type(value) is list:
+            for index, item in enumerate(value):
+                if type(item) in (dict, list):
+                    value[index] = walk(item)
+            return value
+        typename, id = value.pop(TYPE_KEY, None), value.pop(ID_KEY, None)
+        for key, item in value.items():
+            if type(item) in (dict, list):
+                value[key] = walk(item)
+        if typename is None or id is None:
+            return value
+        key = f'{typename}:{id}'
+        if key in entities:
+            _merge(entities[key], value)
+        else:
+            entities[key] = value
+        return {'__ref': key}
+
+    return (walk(data) if type(data) in (dict, list) else data), entities
@@ -1,35 +1,106 @@
+from contextlib import contextmanager
+
 import graphene
 from graphene_django import DjangoObjectType
-from users.models import User
-from posts.models import Post, Comment, Reply, PostFile
+from graphql import GraphQLError
+from rest_framework.exceptions import ValidationError
+from users.models import User, UserStats
+from posts.models import Post, Comment, Reply, PostFile, Hashtag, Mention
+from users.avatars import DEFAULT_FORMAT, rendition_name
+from users.stats import stats_for
+from users.suggestions import suggested_users_for
+from posts.threads import load_thread
+from posts.tags import DEFAULT_PAGE_SIZE, mentions_of, normalize_hashtag, posts_by_hashtag
+from posts.edits import clean_content, edit_content
+from posts.likes import set_like
+from posts.purge import delete_content
+from posts.serializer import PostSerializer, CommentSerializer, ReplySerializer
+from users.relations import set_block, set_follow
+from users.stats import record_post
+from users.autocomplete import autocomplete_users
+from users.cache import visible_user
+from posts.cache import visible_post
+from posts.impressions import impressions_of, record_impression
+from helpers.hyperloglog import relative_error
+from .flags import viewer_flags
+
+
+def viewer(info):
+    return info.context.user
+
+
+class LikersMixin:
+    def resolve_likers(self, info):
+        return self.likers.visible_to(viewer(info))
+
+    liked_by_me = graphene.Boolean()
+
+    def resolve_liked_by_me(self, info):
+        return viewer_flags(info).liked(self)
+
+
+class UserStatsType(DjangoObjectType):
+    class Meta:
+        model = UserStats
+        fields = ('followers_count', 'following_count', 'posts_count', 'likes_received')
+
 
 class UserType(DjangoObjectType):
     class Meta:
         model = User
-        fields = ('id', 'username', 'bio', 'first_name', 'last_name', 'private_profile', 'followers', 'blocked_users')
+        fields = (
+            'id', 'username', 'bio', 'first_name', 'last_name', 'private_profile', 'followers', 'blocked_users',
+            'picture_blurhash', 'picture_color',
+        )
+
+    def resolve_followers(self, info):
+        return self.followers.visible_to(viewer(info))
+
+    def resolve_blocked_users(self, info):
+        # Block lists are only ever shown to their owner
+        if viewer(info).id != self.id:
+            return User.objects.none()
+        return self.blocked_users.all()
 
     following = graphene.List(lambda: UserType)
 
     def resolve_following(self, info):
-        return self.following.all()
+        return self.following.visible_to(viewer(info))
 
     posts = graphene.List(lambda: PostType)
 
     def resolve_posts(self, info):
-        return self.posts.all()
+        return self.posts.visible_to(viewer(info))
 
     likes = graphene.List(lambda: PostType)
 
     def resolve_likes(self, info):
-        return self.post_likes.all()
+        return self.post_likes.visible_to(viewer(info))
+
+    stats = graphene.Field(UserStatsType)
 
-    profile_image_url = graphene.String()
+    # Batched per request, see social_graphql.flags
+    followed_by_me = graphene.Boolean()
+    blocked_by_me = graphene.Boolean()
 
-    def resolve_profile_image_url(self, info):
+    def resolve_followed_by_me(self, info):
+        return viewer_flags(info).followed(self)
+
+    def resolve_blocked_by_me(self, info):
+        return viewer_flags(info).blocked(self)
+
+    def resolve_stats(self, info):
+        return stats_for(self)
+
+    profile_image_url = graphene.String(size=graphene.Int(), format=graphene.String())
+
+    def resolve_profile_image_url(self, info, size=None, format=DEFAULT_FORMAT):
         request = info.context
-        if self.profile_picture:
-            return request.build_absolute_uri(self.profile_picture.url)
-        return None
+        if not self.profile_picture:
+            return None
+        # Fall back to the original until the renditions are built
+        name = rendition_name(self, size, format) or self.profile_picture.name
+        return request.build_absolute_uri(self.profile_picture.storage.url(name))
 
 class PostFileType(DjangoObjectType):
     class Meta:
@@ -44,50 +115,337 @@ class PostFileType(DjangoObjectType):
             return request.build_absolute_uri(self.file.url)
 
 
-class ReplyType(DjangoObjectType):
+class ReplyType(LikersMixin, DjangoObjectType):
     class Meta:
         model = Reply
-        fields = "__all__"
+        exclude = ('mentions',)
+
+    children = graphene.List(lambda: ReplyType)
 
-class CommentType(DjangoObjectType):
+    def resolve_children(self, info):
+        return self.children.visible_to(viewer(info))
+
+class CommentType(LikersMixin, DjangoObjectType):
     class Meta:
         model = Comment
-        fields = "__all__"
+        exclude = ('mentions',)
 
     replies = graphene.List(ReplyType)
 
     def resolve_replies(self, info):
-        return self.replies.all()
+        return self.replies.visible_to(viewer(info))
+
+class ThreadNodeType(graphene.ObjectType):
+    """ A comment or reply in a post's comment tree """
+    id = graphene.Int()
+    kind = graphene.String()
+    content = graphene.String()
+    author = graphene.Field(UserType)
+    date = graphene.DateTime()
+    edited = graphene.Boolean()
+    depth = graphene.Int()
+    children = graphene.List(lambda: ThreadNodeType)
+    collapsed_count = graphene.Int()
+
+class ImpressionsType(graphene.ObjectType):
+    views = graphene.Int(description="Every view, including this process's unflushed ones")
+    unique_viewers = graphene.Int(description="Estimated distinct viewers as of the last flush")
+    error = graphene.Float(description="Relative standard error of uniqueViewers")
 
-class PostType(DjangoObjectType):
+
+class PostType(LikersMixin, DjangoObjectType):
     class Meta:
         model = Post
-        fields = "__all__"
-    
+        exclude = ('impressions_count', 'unique_viewers', 'mentions')
+
+    impressions = graphene.Field(ImpressionsType)
+
+    def resolve_impressions(self, info):
+        views, unique_viewers = impressions_of(self.id)
+        return ImpressionsType(views=views, unique_viewers=unique_viewers, error=relative_error())
+
     comments = graphene.List(CommentType)
     files = graphene.List(PostFileType)
+    comment_tree = graphene.List(ThreadNodeType, depth=graphene.Int(), first=graphene.Int())
+
+    def resolve_comment_tree(self, info, depth=None, first=None):
+        return load_thread(self, viewer(info), depth=depth, first=first)
 
     def resolve_comments(self, info):
-        return self.comments.all()
+        return self.comments.visible_to(viewer(info))
     def resolve_files(self, info):
         return self.files.all()  
 
+class HashtagType(DjangoObjectType):
+    class Meta:
+        model = Hashtag
+        fields = ('name', 'post_count')
+
+class MentionType(DjangoObjectType):
+    """ Where a user was mentioned: a post, or a comment or reply under it """
+    class Meta:
+        model = Mention
+        fields = ('id', 'author', 'post', 'comment', 'reply')
+
 class Query(graphene.ObjectType):
     user_by_username = graphene.Field(UserType, name=graphene.String(required=True))
     post_by_id = graphene.Field(PostType, id=graphene.Int(required=True))
     users_search = graphene.List(UserType, name=graphene.String(required=True))
+    # Typeahead from the in-memory prefix index, see users.autocomplete
+    autocomplete_users = graphene.List(UserType, prefix=graphene.String(required=True), first=graphene.Int(default_value=10))
+    suggested_users = graphene.List(UserType, first=graphene.Int(default_value=10))
+    hashtag = graphene.Field(HashtagType, name=graphene.String(required=True))
+    # Keyset pagination: pass the last post (or mention) id of a page as `after`
+    posts_by_hashtag = graphene.List(
+        PostType, tag=graphene.String(required=True), first=graphene.Int(default_value=DEFAULT_PAGE_SIZE), after=graphene.Int()
+    )
+    mentions_of = graphene.List(
+        MentionType, username=graphene.String(required=True), first=graphene.Int(default_value=DEFAULT_PAGE_SIZE), after=graphene.Int()
+    )
     def resolve_user_by_username(self, info, name):
-        try:
-            return User.objects.get(username=name)
-        except User.DoesNotExist:
-            return None
+        return visible_user(name, viewer(info))
     def resolve_users_search(self, info, name):
-        return User.objects.filter(username__icontains=name)
+        return User.objects.visible_to(viewer(info)).filter(username__icontains=name)
     
+    def resolve_autocomplete_users(self, info, prefix, first):
+        return autocomplete_users(prefix, viewer(info), first)
+
+    def resolve_suggested_users(self, info, first):
+        user = viewer(info)
+        if not user.is_authenticated:
+            return []
+        return suggested_users_for(user, first)
+
+    def resolve_hashtag(self, info, name):
+        return Hashtag.objects.filter(name=normalize_hashtag(name)).first()
+
+    def resolve_posts_by_hashtag(self, info, tag, first, after=None):
+        return posts_by_hashtag(tag, viewer(info), first=first, after=after)
+
+    def resolve_mentions_of(self, info, username, first, after=None):
+        user = User.objects.visible_to(viewer(info)).filter(username=username).first()
+        if user is None:
+            return []
+        return mentions_of(user, viewer(info), first=first, after=after)
+
     def resolve_post_by_id(self, info, id):
-        try:
-            return Post.objects.get(id=id)
-        except Post.DoesNotExist:
-            return None
+        post = visible_post(id, viewer(info))
+        if post is not None:
+            record_impression(post.id, info.context)
+        return post
+
+
+# Mutations. The GraphQL view runs each request, batched or not, in one
+# transaction that is rolled back if any operation fails.
+
+def current_user(info):
+    user = viewer(info)
+    if not user.is_authenticated:
+        raise GraphQLError("You must be authenticated")
+    return user
+
+
+@contextmanager
+def input_errors():
+    """ Report DRF validation errors as a GraphQL error carrying the field errors """
+    try:
+        yield
+    except ValidationError as e:
+        raise GraphQLError("Invalid input", extensions={'errors': e.detail})
+
+
+def create(serializer_class, info, data):
+    current_user(info)
+    serializer = serializer_class(data=data, context={'request': info.context})
+    with input_errors():
+        serializer.is_valid(raise_exception=True)
+    return serializer.save()
+
+
+def edit(serializer_class, info, id, content, version=None):
+    user = current_user(info)
+    with input_errors():
+        content = clean_content(serializer_class, content)
+    return edit_content(serializer_class.Meta.model, id, user, content, None if version is None else [version])
+
+
+def delete(model, info, id):
+    user = current_user(info)
+    obj = model.objects.filter(id=id).first()
+    if obj is None:
+        raise GraphQLError(f"{model.__name__} not found")
+    if obj.author_id != user.id:
+        raise GraphQLError(f"You cannot delete other users' {model.__name__}")
+    delete_content(obj)
+    return True
+
+
+def visible(queryset, id):
+    obj = queryset.filter(id=id).first()
+    if obj is None:
+        raise GraphQLError(f"{queryset.model.__name__} not found")
+    return obj
+
+
+class CreatePost(graphene.Mutation):
+    class Arguments:
+        content = graphene.String(required=True)
+
+    post = graphene.Field(PostType)
+
+    def mutate(root, info, content):
+        post = create(PostSerializer, info, {'content': content})
+        record_post(post.author_id, 1)
+        return CreatePost(post=post)
+
+
+class CreateComment(graphene.Mutation):
+    class Arguments:
+        post = graphene.Int(required=True)
+        content = graphene.String(required=True)
+
+    comment = graphene.Field(CommentType)
+
+    def mutate(root, info, **data):
+        return CreateComment(comment=create(CommentSerializer, info, data))
+
+
+class CreateReply(graphene.Mutation):
+    class Arguments:
+        content = graphene.String(required=True)
+        comment = graphene.Int()
+        parent = graphene.Int(description="Reply being answered, instead of the comment itself")
+
+    reply = graphene.Field(ReplyType)
+
+    def mutate(root, info, **data):
+        return CreateReply(reply=create(ReplySerializer, info, data))
+
+
+class EditArguments:
+    id = graphene.Int(required=True)
+    content = graphene.String(required=True)
+    version = graphene.Int(description="Only edit if still at this version")
+
+
+class EditPost(graphene.Mutation):
+    Arguments = EditArguments
+    post = graphene.Field(PostType)
+
+    def mutate(root, info, **data):
+        return EditPost(post=edit(PostSerializer, info, **data))
+
+
+class EditComment(graphene.Mutation):
+    Arguments = EditArguments
+    comment = graphene.Field(CommentType)
+
+    def mutate(root, info, **data):
+        return EditComment(comment=edit(CommentSerializer, info, **data))
+
+
+class EditReply(graphene.Mutation):
+    Arguments = EditArguments
+    reply = graphene.Field(ReplyType)
+
+    def mutate(root, info, **data):
+        return EditReply(reply=edit(ReplySerializer, info, **data))
+
+
+class DeleteArguments:
+    id = graphene.Int(required=True)
+
+
+class DeletePost(graphene.Mutation):
+    Arguments = DeleteArguments
+    ok = graphene.Boolean()
+
+    def mutate(root, info, id):
+        return DeletePost(ok=delete(Post, info, id))
+
+
+class DeleteComment(graphene.Mutation):
+    Arguments = DeleteArguments
+    ok = graphene.Boolean()
+
+    def mutate(root, info, id):
+        return DeleteComment(ok=delete(Comment, info, id))
+
+
+class DeleteReply(graphene.Mutation):
+    Arguments = DeleteArguments
+    ok = graphene.Boolean()
+
+    def mutate(root, info, id):
+        return DeleteReply(ok=delete(Reply, info, id))
+
+
+class LikeTarget(graphene.Enum):
+    POST = 'post'
+    COMMENT = 'comment'
+    REPLY = 'reply'
+
+
+LIKE_MODELS = {'post': Post, 'comment': Comment, 'reply': Reply}
+
+
+class SetLike(graphene.Mutation):
+    class Arguments:
+        target = LikeTarget(required=True)
+        id = graphene.Int(required=True)
+        liked = graphene.Boolean(default_value=True)
+
+    changed = graphene.Boolean()
+
+    def mutate(root, info, target, id, liked):
+        user = current_user(info)
+        obj = visible(LIKE_MODELS[target.value].objects.visible_to(user), id)
+        changed = set_like(obj, user, liked)
+        viewer_flags(info).clear()
+        return SetLike(changed=changed)
+
+
+class SetFollow(graphene.Mutation):
+    class Arguments:
+        user = graphene.Int(required=True)
+        following = graphene.Boolean(default_value=True)
+
+    changed = graphene.Boolean()
+
+    def mutate(root, info, user, following):
+        follower = current_user(info)
+        target = visible(User.objects.visible_to(follower), user)
+        changed = set_follow(follower, target, following)
+        viewer_flags(info).clear()
+        return SetFollow(changed=changed)
+
+
+class SetBlock(graphene.Mutation):
+    class Arguments:
+        user = graphene.Int(required=True)
+        blocked = graphene.Boolean(default_value=True)
+
+    ok = graphene.Boolean()
+
+    def mutate(root, info, user, blocked):
+        set_block(current_user(info), visible(User.objects, user), blocked)
+        viewer_flags(info).clear()
+        return SetBlock(ok=True)
+
+
+class Mutation(graphene.ObjectType):
+    create_post = CreatePost.Field()
+    create_comment = CreateComment.Field()
+    create_reply = CreateReply.Field()
+    edit_post = EditPost.Field()
+    edit_comment = EditComment.Field()
+    edit_reply = EditReply.Field()
+    delete_post = DeletePost.Field()
+    delete_comment = DeleteComment.Field()
+    delete_reply = DeleteReply.Field()
+    set_like = SetLike.Field()
+    set_follow = SetFollow.Field()
+    set_block = SetBlock.Field()
+
 
-schema = graphene.Schema(query=Query)
+schema = graphene.Schema(query=Query, mutation=Mutation)
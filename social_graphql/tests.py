@@ -1,3 +1,573 @@
-from django.test import TestCase
+import json
+import os
+import subprocess
+import sys
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from helpers.cache import get_cache
+from helpers.throttling import get_store
+from posts.models import Post, PostFile, Comment, Reply, PurgeJob
+from users.models import User
+from users.suggestions import build_suggestions
+from users.avatars import build_avatars
+from users.autocomplete import reset_index
+from helpers.util import create_dummy_image, get_jwt_token
+from social_graphql.views import query_cost
+from posts.impressions import ImpressionBuffer
+from posts.tags import index_content
+
+
+class GraphQLTestCase(TestCase):
+    def query(self, query, variables=None):
+        response = self.client.post(
+            '/graphql',
+            json.dumps({'query': query, 'variables': variables or {}}),
+            content_type='application/json',
+        )
+        return json.loads(response.content)
+
+
+class SuggestedUsersQueryTest(GraphQLTestCase):
+    QUERY = "query { suggestedUsers(first: 5) { username } }"
+
+    def setUp(self):
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(username=name, password="password")
+            for name in ("alice", "bob", "carol")
+        ]
+        self.bob.followers.add(self.alice)
+        self.carol.followers.add(self.bob)
+        build_suggestions()
+
+    def test_suggested_users(self):
+        self.client.force_login(self.alice)
+        result = self.query(self.QUERY)
+
+        self.assertEqual(result['data']['suggestedUsers'], [{'username': 'carol'}])
+
+    def test_suggestions_followed_since_build_are_hidden(self):
+        self.carol.followers.add(self.alice)
+        self.client.force_login(self.alice)
+        result = self.query(self.QUERY)
+
+        self.assertEqual(result['data']['suggestedUsers'], [])
+
+    def test_anonymous_viewer_gets_no_suggestions(self):
+        result = self.query(self.QUERY)
+
+        self.assertEqual(result['data']['suggestedUsers'], [])
+
+
+class VisibilityQueryTest(GraphQLTestCase):
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username="viewer", password="password")
+        self.author = User.objects.create_user(username="author", password="password", private_account=True)
+        self.post = Post.objects.create(content="hidden", author=self.author)
+        self.client.force_login(self.viewer)
+
+    def test_private_post_hidden_from_non_followers(self):
+        result = self.query("query($id: Int!) { postById(id: $id) { content } }", {'id': self.post.id})
+        self.assertIsNone(result['data']['postById'])
+
+        self.author.followers.add(self.viewer)
+        result = self.query("query($id: Int!) { postById(id: $id) { content } }", {'id': self.post.id})
+        self.assertEqual(result['data']['postById'], {'content': 'hidden'})
+
+    def test_nested_posts_are_filtered(self):
+        result = self.query('query { userByUsername(name: "author") { posts { content } } }')
+
+        self.assertEqual(result['data']['userByUsername']['posts'], [])
+
+    def test_blocked_users_are_not_found(self):
+        self.author.blocked_users.add(self.viewer)
+
+        result = self.query('query { userByUsername(name: "author") { username } }')
+        self.assertIsNone(result['data']['userByUsername'])
+
+        result = self.query('query { usersSearch(name: "auth") { username } }')
+        self.assertEqual(result['data']['usersSearch'], [])
+
+    def test_block_list_only_visible_to_owner(self):
+        self.author.blocked_users.add(self.viewer)
+        self.client.force_login(self.author)
+        result = self.query('query { userByUsername(name: "author") { blockedUsers { username } } }')
+        self.assertEqual(result['data']['userByUsername']['blockedUsers'], [{'username': 'viewer'}])
+
+        self.author.blocked_users.clear()
+        self.client.force_login(self.viewer)
+        result = self.query('query { userByUsername(name: "author") { blockedUsers { username } } }')
+        self.assertEqual(result['data']['userByUsername']['blockedUsers'], [])
+
+
+@override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'graphql_ip': '5/min'}})
+class GraphQLThrottleTest(GraphQLTestCase):
+
+    def setUp(self):
+        get_store().clear()
+        User.objects.create_user(username="alice", password="password")
+
+    def tearDown(self):
+        get_store().clear()
+
+    def test_query_cost_counts_selected_fields(self):
+        self.assertEqual(query_cost('query { userByUsername(name: "a") { username posts { id } } }'), 4)
+
+    def test_expensive_queries_use_up_the_bucket(self):
+        query = 'query { userByUsername(name: "alice") { username bio } }'
+        self.assertIn('data', self.query(query))
+
+        response = self.client.post('/graphql', json.dumps({'query': query}), content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('throttled', json.loads(response.content)['errors'][0]['message'])
+
+
+class CommentTreeQueryTest(GraphQLTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.post = Post.objects.create(content="Thread", author=self.user)
+        comment = Comment.objects.create(content="comment", author=self.user, post=self.post)
+        reply = Reply.objects.create(content="reply", author=self.user, comment=comment)
+        Reply.objects.create(content="nested", author=self.user, comment=comment, parent=reply)
+
+    def test_comment_tree(self):
+        query = """
+            query($id: Int!) {
+                postById(id: $id) {
+                    commentTree(depth: 1, first: 10) {
+                        kind content author { username }
+                        children { kind content depth collapsedCount children { content } }
+                    }
+                }
+            }
+        """
+        result = self.query(query, {'id': self.post.id})
+
+        self.assertEqual(result['data']['postById']['commentTree'], [{
+            'kind': 'comment',
+            'content': 'comment',
+            'author': {'username': 'user'},
+            'children': [{'kind': 'reply', 'content': 'reply', 'depth': 1, 'collapsedCount': 1, 'children': []}],
+        }])
+
+
+    def test_nested_replies_are_filtered(self):
+        viewer = User.objects.create_user(username="viewer", password="password")
+        blocker = User.objects.create_user(username="blocker", password="password")
+        blocker.blocked_users.add(viewer)
+        reply = Reply.objects.get(content="reply")
+        Reply.objects.create(content="blocked reply", author=blocker, comment=reply.comment, parent=reply)
+        query = "query($id: Int!) { postById(id: $id) { comments { replies { content children { content } } } } }"
+
+        self.client.force_login(viewer)
+        replies = self.query(query, {'id': self.post.id})['data']['postById']['comments'][0]['replies']
+
+        self.assertEqual(replies[0], {'content': 'reply', 'children': [{'content': 'nested'}]})
+        self.assertNotIn('blocked reply', json.dumps(replies))
+
+
+class ProfileImageQueryTest(GraphQLTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="pic", password="password", profile_picture=create_dummy_image())
+
+    def test_profile_image_url_picks_rendition(self):
+        query = 'query { userByUsername(name: "pic") { small: profileImageUrl(size: 60) original: profileImageUrl } }'
+        before = self.query(query)['data']['userByUsername']
+        self.assertIn('/media/profile_pictures/', before['small'])
+
+        build_avatars(self.user.id)
+        after = self.query(query)['data']['userByUsername']
+        self.assertRegex(after['small'], r'^http://testserver/media/avatars/\d+/[0-9a-f]{16}_96\.webp$')
+        self.assertRegex(after['original'], r'_256\.webp$')
+
+    def test_placeholders(self):
+        build_avatars(self.user.id)
+        post = Post.objects.create(author=self.user, content="post")
+        PostFile.objects.create(post=post, file=create_dummy_image())
+
+        result = self.query(
+            'query { userByUsername(name: "pic") { pictureBlurhash pictureColor '
+            'posts { files { blurhash dominantColor } } } }'
+        )['data']['userByUsername']
+        self.assertEqual(len(result['pictureBlurhash']), 28)
+        self.assertEqual(result['pictureColor'], '#fe0000')
+        self.assertEqual(result['posts'][0]['files'][0]['dominantColor'], '#fe0000')
+
+
+class UserStatsQueryTest(GraphQLTestCase):
+
+    def test_stats(self):
+        alice, bob = [User.objects.create_user(username=name, password="password") for name in ("alice", "bob")]
+        alice.followers.add(bob)
+        Post.objects.create(author=alice, content="post").likers.add(bob)
+
+        result = self.query('query { userByUsername(name: "alice") { stats { followersCount followingCount postsCount likesReceived } } }')
+        self.assertEqual(result['data']['userByUsername']['stats'], {
+            'followersCount': 1, 'followingCount': 0, 'postsCount': 1, 'likesReceived': 1,
+        })
+
+
+class HashtagQueryTest(GraphQLTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.friend = User.objects.create_user(username="friend", password="password")
+        self.posts = [Post.objects.create(author=self.user, content=f"#news {i} @friend") for i in range(3)]
+        for post in self.posts:
+            index_content(post)
+
+    def test_posts_by_hashtag(self):
+        query = 'query ($after: Int) { hashtag(name: "News") { postCount } postsByHashtag(tag: "news", first: 2, after: $after) { id } }'
+        result = self.query(query)['data']
+        self.assertEqual(result['hashtag'], {'postCount': 3})
+        self.assertEqual([int(p['id']) for p in result['postsByHashtag']], [self.posts[2].id, self.posts[1].id])
+
+        result = self.query(query, {'after': self.posts[1].id})['data']
+        self.assertEqual([int(p['id']) for p in result['postsByHashtag']], [self.posts[0].id])
+
+    def test_mentions_of(self):
+        result = self.query('query { mentionsOf(username: "friend", first: 5) { author { username } post { id } comment { id } } }')
+        mentions = result['data']['mentionsOf']
+        self.assertEqual(len(mentions), 3)
+        self.assertEqual(mentions[0], {'author': {'username': 'user'}, 'post': {'id': str(self.posts[2].id)}, 'comment': None})
+
+
+class ViewerFlagsQueryTest(GraphQLTestCase):
+    QUERY = 'query { postsByHashtag(tag: "news", first: 50) { likedByMe author { followedByMe blockedByMe } } }'
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username="viewer", password="password")
+        self.client.force_login(self.viewer)
+
+    def add_posts(self, count):
+        posts = []
+        for i in range(count):
+            author = User.objects.create_user(username=f"author{Post.objects.count()}", password="password")
+            posts.append(Post.objects.create(author=author, content="#news"))
+            index_content(posts[-1])
+        return posts
+
+    def run_query(self, query=QUERY):
+        with CaptureQueriesContext(connection) as queries:
+            result = self.query(query)
+        return result['data']['postsByHashtag'], len(queries)
+
+    def test_flags(self):
+        liked, followed, blocked = self.add_posts(3)
+        liked.likers.add(self.viewer)
+        followed.author.followers.add(self.viewer)
+
+        result, _ = self.run_query()
+        self.assertEqual(result, [
+            {'likedByMe': False, 'author': {'followedByMe': False, 'blockedByMe': False}},
+            {'likedByMe': False, 'author': {'followedByMe': True, 'blockedByMe': False}},
+            {'likedByMe': True, 'author': {'followedByMe': False, 'blockedByMe': False}},
+        ])
+
+        self.viewer.blocked_users.add(blocked.author)
+        result = self.query('query { userByUsername(name: "viewer") { blockedUsers { username blockedByMe } } }')
+        self.assertEqual(
+            result['data']['userByUsername']['blockedUsers'],
+            [{'username': blocked.author.username, 'blockedByMe': True}],
+        )
+
+    def test_one_query_per_relation_and_page(self):
+        self.add_posts(10)
+        result, with_flags = self.run_query()
+        _, without_flags = self.run_query('query { postsByHashtag(tag: "news", first: 50) { id author { id } } }')
+
+        self.assertEqual(len(result), 10)
+        # likes, follows and blocks
+        self.assertEqual(with_flags - without_flags, 3)
+
+    def test_flags_follow_mutations_in_a_batch(self):
+        post, = self.add_posts(1)
+        response = self.client.post('/graphql/batch', json.dumps([
+            {'query': self.QUERY},
+            {'query': 'mutation($id: Int!) { setLike(target: POST, id: $id, liked: true) { changed } }', 'variables': {'id': post.id}},
+            {'query': self.QUERY},
+        ]), content_type='application/json')
+        before, _, after = json.loads(response.content)
+
+        self.assertFalse(before['data']['postsByHashtag'][0]['likedByMe'])
+        self.assertTrue(after['data']['postsByHashtag'][0]['likedByMe'])
+
+    def test_anonymous_viewer(self):
+        self.add_posts(1)
+        self.client.logout()
+
+        result, _ = self.run_query()
+        self.assertEqual(result, [{'likedByMe': False, 'author': {'followedByMe': False, 'blockedByMe': False}}])
+
+
+class ImpressionsQueryTest(GraphQLTestCase):
+    QUERY = "query($id: Int!) { postById(id: $id) { impressions { views uniqueViewers error } } }"
+
+    def test_post_by_id_counts_views(self):
+        get_cache().clear()
+        buffer = ImpressionBuffer(flush_interval=3600)
+        post = Post.objects.create(content="seen", author=User.objects.create_user(username="author", password="password"))
+
+        with mock.patch('posts.impressions._buffer', buffer):
+            for _ in range(3):
+                with self.captureOnCommitCallbacks(execute=True):
+                    result = self.query(self.QUERY, {'id': post.id})
+            # The third view is recorded once the query's transaction commits
+            self.assertEqual(result['data']['postById']['impressions']['views'], 2)
+            # The cached post stays: its counters are read from the row
+            with mock.patch.object(get_cache(), 'invalidate') as invalidate:
+                buffer.flush()
+            invalidate.assert_not_called()
+            impressions = self.query(self.QUERY, {'id': post.id})['data']['postById']['impressions']
+
+        self.assertEqual((impressions['views'], impressions['uniqueViewers']), (3, 1))
+        self.assertAlmostEqual(impressions['error'], 1.04 / 64)
+
+
+class NormalizedResponseTest(GraphQLTestCase):
+    QUERY = 'query { postsByHashtag(tag: "news", first: 5) { content author { username } comments { by: author { username bio } } } }'
+
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="password", bio="hello")
+        self.posts = [Post.objects.create(author=self.author, content=f"#news {i}") for i in range(3)]
+        for post in self.posts:
+            index_content(post)
+            Comment.objects.create(post=post, author=self.author, content="self reply")
+
+    def post(self, path, body):
+        return json.loads(self.client.post(path, json.dumps(body), content_type='application/json').content)
+
+    def test_entities_are_sent_once(self):
+        plain = self.query(self.QUERY)
+        result = self.post('/graphql?normalize=1', {'query': self.QUERY})
+
+        author_key = f'UserType:{self.author.id}'
+        self.assertEqual(result['entities'][author_key], {'username': 'author', 'bio': 'hello'})
+        self.assertEqual(len([key for key in result['entities'] if key.startswith('UserType:')]), 1)
+        self.assertNotIn('entities', plain)
+
+        posts = [result['entities'][post['__ref']] for post in result['data']['postsByHashtag']]
+        self.assertEqual([post['content'] for post in posts], [p['content'] for p in plain['data']['postsByHashtag']])
+        self.assertEqual(posts[0]['author'], {'__ref': author_key})
+        comment = result['entities'][posts[0]['comments'][0]['__ref']]
+        self.assertEqual(comment, {'by': {'__ref': author_key}})
+        self.assertNotIn('_ref_type', json.dumps(result))
+
+    def test_comment_tree_nodes_stay_inline(self):
+        # Tree nodes are comments and replies, whose ids may coincide
+        comment = Comment.objects.create(id=1000, post=self.posts[0], author=self.author, content="comment")
+        Reply.objects.create(id=1000, comment=comment, author=self.author, content="reply")
+        query = 'query($id: Int!) { postById(id: $id) { commentTree { id kind children { id kind } } } }'
+
+        result = self.post('/graphql?normalize=1', {'query': query, 'variables': {'id': self.posts[0].id}})
+
+        tree = result['entities'][result['data']['postById']['__ref']]['commentTree']
+        self.assertIn({'id': 1000, 'kind': 'comment', 'children': [{'id': 1000, 'kind': 'reply'}]}, tree)
+        self.assertFalse([key for key in result['entities'] if key.startswith('ThreadNodeType:')])
+
+    def test_batch(self):
+        results = self.post('/graphql/batch?normalize=1', [
+            {'query': 'query { userByUsername(name: "author") { username } }'},
+            {'query': '{ bad'},
+        ])
+
+        self.assertEqual(results[0]['data'], {'userByUsername': {'__ref': f'UserType:{self.author.id}'}})
+        self.assertNotIn('data', results[1])
+        self.assertIn('errors', results[1])
+
+
+class CachedEntryPointTest(GraphQLTestCase):
+    POST = "query($id: Int!) { postById(id: $id) { content author { username } } }"
+    USER = 'query { userByUsername(name: "author") { username bio } }'
+
+    def setUp(self):
+        get_cache().clear()
+        self.author = User.objects.create_user(username="author", password="password")
+        self.viewer = User.objects.create_user(username="viewer", password="password")
+        self.post = Post.objects.create(content="cached", author=self.author)
+
+    def test_anonymous_hits_skip_the_database(self):
+        self.query(self.POST, {'id': self.post.id})
+        with CaptureQueriesContext(connection) as queries:
+            result = self.query(self.POST, {'id': self.post.id})
+        # Only the savepoint of the view's transaction
+        self.assertFalse([q for q in queries if 'SAVEPOINT' not in q['sql']])
+        self.assertEqual(result['data']['postById'], {'content': 'cached', 'author': {'username': 'author'}})
+
+    def test_writes_invalidate(self):
+        self.client.force_login(self.author)
+        self.query(self.POST, {'id': self.post.id})
+        self.query(self.USER)
+
+        self.query('mutation($id: Int!) { editPost(id: $id, content: "edited") { post { id } } }', {'id': self.post.id})
+        self.author.bio = "new bio"
+        self.author.save()
+
+        self.assertEqual(self.query(self.POST, {'id': self.post.id})['data']['postById']['content'], 'edited')
+        self.assertEqual(self.query(self.USER)['data']['userByUsername']['bio'], 'new bio')
+
+        self.query('mutation($id: Int!) { deletePost(id: $id) { ok } }', {'id': self.post.id})
+        self.assertIsNone(self.query(self.POST, {'id': self.post.id})['data']['postById'])
+
+    def test_visibility_is_checked_on_hits(self):
+        self.client.force_login(self.viewer)
+        self.query(self.POST, {'id': self.post.id})
+
+        self.author.private_account = True
+        self.author.save()
+        self.assertIsNone(self.query(self.POST, {'id': self.post.id})['data']['postById'])
+
+        self.author.followers.add(self.viewer)
+        self.assertIsNotNone(self.query(self.POST, {'id': self.post.id})['data']['postById'])
+
+        self.author.blocked_users.add(self.viewer)
+        self.assertIsNone(self.query(self.POST, {'id': self.post.id})['data']['postById'])
+        self.assertIsNone(self.query(self.USER)['data']['userByUsername'])
+
+    def test_renamed_user_is_not_found_by_the_old_name(self):
+        self.query(self.USER)
+        self.author.username = "renamed"
+        self.author.save()
+
+        self.assertIsNone(self.query(self.USER)['data']['userByUsername'])
+
+
+class AutocompleteQueryTest(GraphQLTestCase):
+    def test_autocomplete_users(self):
+        reset_index()
+        for name in ("martin", "marta", "bob"):
+            User.objects.create_user(username=name, password="password")
+
+        result = self.query('query { autocompleteUsers(prefix: "Mar", first: 5) { username } }')
+        self.assertEqual(result['data']['autocompleteUsers'], [{'username': 'marta'}, {'username': 'martin'}])
+
+
+class MutationTest(GraphQLTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="password")
+        self.other = User.objects.create_user(username="other", password="password")
+        self.posts = [Post.objects.create(author=self.other, content=f"post {i}") for i in range(2)]
+        self.auth = {'HTTP_AUTHORIZATION': 'Bearer ' + get_jwt_token(self.user)}
+
+    def batch(self, operations):
+        response = self.client.post('/graphql/batch', json.dumps(operations), content_type='application/json', **self.auth)
+        return json.loads(response.content)
+
+    def test_write_through_jwt(self):
+        response = self.client.post(
+            '/graphql',
+            json.dumps({'query': 'mutation { createPost(content: "hi #graphql") { post { content author { username } } } }'}),
+            content_type='application/json', **self.auth,
+        )
+        result = json.loads(response.content)
+
+        self.assertEqual(result['data']['createPost']['post'], {'content': 'hi #graphql', 'author': {'username': 'user'}})
+        self.assertEqual(self.user.stats.posts_count, 1)
+
+    def test_session_writes_need_a_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        body = json.dumps({'query': 'mutation { createPost(content: "forged") { post { id } } }'})
+
+        response = client.post('/graphql', body, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Post.objects.filter(content="forged").exists())
+
+        token = 'a' * 32
+        client.cookies['csrftoken'] = token
+        response = client.post('/graphql', body, content_type='application/json', HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        # Bearer tokens are not sent by browsers on their own, so need no CSRF token
+        response = Client(enforce_csrf_checks=True).post('/graphql', body, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Post.objects.filter(content="forged").count(), 2)
+
+    def test_deleted_posts_are_purged_in_the_background(self):
+        post = Post.objects.create(author=self.user, content="mine")
+        comment = Comment.objects.create(author=self.other, post=post, content="comment")
+        response = self.client.post(
+            '/graphql',
+            json.dumps({'query': 'mutation($id: Int!) { deletePost(id: $id) { ok } }', 'variables': {'id': post.id}}),
+            content_type='application/json', **self.auth,
+        )
+
+        self.assertTrue(json.loads(response.content)['data']['deletePost']['ok'])
+        self.assertIsNotNone(Post.all_objects.get(id=post.id).deleted_at)
+        self.assertTrue(PurgeJob.objects.filter(kind=PurgeJob.Kind.POST, target_id=post.id).exists())
+        self.assertTrue(Comment.objects.filter(id=comment.id).exists())
+
+    def test_hidden_posts_cannot_be_commented(self):
+        comment = Comment.objects.create(author=self.other, post=self.posts[0], content="comment")
+        self.other.blocked_users.add(self.user)
+        results = self.batch([
+            {'query': 'mutation { createComment(post: %d, content: "hi") { comment { id } } }' % self.posts[0].id},
+        ])
+        self.assertEqual(results[0]['errors'][0]['extensions']['errors'], {'post': [f'Invalid pk "{self.posts[0].id}" - object does not exist.']})
+
+        self.other.blocked_users.remove(self.user)
+        self.other.private_account = True
+        self.other.save()
+        results = self.batch([
+            {'query': 'mutation { createReply(comment: %d, content: "hi") { reply { id } } }' % comment.id},
+        ])
+        self.assertIn('comment', results[0]['errors'][0]['extensions']['errors'])
+        self.assertFalse(Comment.objects.filter(content="hi").exists() or Reply.objects.exists())
+
+    def test_anonymous_writes_are_refused(self):
+        result = self.query('mutation { setFollow(user: %d) { changed } }' % self.other.id)
+
+        self.assertEqual(result['errors'][0]['message'], "You must be authenticated")
+        self.assertFalse(self.other.followers.exists())
+
+    def test_batched_writes(self):
+        like = 'mutation ($id: Int!) { setLike(target: POST, id: $id) { changed } }'
+        results = self.batch([
+            {'query': like, 'variables': {'id': self.posts[0].id}},
+            {'query': like, 'variables': {'id': self.posts[1].id}},
+            {'query': 'mutation { setFollow(user: %d) { changed } }' % self.other.id},
+        ])
+
+        self.assertEqual([r['data'] for r in results], [
+            {'setLike': {'changed': True}}, {'setLike': {'changed': True}}, {'setFollow': {'changed': True}},
+        ])
+        self.assertEqual(self.user.post_likes.count(), 2)
+        self.assertTrue(self.other.followers.filter(id=self.user.id).exists())
+
+    def test_failed_operation_rolls_back_the_batch(self):
+        results = self.batch([
+            {'query': 'mutation { setFollow(user: %d) { changed } }' % self.other.id},
+            {'query': 'mutation { editPost(id: %d, content: "mine now") { post { id } } }' % self.posts[0].id},
+            {'query': 'mutation { setBlock(user: %d) { ok } }' % self.other.id},
+        ])
+
+        self.assertIn('errors', results[1])
+        self.assertEqual(results[2]['errors'][0]['message'], "Not run: an earlier operation in this request failed")
+        self.assertFalse(self.other.followers.exists())
+        self.assertEqual(Post.objects.get(id=self.posts[0].id).content, "post 0")
+
+
+class LazyGraphQLViewTest(TestCase):
+
+    def test_graphiql_renders_without_the_app_installed(self):
+        response = self.client.get('/graphql', HTTP_ACCEPT='text/html')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'graphiql')
+
+    def test_boot_does_not_import_the_graphql_stack(self):
+        script = (
+            "import django, sys; django.setup();"
+            "from django.urls import get_resolver; get_resolver().url_patterns;"
+            "print(sorted(m for m in ('graphene', 'numpy', 'PIL', 'rest_framework_simplejwt') if m in sys.modules))"
+        )
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'backend.settings'}
+        result = subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+
+        self.assertEqual(result.stdout.strip(), '[]', result.stderr)
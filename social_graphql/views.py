@@ -0,0 +1,122 @@
+import json
+
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
+from graphene_django.views import GraphQLView as BaseGraphQLView, HttpError
+from graphql import ExecutionResult, GraphQLError, parse
+from graphql.language import Visitor, visit
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from helpers.throttling import IPTokenBucketThrottle, UserTokenBucketThrottle
+from .normalize import normalize, with_references
+
+try:
+    import orjson
+except ImportError:  # optional: the standard library encoder is the fallback
+    orjson = None
+
+
+class _FieldCounter(Visitor):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def enter_field(self, *args):
+        self.count += 1
+
+
+def query_cost(query):
+    """ Throttle cost of a query: one token per selected field """
+    try:
+        document = parse(query)
+    except GraphQLError:
+        return 1
+    counter = _FieldCounter()
+    visit(document, counter)
+    return max(counter.count, 1)
+
+
+def encode(data):
+    """ Compact JSON of a response, with orjson when it is installed """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data).decode()
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(data, separators=(',', ':'))
+
+
+def wants_normalized(request):
+    return request.GET.get('normalize') in ('1', 'true')
+
+
+class GraphQLView(BaseGraphQLView):
+    """
+    GraphQL endpoint authenticated by session, with CSRF protection, or JWT
+    bearer token. A POST runs
+    in one transaction, including every operation of a batch, and the whole
+    request is rolled back as soon as one operation fails.
+
+    With ?normalize=1 every model object is sent once, in an
+    "entities" table keyed by "<typename>:<id>", and referenced as
+    {"__ref": key} in "data", so an author shared by a page of posts is not
+    repeated on each of them. Error locations then refer to the query as
+    rewritten with the reference fields.
+    """
+    throttle_scope = 'graphql'
+    throttle_classes = [UserTokenBucketThrottle, IPTokenBucketThrottle]
+
+    def authenticate(self, request):
+        auth = JWTAuthentication().authenticate(request)
+        if auth is not None:
+            request.user = auth[0]
+        elif request.method == 'POST' and request.user.is_authenticated:
+            # The route is csrf_exempt for token clients; session cookies
+            # are sent cross-site, so those requests still need the token
+            SessionAuthentication().enforce_csrf(request)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            self.authenticate(request)
+        except (AuthenticationFailed, PermissionDenied) as e:
+            return JsonResponse({'errors': [{'message': str(e.detail)}]}, status=e.status_code)
+
+        if request.method != 'POST':
+            return super().dispatch(request, *args, **kwargs)
+        with transaction.atomic():
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code >= 400:
+                transaction.set_rollback(True)
+            return response
+
+    def check_throttles(self, request, cost):
+        self.throttle_cost = cost
+        for throttle in (throttle_class() for throttle_class in self.throttle_classes):
+            if not throttle.allow_request(request, self):
+                wait = throttle.wait() or 0
+                response = HttpResponse(status=429)
+                response['Retry-After'] = str(int(wait) + 1)
+                raise HttpError(response, f"Request was throttled. Expected available in {wait:.0f} seconds.")
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        if query:
+            self.check_throttles(request, query_cost(query))
+        in_transaction = request.method == 'POST' and transaction.get_connection().in_atomic_block
+        if in_transaction and transaction.get_rollback():
+            return ExecutionResult(errors=[GraphQLError("Not run: an earlier operation in this request failed")])
+
+        if query and wants_normalized(request):
+            query = with_references(query, self.schema.graphql_schema)
+        result = super().execute_graphql_request(request, data, query, variables, operation_name, show_graphiql)
+        if in_transaction and result is not None and result.errors:
+            transaction.set_rollback(True)
+        return result
+
+    def json_encode(self, request, d, pretty=False):
+        if wants_normalized(request) and d.get('data') is not None:
+            d['data'], d['entities'] = normalize(d['data'])
+        if self.pretty or pretty or request.GET.get('pretty'):
+            return super().json_encode(request, d, pretty)
+        return encode(d)
@@ -0,0 +1,231 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
+
+from .models import User, UserStats
+
+DEFAULT_MAX_AGE = 600
+MAX_RESULTS = 50
+# Sorts after every character a name can contain
+_END = '\U0010ffff'
+
+
+def names_of(username, first_name, last_name):
+    """ The lowercase keys a user is found by: username, full name and last name """
+    full_name = f'{first_name or ""} {last_name or ""}'.strip().lower()
+    keys = {username.lower(), full_name, (last_name or '').lower()}
+    keys.discard('')
+    return keys
+
+
+class PrefixIndex:
+    """
+    Sorted lowercase names with the user id and follower count of each, in
+    parallel arrays. A prefix is a contiguous range of the names, found by
+    bisection; the best ranked users of the range come from an argpartition
+    over its follower counts.
+
+    Names added after the build wait in a short `recent` list that every
+    search scans, and are merged into the arrays MERGE_EVERY at a time, so
+    a profile save does not copy the whole index. Removed users are left
+    out of results and dropped from the arrays at the next merge. A renamed
+    user keeps its old names until the next rebuild, so callers check the
+    users they get back.
+    """
+    MERGE_EVERY = 256
+
+    def __init__(self, rows=()):
+        # Imported here rather than at boot, like everything NumPy backed
+        import numpy as np
+
+        entries = sorted(
+            (name, user_id, score or 0)
+            for user_id, username, first_name, last_name, score in rows
+            for name in names_of(username, first_name, last_name)
+        )
+        self.keys = [name for name, _, _ in entries]
+        self.ids = np.fromiter((user_id for _, user_id, _ in entries), dtype=np.int64, count=len(entries))
+        self.scores = np.fromiter((score for _, _, score in entries), dtype=np.int64, count=len(entries))
+        self.recent = []
+        self.removed = set()
+        self.built_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys) + len(self.recent)
+
+    def add(self, user_id, names, score):
+        with self._lock:
+            self.removed.discard(user_id)
+            for name in names:
+                position = bisect_left(self.keys, name)
+                if self._has(name, position, user_id) or any(
+                    (entry[0], entry[1]) == (name, user_id) for entry in self.recent
+                ):
+                    continue
+                self.recent.append((name, user_id, score))
+            if len(self.recent) >= self.MERGE_EVERY:
+                self._merge()
+
+    def remove(self, user_id):
+        with self._lock:
+            self.removed.add(user_id)
+            if len(self.removed) >= self.MERGE_EVERY:
+                self._merge()
+
+    def _has(self, name, position, user_id):
+        while position < len(self.keys) and self.keys[position] == name:
+            if self.ids[position] == user_id:
+                return True
+            position += 1
+        return False
+
+    def _merge(self):
+        """ Fold the recent names into the arrays and drop removed users, in one copy of each """
+        import numpy as np
+
+        recent = sorted(self.recent)
+        positions = [bisect_left(self.keys, name) for name, _, _ in recent]
+        keys, previous = [], 0
+        for position, (name, _, _) in zip(positions, recent):
+            keys.extend(self.keys[previous:position])
+            keys.append(name)
+            previous = position
+        keys.extend(self.keys[previous:])
+        ids = np.insert(self.ids, positions, [user_id for _, user_id, _ in recent])
+        scores = np.insert(self.scores, positions, [score for _, _, score in recent])
+        if self.removed:
+            keep = ~np.isin(ids, list(self.removed))
+            keys = [key for key, kept in zip(keys, keep.tolist()) if kept]
+            ids, scores = ids[keep], scores[keep]
+        self.keys, self.ids, self.scores = keys, ids, scores
+        self.recent, self.removed = [], set()
+
+    def search(self, prefix, limit):
+        """ Ids of up to `limit` users with a name starting with `prefix`, most followed first """
+        import numpy as np
+
+        prefix = prefix.lower()
+        with self._lock:
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + _END, start)
+            ids, scores = self.ids[start:end], self.scores[start:end]
+            # Recent names go where they sort in the range, keeping name order for ties
+            recent = sorted(entry for entry in self.recent if entry[0].startswith(prefix))
+            positions = [bisect_left(self.keys, name, start, end) - start for name, _, _ in recent]
+            removed = list(self.removed)
+        if recent:
+            ids = np.insert(ids, positions, [user_id for _, user_id, _ in recent])
+            scores = np.insert(scores, positions, [score for _, _, score in recent])
+        if removed:
+            keep = ~np.isin(ids, removed)
+            ids, scores = ids[keep], scores[keep]
+        # A user matching through several names takes several entries
+        take = min(len(ids), limit * 3)
+        if take < len(ids):
+            # Sorted back into name order, so equal counts rank alphabetically
+            best = np.sort(np.argpartition(-scores, take - 1)[:take])
+            ids, scores = ids[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return list(dict.fromkeys(ids[order].tolist()))[:limit]
+
+
+def snapshot():
+    """ A PrefixIndex of every live user, ranked by their follower counters """
+    rows = User.objects.values_list(
+        'id', 'username', 'first_name', 'last_name', 'stats__followers_count'
+    ).iterator(chunk_size=10000)
+    return PrefixIndex(rows)
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = False
+
+
+def _rebuild():
+    global _index, _rebuilding
+    try:
+        _index = snapshot()
+    finally:
+        _rebuilding = False
+        connections.close_all()
+
+
+def get_index():
+    """
+    The index of this process, built from a snapshot on first use. Once it
+    is older than AUTOCOMPLETE_MAX_AGE seconds it is rebuilt in a background
+    thread while the old one keeps serving, which also picks up follower
+    counts and the writes of other processes.
+    """
+    global _index, _rebuilding
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = snapshot()
+    elif time.monotonic() - _index.built_at > getattr(settings, 'AUTOCOMPLETE_MAX_AGE', DEFAULT_MAX_AGE):
+        with _index_lock:
+            if not _rebuilding:
+                _rebuilding = True
+                threading.Thread(target=_rebuild, name='autocomplete', daemon=True).start()
+    return _index
+
+
+def reset_index():
+    global _index
+    _index = None
+
+
+def autocomplete_users(prefix, viewer, first=10):
+    """
+    Up to `first` users `viewer` may see with a username, full name or last
+    name starting with `prefix`, most followed first.
+    """
+    prefix = prefix.strip().lower()
+    first = max(0, min(first, MAX_RESULTS))
+    if not prefix or not first:
+        return []
+    # Room for candidates dropped as blocked, deleted or renamed
+    ids = get_index().search(prefix, first * 2 + 10)
+    users = User.objects.visible_to(viewer).in_bulk(ids)
+    matches = [users[user_id] for user_id in ids if user_id in users and _matches(users[user_id], prefix)]
+    return matches[:first]
+
+
+def _matches(user, prefix):
+    return any(name.startswith(prefix) for name in names_of(user.username, user.first_name, user.last_name))
+
+
+def forget_user(user_id):
+    """ Stop suggesting a deleted or soft-deleted user from this process's index """
+    if _index is not None:
+        _index.remove(user_id)
+
+
+def _user_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    # Only an index this process already built needs the new names
+    if _index is None:
+        return
+    if instance.deleted_at is not None:
+        _index.remove(instance.pk)
+        return
+    if update_fields is not None and not {'username', 'first_name', 'last_name'} & set(update_fields):
+        return
+    # A new account has no followers yet, which spares signup a query
+    score = None if created else UserStats.objects.filter(user_id=instance.pk).values_list('followers_count', flat=True).first()
+    _index.add(instance.pk, names_of(instance.username, instance.first_name, instance.last_name), score or 0)
+
+
+post_save.connect(_user_saved, sender=User, dispatch_uid='users.autocomplete.save')
+
+
+def _user_deleted(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+post_delete.connect(_user_deleted, sender=User, dispatch_uid='users.autocomplete.delete')
@@ -0,0 +1,129 @@
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+
+from helpers.placeholders import placeholder
+from users.cache import invalidate_user
+from users.models import User
+
+logger = logging.getLogger(__name__)
+
+AVATAR_SIZES = (256, 96, 48)
+# Rendition format name -> (Pillow format, file extension)
+AVATAR_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+DEFAULT_FORMAT = 'webp'
+
+_executor = None
+
+
+def render_avatars(source):
+    """
+    Decode `source` once and return {size: {format: bytes}} with a square
+    crop per size in AVATAR_SIZES. Smaller sizes are scaled down from the
+    previous rendition rather than from the original.
+    """
+    # Pillow is only needed by the avatar workers, not at boot
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        renditions = {}
+        for size in AVATAR_SIZES:
+            image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            renditions[size] = {}
+            for name, (pil_format, _) in AVATAR_FORMATS.items():
+                buffer = io.BytesIO()
+                image.save(buffer, format=pil_format, quality=85)
+                renditions[size][name] = buffer.getvalue()
+    return renditions
+
+
+def build_avatars(user_id):
+    """
+    Render and store the avatar renditions of a user's current profile
+    picture. Names are content hashed so they can be cached forever.
+    """
+    user = User.objects.filter(id=user_id).first()
+    if user is None or not user.profile_picture:
+        return None
+
+    picture = user.profile_picture
+    storage = picture.storage
+    with picture.open('rb') as source:
+        rendered = render_avatars(source)
+
+    stored = {}
+    for size, formats in rendered.items():
+        stored[str(size)] = {}
+        for name, data in formats.items():
+            digest = hashlib.sha256(data).hexdigest()[:16]
+            path = f'avatars/{user_id}/{digest}_{size}.{AVATAR_FORMATS[name][1]}'
+            if not storage.exists(path):
+                path = storage.save(path, ContentFile(data))
+            stored[str(size)][name] = path
+
+    # Decoding the smallest rendition is far cheaper than the original again
+    blurhash, color = placeholder(io.BytesIO(rendered[min(rendered)]['jpeg'])) or ('', '')
+
+    # The picture may have been replaced while we were rendering
+    User.objects.filter(id=user_id, profile_picture=picture.name).update(
+        avatar_renditions=stored, picture_blurhash=blurhash, picture_color=color,
+    )
+    invalidate_user(user)
+    return stored
+
+
+def rendition_name(user, size=None, image_format=DEFAULT_FORMAT):
+    """
+    Stored name of the smallest rendition at least `size` pixels wide (the
+    largest one if none is), or None when there are no renditions yet.
+    """
+    renditions = user.avatar_renditions
+    if not renditions:
+        return None
+    sizes = sorted(int(s) for s in renditions)
+    chosen = next((s for s in sizes if size is not None and s >= size), sizes[-1])
+    formats = renditions[str(chosen)]
+    return formats.get(image_format) or formats.get(DEFAULT_FORMAT)
+
+
+def rendition_names(user):
+    return [name for formats in (user.avatar_renditions or {}).values() for name in formats.values()]
+
+
+def _build_in_background(user_id, stale_names):
+    try:
+        stored = build_avatars(user_id) or {}
+        fresh = {name for formats in stored.values() for name in formats.values()}
+        storage = User._meta.get_field('profile_picture').storage
+        for name in set(stale_names) - fresh:
+            storage.delete(name)
+    except Exception:
+        logger.exception("Could not build avatars for user %s", user_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_avatar_build(user):
+    """
+    Drop the renditions of the previous picture and render the new ones on
+    the avatar thread pool once the current transaction commits.
+    """
+    global _executor
+    stale_names = rendition_names(user)
+    User.objects.filter(id=user.id).update(avatar_renditions={}, picture_blurhash='', picture_color='')
+    user.avatar_renditions = {}
+    user.picture_blurhash = user.picture_color = ''
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'AVATAR_WORKERS', 2), thread_name_prefix='avatars'
+        )
+    transaction.on_commit(lambda: _executor.submit(_build_in_background, user.id, stale_names))
@@ -0,0 +1,48 @@
+import copy
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from helpers.cache import get_cache
+from .models import User, is_anonymous, relation
+
+
+def cached_user(user_id):
+    """ The live user `user_id` from the two-tier cache, as a copy the caller may change """
+    user = get_cache().get_or_set('user', user_id, lambda: User.objects.filter(pk=user_id).first())
+    return copy.copy(user)
+
+
+def visible_user(username, viewer):
+    """
+    User.objects.visible_to(viewer).filter(username=username).first(), served
+    from the cache. Only a logged in viewer looking at someone else costs a
+    query, for the block check.
+    """
+    user_id = get_cache().get_or_set(
+        'username', username, lambda: User.objects.filter(username=username).values_list('id', flat=True).first()
+    )
+    user = cached_user(user_id) if user_id is not None else None
+    if user is None or user.username != username:
+        # Renamed or deleted since the name was cached
+        return None
+    if not is_anonymous(viewer) and viewer.id != user.id and relation(viewer, user.id)[0]:
+        return None
+    return user
+
+
+def invalidate_user(user):
+    def invalidate():
+        get_cache().invalidate('user', user.pk)
+        get_cache().invalidate('username', user.username)
+    # Again after commit, in case a concurrent read cached the old row meanwhile
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+def _user_changed(sender, instance, **kwargs):
+    invalidate_user(instance)
+
+
+post_save.connect(_user_changed, sender=User, dispatch_uid='users.cache.save')
+post_delete.connect(_user_changed, sender=User, dispatch_uid='users.cache.delete')
@@ -0,0 +1,47 @@
+import re
+
+from django.db.models import OuterRef, Q
+
+from .models import User, follows
+from .serializer import absolute_media_url
+
+# Hashes per IN (...) query, well under SQLite's bound parameter limit
+CHUNK_SIZE = 500
+MAX_CONTACTS = 10_000
+HASH_RE = re.compile(r'[0-9a-f]{64}')
+
+
+def matchable_users(viewer):
+    """
+    Users contact sync may reveal to `viewer`: not the viewer, no block
+    either way, and private accounts only when the viewer already follows them.
+    """
+    return (
+        User.objects.visible_to(viewer)
+        .exclude(pk=viewer.pk)
+        .filter(Q(private_account=False) | Q(follows(viewer, OuterRef('pk'))))
+    )
+
+
+def match_contacts(viewer, hashes, request=None, chunk_size=CHUNK_SIZE):
+    """
+    The users whose phone_hash is one of `hashes` (see users.models.hash_phone),
+    looked up on the indexed column in chunked IN queries. Each match carries
+    the hash it was found by.
+    """
+    hashes = sorted({h.lower() for h in hashes})
+    users = matchable_users(viewer)
+    storage = User._meta.get_field('profile_picture').storage
+    matches = []
+    for start in range(0, len(hashes), chunk_size):
+        rows = users.filter(phone_hash__in=hashes[start:start + chunk_size]).values(
+            'id', 'username', 'profile_picture', 'phone_hash'
+        )
+        for row in rows:
+            matches.append({
+                'hash': row['phone_hash'],
+                'id': row['id'],
+                'username': row['username'],
+                'profile_image_url': absolute_media_url(request, row['profile_picture'], storage),
+            })
+    return matches
@@ -0,0 +1,205 @@
+import logging
+import secrets
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from posts.models import Post, PostFile, Comment, Reply
+from users.models import User, DataExport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 2000
+# Copy buffer for media files, which are never read whole
+COPY_BUFFER_SIZE = 1024 * 1024
+# A pending or running export untouched for this long lost its worker
+DEFAULT_STALE_AFTER = 3600
+# How often a running export refreshes updated_at to show it is alive
+DEFAULT_HEARTBEAT_INTERVAL = 60
+
+_executor = None
+
+
+def _sections(user_id):
+    """ (file name in the archive, rows) for every kind of data a user owns, rows ordered by id """
+    follows = User.followers.through.objects
+    blocks = User.blocked_users.through.objects
+    return [
+        ('profile.jsonl', User.objects.filter(id=user_id).values(
+            'id', 'username', 'first_name', 'last_name', 'email', 'phone_number', 'bio',
+            'profile_picture', 'private_account', 'date_joined', 'last_login',
+        )),
+        ('posts.jsonl', Post.objects.filter(author_id=user_id).order_by('id').values(
+            'id', 'content', 'post_date', 'edited', 'edited_at',
+        )),
+        ('post_files.jsonl', PostFile.objects.filter(
+            post__author_id=user_id, post__deleted_at__isnull=True,
+        ).order_by('id').values('id', 'post_id', 'file')),
+        ('comments.jsonl', Comment.objects.filter(author_id=user_id).order_by('id').values(
+            'id', 'post_id', 'content', 'comment_date', 'edited', 'edited_at',
+        )),
+        ('replies.jsonl', Reply.objects.filter(author_id=user_id).order_by('id').values(
+            'id', 'comment_id', 'parent_id', 'content', 'reply_date', 'edited', 'edited_at',
+        )),
+        ('post_likes.jsonl', Post.likers.through.objects.filter(user_id=user_id).order_by('id').values('post_id')),
+        ('comment_likes.jsonl', Comment.likers.through.objects.filter(user_id=user_id).order_by('id').values('comment_id')),
+        ('reply_likes.jsonl', Reply.likers.through.objects.filter(user_id=user_id).order_by('id').values('reply_id')),
+        # In the follow table from_user is the followed account and to_user the follower
+        ('followers.jsonl', follows.filter(from_user_id=user_id).order_by('id').values(
+            user_id=F('to_user_id'), username=F('to_user__username'),
+        )),
+        ('following.jsonl', follows.filter(to_user_id=user_id).order_by('id').values(
+            user_id=F('from_user_id'), username=F('from_user__username'),
+        )),
+        ('blocked.jsonl', blocks.filter(from_user_id=user_id).order_by('id').values(
+            user_id=F('to_user_id'), username=F('to_user__username'),
+        )),
+    ]
+
+
+def _media_names(user_id):
+    """ Storage names of the user's profile picture and post files """
+    picture = User.objects.filter(id=user_id).values_list('profile_picture', flat=True).first()
+    if picture:
+        yield picture
+    yield from PostFile.objects.filter(
+        post__author_id=user_id, post__deleted_at__isnull=True,
+    ).exclude(file='').exclude(file__isnull=True).order_by('id').values_list('file', flat=True).iterator()
+
+
+def write_archive(user_id, target, chunk_size=None, progress=None):
+    """
+    Write the data of `user_id` to the binary file `target` as a ZIP: one
+    JSONL file per kind of row and the media files under media/, each
+    streamed into its entry so neither the rows nor the files are held in
+    memory. `progress` is called after every chunk of rows and of file
+    data. Returns the number of rows written.
+    """
+    chunk_size = chunk_size or getattr(settings, 'EXPORT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    storage = PostFile._meta.get_field('file').storage
+    rows = 0
+    with zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, queryset in _sections(user_id):
+            with archive.open(name, 'w', force_zip64=True) as entry:
+                for row in queryset.iterator(chunk_size=chunk_size):
+                    entry.write(encoder.encode(row).encode() + b'\n')
+                    rows += 1
+                    if progress is not None and rows % chunk_size == 0:
+                        progress()
+
+        for name in _media_names(user_id):
+            try:
+                source = storage.open(name, 'rb')
+            except OSError:
+                logger.warning("Could not export missing file %s", name)
+                continue
+            # Pictures and videos are compressed already
+            info = zipfile.ZipInfo(f'media/{name}')
+            info.compress_type = zipfile.ZIP_STORED
+            with source, archive.open(info, 'w', force_zip64=True) as entry:
+                while data := source.read(COPY_BUFFER_SIZE):
+                    entry.write(data)
+                    if progress is not None:
+                        progress()
+    return rows
+
+
+def _heartbeat(export_id):
+    """ A progress callback that refreshes the export's updated_at, at most once per interval """
+    interval = getattr(settings, 'EXPORT_HEARTBEAT_INTERVAL', DEFAULT_HEARTBEAT_INTERVAL)
+    last = time.monotonic()
+
+    def beat():
+        nonlocal last
+        if time.monotonic() - last >= interval:
+            DataExport.objects.filter(id=export_id).update(updated_at=timezone.now())
+            last = time.monotonic()
+    return beat
+
+
+def run_export(export_id):
+    """
+    Build the archive of an export, then drop the archives of its older
+    exports. A heartbeat keeps a long export from being taken as stale.
+    """
+    export = DataExport.objects.get(id=export_id)
+    export.status = DataExport.Status.RUNNING
+    export.save(update_fields=['status', 'updated_at'])
+    try:
+        with tempfile.TemporaryFile() as target:
+            write_archive(export.user_id, target, progress=_heartbeat(export.id))
+            export.size = target.tell()
+            target.seek(0)
+            # Media is served publicly, so the name must not be guessable
+            export.archive.save(f'{export.user_id}-{secrets.token_urlsafe(16)}.zip', File(target), save=False)
+        export.status = DataExport.Status.DONE
+        export.save(update_fields=['archive', 'size', 'status', 'updated_at'])
+    except Exception as e:
+        logger.exception("Export %s failed", export.id)
+        export.status = DataExport.Status.FAILED
+        export.error = str(e)
+        export.save(update_fields=['status', 'error', 'updated_at'])
+        return export
+
+    older = DataExport.objects.filter(user_id=export.user_id, id__lt=export.id)
+    for name in older.exclude(archive='').exclude(archive__isnull=True).values_list('archive', flat=True):
+        export.archive.storage.delete(name)
+    older.delete()
+    return export
+
+
+def _run_in_background(export_id):
+    try:
+        run_export(export_id)
+    finally:
+        connections.close_all()
+
+
+def stale_exports():
+    """
+    Pending or running exports not updated for EXPORT_STALE_AFTER seconds,
+    whose worker died or whose process restarted before it ran them
+    """
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'EXPORT_STALE_AFTER', DEFAULT_STALE_AFTER))
+    return DataExport.objects.filter(
+        status__in=[DataExport.Status.PENDING, DataExport.Status.RUNNING], updated_at__lt=cutoff,
+    )
+
+
+def _submit(export):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'EXPORT_WORKERS', 1), thread_name_prefix='exports'
+        )
+    transaction.on_commit(lambda: _executor.submit(_run_in_background, export.id))
+
+
+def request_export(user):
+    """
+    The pending or running export of `user`, or a new one built on the
+    export thread pool once the current transaction commits. A stale
+    export is queued again rather than waited on forever.
+    """
+    export = DataExport.objects.filter(
+        user=user, status__in=[DataExport.Status.PENDING, DataExport.Status.RUNNING],
+    ).first()
+    if export is not None:
+        if not stale_exports().filter(id=export.id).exists():
+            return export
+        export.status = DataExport.Status.PENDING
+        export.save(update_fields=['status', 'updated_at'])
+    else:
+        export = DataExport.objects.create(user=user)
+    _submit(export)
+    return export
@@ -0,0 +1,59 @@
+import random
+import statistics
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.autocomplete import PrefixIndex
+
+
+class Command(BaseCommand):
+    help = "Benchmark prefix queries on a synthetic in-memory autocomplete index (no database access)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=2_000, help="Queries per prefix length")
+        parser.add_argument('--first', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        letters = string.ascii_lowercase
+        first_names = [''.join(rng.choices(letters, k=rng.randint(3, 8))).title() for _ in range(2_000)]
+        last_names = [''.join(rng.choices(letters, k=rng.randint(4, 10))).title() for _ in range(20_000)]
+
+        # Follower counts are heavy tailed, like on any social network
+        rows = [
+            (
+                user_id,
+                ''.join(rng.choices(letters + string.digits + '_', k=rng.randint(5, 15))),
+                rng.choice(first_names),
+                rng.choice(last_names),
+                int(rng.paretovariate(1.2)),
+            )
+            for user_id in range(1, options['users'] + 1)
+        ]
+
+        started = time.perf_counter()
+        index = PrefixIndex(rows)
+        build_time = time.perf_counter() - started
+        self.stdout.write(f"index: {options['users']:,} users, {len(index):,} names, built in {build_time:.1f} s")
+
+        for length in (1, 2, 3, 5):
+            timings = []
+            for _ in range(options['queries']):
+                name = rng.choice(rows)[rng.randint(1, 3)].lower()
+                prefix = name[:length]
+                started = time.perf_counter()
+                index.search(prefix, options['first'])
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            self.stdout.write(
+                f"prefix of {length}: median {statistics.median(timings) * 1e6:.0f} us, "
+                f"p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f} us"
+            )
+
+        started = time.perf_counter()
+        index.add(options['users'] + 1, {'zz_new_user'}, 0)
+        self.stdout.write(f"insert: {(time.perf_counter() - started) * 1000:.1f} ms")
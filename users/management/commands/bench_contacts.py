@@ -0,0 +1,62 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users.contacts import match_contacts
+from users.models import User, hash_phone
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Time contact sync of a large address book against the indexed phone hashes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50_000)
+        parser.add_argument('--contacts', type=int, default=10_000)
+        parser.add_argument('--hit-rate', type=float, default=0.2, help="Share of contacts that are users")
+        parser.add_argument('--sample', type=int, default=500, help="Contacts looked up one at a time for comparison")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # Seed inside a transaction that is always rolled back
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        numbers = [f'+1555{i:07d}' for i in range(options['users'])]
+        User.objects.bulk_create(
+            (
+                User(username=f'bench-contact-{i}', phone_number=number, phone_hash=hash_phone(number))
+                for i, number in enumerate(numbers)
+            ),
+            batch_size=5000,
+        )
+        viewer = User.objects.create(username='bench-contact-viewer')
+
+        hits = int(options['contacts'] * options['hit_rate'])
+        book = rng.sample(numbers, hits) + [f'+4477{i:08d}' for i in range(options['contacts'] - hits)]
+        hashes = [hash_phone(number) for number in book]
+
+        started = time.perf_counter()
+        matches = match_contacts(viewer, hashes)
+        batched = time.perf_counter() - started
+
+        sample = hashes[:options['sample']]
+        started = time.perf_counter()
+        for digest in sample:
+            list(User.objects.filter(phone_hash=digest).values('id'))
+        one_at_a_time = (time.perf_counter() - started) / len(sample) * len(hashes)
+
+        self.stdout.write(f"{len(hashes)} contacts against {options['users']} users: {len(matches)} matches")
+        self.stdout.write(f"chunked IN queries: {batched * 1000:.1f} ms")
+        self.stdout.write(f"one query per contact (estimated from {len(sample)}): {one_at_a_time * 1000:.1f} ms")
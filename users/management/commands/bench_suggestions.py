@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from users.suggestions import FollowGraph, score_candidates
+
+
+class Command(BaseCommand):
+    help = "Benchmark suggestion scoring on a synthetic follow graph (no database access)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--edges', type=int, default=1_000_000)
+        parser.add_argument('--blocks', type=int, default=10_000)
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument('--sample', type=int, default=2_000, help="Users scored for the timing")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        n, m = options['users'], options['edges']
+
+        # Popular accounts attract most follows, like a real social graph
+        sources = rng.integers(1, n + 1, size=m)
+        targets = np.minimum(rng.zipf(1.3, size=m), n)
+        targets = rng.permutation(n)[targets - 1] + 1
+        blockers = rng.integers(1, n + 1, size=(2, options['blocks']))
+        ids = np.arange(1, n + 1, dtype=np.int64)
+
+        started = time.perf_counter()
+        graph = FollowGraph.from_edges(sources, targets, ids)
+        blocks = FollowGraph.from_edges(
+            np.concatenate(blockers), np.concatenate(blockers[::-1]), ids
+        )
+        build_time = time.perf_counter() - started
+
+        sample = rng.choice(len(graph), size=min(options['sample'], len(graph)), replace=False)
+        started = time.perf_counter()
+        for node in sample:
+            score_candidates(graph, blocks, node, options['top'])
+        score_time = time.perf_counter() - started
+        per_user = score_time / len(sample)
+
+        self.stdout.write(f"graph: {n} users, {len(graph.indices)} edges")
+        self.stdout.write(f"CSR build: {build_time * 1000:.1f} ms")
+        self.stdout.write(f"scoring: {per_user * 1000:.3f} ms/user over {len(sample)} users")
+        self.stdout.write(f"estimated full run: {per_user * n:.1f} s")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from users.suggestions import build_suggestions
+
+
+class Command(BaseCommand):
+    help = "Recompute the friends-of-friends follow suggestions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help="Suggestions stored per user")
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help="Only refresh this user id (can be repeated)",
+        )
+
+    def handle(self, *args, **options):
+        refreshed = build_suggestions(top_n=options['top'], user_ids=options['users'])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed suggestions for {refreshed} users"))
@@ -0,0 +1,94 @@
+import csv
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+
+from users.models import User, hash_phone
+
+FIELDS = ('username', 'email', 'first_name', 'last_name', 'bio', 'phone_number', 'private_account')
+TRUE = {'1', 'true', 'yes'}
+
+
+def read_rows(stream, format):
+    """ Dicts from a CSV (with a header line) or JSONL stream, read lazily """
+    if format == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for number, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise CommandError(f"Line {number} is not valid JSON")
+
+
+def build_user(row, password_hash):
+    values = {name: row[name] for name in FIELDS if row.get(name) not in (None, '')}
+    if isinstance(values.get('private_account'), str):
+        values['private_account'] = values['private_account'].lower() in TRUE
+    # bulk_create skips save(), which keeps phone_hash otherwise
+    return User(password=password_hash, phone_hash=hash_phone(values.get('phone_number')), **values)
+
+
+class Command(BaseCommand):
+    help = (
+        "Create users in bulk from a CSV or JSONL stream (username, password, email, ...), "
+        "hashing the passwords in a process pool; existing usernames are skipped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to read, or - for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Guessed from the extension by default")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--processes', type=int, help="Hashing processes (all cores by default)")
+
+    def new_rows(self, batch):
+        """ The rows of `batch` whose username is not taken, so no hash is wasted on them """
+        names = [row.get('username') for row in batch]
+        if not all(names):
+            raise CommandError("Every row needs a username")
+        taken = set(User.all_objects.filter(username__in=names).values_list('username', flat=True))
+        rows = []
+        for row in batch:
+            if row['username'] not in taken:
+                taken.add(row['username'])
+                rows.append(row)
+        return rows
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+
+        created = seen = 0
+        started = time.perf_counter()
+        try:
+            rows = read_rows(stream, format)
+            with ProcessPoolExecutor(max_workers=options['processes']) as pool:
+                while batch := list(islice(rows, options['batch_size'])):
+                    seen += len(batch)
+                    batch = self.new_rows(batch)
+                    # A row without a password gets an unusable one
+                    hashes = pool.map(make_password, [row.get('password') or None for row in batch], chunksize=32)
+                    users = [build_user(row, password_hash) for row, password_hash in zip(batch, hashes)]
+                    User.objects.bulk_create(users, ignore_conflicts=True)
+                    # ignore_conflicts hides the rows it skipped (a username taken
+                    # meanwhile); every salted hash is unique, so the rows holding
+                    # one of ours are exactly those this run inserted
+                    created += User.all_objects.filter(
+                        username__in=[user.username for user in users], password__in=[user.password for user in users],
+                    ).count()
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"created {created} users, skipped {seen - created} existing usernames "
+            f"in {elapsed:.1f} s ({seen / elapsed if elapsed else 0:,.0f} rows/s)"
+        )
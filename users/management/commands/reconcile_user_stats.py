@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from users.stats import RECONCILE_CHUNK_SIZE, reconcile
+
+
+class Command(BaseCommand):
+    help = "Recount the profile counters in bulk and correct the rows that drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=RECONCILE_CHUNK_SIZE, help="Users recounted per pass"
+        )
+
+    def handle(self, *args, **options):
+        corrected = reconcile(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Corrected stats for {corrected} users"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from users.exports import run_export, stale_exports
+from users.models import DataExport
+
+
+class Command(BaseCommand):
+    help = "Run every data export left pending or running by a worker that is gone"
+
+    def handle(self, *args, **options):
+        for export_id in stale_exports().order_by('id').values_list('id', flat=True):
+            export = run_export(export_id)
+            style = self.style.SUCCESS if export.status == DataExport.Status.DONE else self.style.ERROR
+            self.stdout.write(style(f"{export}: {export.size} bytes"))
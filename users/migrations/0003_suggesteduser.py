@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_bio_user_blocked_users_user_followers_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuggestedUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField()),
+                ('suggested', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='suggestions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-score', 'suggested_id'],
+                'indexes': [models.Index(fields=['user', '-score'], name='suggestion_user_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'suggested'), name='unique_user_suggestion')],
+            },
+        ),
+    ]
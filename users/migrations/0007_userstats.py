@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_user_avatar_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('followers_count', models.IntegerField(default=0)),
+                ('following_count', models.IntegerField(default=0)),
+                ('posts_count', models.IntegerField(default=0)),
+                ('likes_received', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
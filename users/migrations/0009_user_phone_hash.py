@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:07
+
+import hashlib
+import re
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+# Frozen copy of users.models.hash_phone as of this migration
+def hash_phone(number):
+    digits = re.sub(r'\D', '', number or '')
+    return hashlib.sha256(f'+{digits}'.encode()).hexdigest() if digits else None
+
+
+def hash_phone_numbers(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+
+    batch = []
+    users = User.objects.exclude(phone_number__isnull=True).exclude(phone_number='').values_list('id', 'phone_number')
+    for user_id, phone_number in users.iterator(chunk_size=BATCH_SIZE):
+        batch.append(User(id=user_id, phone_hash=hash_phone(phone_number)))
+        if len(batch) >= BATCH_SIZE:
+            User.objects.bulk_update(batch, ['phone_hash'])
+            batch = []
+    User.objects.bulk_update(batch, ['phone_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_user_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='phone_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(hash_phone_numbers, migrations.RunPython.noop),
+    ]
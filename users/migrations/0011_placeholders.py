@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_dataexport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='picture_blurhash',
+            field=models.CharField(blank=True, editable=False, max_length=166),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='picture_color',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+    ]
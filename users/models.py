@@ -1,8 +1,87 @@
+import hashlib
+import re
+
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
 from django.core.validators import RegexValidator
+from django.db.models import BooleanField, Exists, ExpressionWrapper, F, Q
+from django.utils.translation import gettext_lazy as _
+
+from helpers.placeholders import BLURHASH_MAX_LENGTH
 
 phone_number_validator = RegexValidator(regex=r'^\+?1?\d{9,20}$', message="Phone number must be entered in the format: '+ 999999999'. Up to 20 digits allowed.")
+
+
+def normalize_phone(number):
+    """ '+1 (555) 010-9999' -> '+15550109999': a plus and the digits, or None """
+    digits = re.sub(r'\D', '', number or '')
+    return f'+{digits}' if digits else None
+
+
+def hash_phone(number):
+    """
+    SHA-256 hex digest of the normalized number, the form in which contact
+    sync receives address books, or None for no number.
+    """
+    normalized = normalize_phone(number)
+    return hashlib.sha256(normalized.encode()).hexdigest() if normalized else None
+
+
+def is_anonymous(viewer):
+    return viewer is None or not viewer.is_authenticated
+
+
+def follows(viewer, user):
+    """
+    EXISTS subquery that matches when `viewer` follows `user`, which may be an
+    id or an OuterRef. Served by the unique (from_user_id, to_user_id) index.
+    """
+    return Exists(User.followers.through.objects.filter(from_user_id=user, to_user_id=viewer.id))
+
+
+def blocked_between(viewer, user):
+    """
+    Condition that matches when `viewer` blocked `user` or the other way
+    around. Both EXISTS subqueries are served by the unique
+    (from_user_id, to_user_id) index on the blocks table.
+    """
+    blocks = User.blocked_users.through.objects
+    return Q(Exists(blocks.filter(from_user_id=viewer.id, to_user_id=user))) | Q(
+        Exists(blocks.filter(from_user_id=user, to_user_id=viewer.id))
+    )
+
+
+def relation(viewer, user_id):
+    """
+    (blocked either way, viewer follows user) between `viewer` and the user
+    `user_id`, in one query made of the visible_to subqueries.
+    """
+    if is_anonymous(viewer):
+        return False, False
+    return User.all_objects.filter(pk=user_id).values_list(
+        ExpressionWrapper(blocked_between(viewer, user_id), output_field=BooleanField()),
+        follows(viewer, user_id),
+    ).first() or (False, False)
+
+
+class UserQuerySet(models.QuerySet):
+    def visible_to(self, viewer):
+        """ Users `viewer` may see: everyone except accounts on either side of a block """
+        if is_anonymous(viewer):
+            return self
+        return self.exclude(blocked_between(viewer, models.OuterRef('pk')))
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    def get_queryset(self):
+        # Soft-deleted accounts stay hidden until they are purged
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+# Saved without changing what the profile shows
+UNVERSIONED_FIELDS = frozenset({'last_login', 'password'})
+
+
 # Create your models here.
 class User(AbstractUser):
     phone_number = models.CharField(
@@ -11,12 +90,100 @@ class User(AbstractUser):
         null=True, 
         validators=[phone_number_validator]
     )
+    # hash_phone(phone_number), kept by save() and matched by contact sync
+    phone_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True, editable=False)
 
     bio = models.TextField(null=True, blank=True)
     followers = models.ManyToManyField("User", related_name='following', blank=True)
     blocked_users = models.ManyToManyField("User", related_name='blocking', blank=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', null=True, blank=True)
+    # {"<size>": {"webp": name, "jpeg": name}}, built by users.avatars
+    avatar_renditions = models.JSONField(default=dict, blank=True)
+    # Placeholders of the profile picture, set with the renditions
+    picture_blurhash = models.CharField(max_length=BLURHASH_MAX_LENGTH, blank=True, editable=False)
+    picture_color = models.CharField(max_length=7, blank=True, editable=False)
     private_account = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Bumped by saves of profile fields; with updated_at, the validators of conditional GETs
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UserManager()
+    all_objects = models.Manager()
+
+    def save(self, *args, **kwargs):
+        self.phone_hash = hash_phone(self.phone_number)
+        if kwargs.get('update_fields') is not None and 'phone_number' in kwargs['update_fields']:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'phone_hash'}
+        update_fields = kwargs.get('update_fields')
+        # A save that only touches fields outside the profile, such as a
+        # login, keeps the version and so the ETag of the profile
+        bump = not self._state.adding and (update_fields is None or bool(set(update_fields) - UNVERSIONED_FIELDS))
+        if bump:
+            self.version = F('version') + 1
+            if update_fields is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['version'])
+
+    def __str__(self):
+        return self.username
+
+class SuggestedUser(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='suggestions')
+    suggested = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['-score', 'suggested_id']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'suggested'], name='unique_user_suggestion'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score'], name='suggestion_user_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.suggested} for {self.user}"
+
+
+class UserStats(models.Model):
+    """
+    Denormalized profile counters, kept up to date by the write paths and
+    corrected in bulk by the reconcile_user_stats command.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    followers_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
+    posts_count = models.IntegerField(default=0)
+    # Likes on the user's posts
+    likes_received = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats for {self.user_id}"
+
+
+
+class DataExport(models.Model):
+    """
+    A ZIP archive of everything a user has on the site, built in the
+    background by users.exports and downloaded once it is done.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        RUNNING = 'running', _('Running')
+        DONE = 'done', _('Done')
+        FAILED = 'failed', _('Failed')
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='exports')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    archive = models.FileField(upload_to='exports/', null=True, blank=True)
+    size = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return self.username
\ No newline at end of file
+        return f"Export {self.id} of {self.user_id} ({self.status})"
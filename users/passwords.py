@@ -0,0 +1,28 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'PASSWORD_HASHING_WORKERS', 2), thread_name_prefix='passwords'
+                )
+    return _executor
+
+
+def hash_password(raw_password):
+    """
+    make_password() run on a small shared pool. The hasher releases the GIL,
+    so at most PASSWORD_HASHING_WORKERS cores go to hashing however many
+    signups arrive at once, and the other requests keep being served.
+    """
+    return _get_executor().submit(make_password, raw_password).result()
@@ -0,0 +1,31 @@
+from django.db import transaction
+
+from helpers import events
+from users.models import User
+from users.stats import record_follow
+
+
+def set_follow(follower, user, following=True):
+    """
+    Make `follower` follow or unfollow `user`. The counters only move when a
+    follow row is actually created or removed. Returns whether anything changed.
+    """
+    follows = User.followers.through.objects
+    with transaction.atomic():
+        if following:
+            _, changed = follows.get_or_create(from_user_id=user.id, to_user_id=follower.id)
+        else:
+            changed = follows.filter(from_user_id=user.id, to_user_id=follower.id).delete()[0] > 0
+        if changed:
+            record_follow(follower.id, user.id, 1 if following else -1)
+            events.record('follow' if following else 'unfollow', follower.id, user.id)
+    return changed
+
+
+def set_block(user, other, blocked=True):
+    """ Block or unblock `other` on behalf of `user` """
+    if blocked:
+        user.blocked_users.add(other)
+    else:
+        user.blocked_users.remove(other)
+    events.record('block' if blocked else 'unblock', user.id, other.id)
@@ -1,13 +1,81 @@
 from rest_framework import serializers
 from .models import User
+from .passwords import hash_password
 
-class UserSerializer(serializers.ModelSerializer):
+
+def requested_fields(request):
+    """ Field names asked for with ?fields=a,b,c, or None when absent """
+    if request is None:
+        return None
+    fields = request.query_params.get('fields') if hasattr(request, 'query_params') else request.GET.get('fields')
+    if not fields:
+        return None
+    return {name.strip() for name in fields.split(',') if name.strip()}
+
+
+def absolute_media_url(request, field_file_or_name, storage):
+    """ Absolute URL of a stored file, the way DRF's FileField renders it """
+    if not field_file_or_name:
+        return None
+    url = storage.url(str(field_file_or_name))
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+class SparseFieldsMixin:
+    """
+    Render only the fields listed in the request's ?fields= parameter.
+    Applies to the top-level serializer only; input handling is unchanged.
+    """
+
+    @property
+    def _readable_fields(self):
+        requested = requested_fields(self.context.get('request')) if self.parent is None else None
+        for field in super()._readable_fields:
+            if requested is None or field.field_name in requested:
+                yield field
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'bio', 'password', 'first_name', 'last_name', 'email', 'profile_picture', 'private_account', 'is_staff', 'is_active', 'phone_number']
+        extra_kwargs = {'password': {'write_only': True}}
 
     def create(self, validated_data):
-        user = User.objects.create(**validated_data)
-        user.set_password(validated_data['password'])
-        user.save()
-        return user
\ No newline at end of file
+        # One hash and one INSERT
+        validated_data['password'] = hash_password(validated_data['password'])
+        return User.objects.create(**validated_data)
+
+    def update(self, instance, validated_data):
+        if 'password' in validated_data:
+            validated_data['password'] = hash_password(validated_data['password'])
+        return super().update(instance, validated_data)
+
+
+class UserCardSerializer(serializers.ModelSerializer):
+    """ The few author fields a post, comment or reply needs to render """
+    profile_image_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'profile_image_url']
+
+    def get_profile_image_url(self, user):
+        return absolute_media_url(self.context.get('request'), user.profile_picture, user.profile_picture.storage)
+
+
+USER_VALUE_FIELDS = [name for name in UserSerializer.Meta.fields if name != 'password']
+
+
+def user_rows(queryset, request=None):
+    """
+    Fast read path: the UserSerializer representation built from .values()
+    rows, without instantiating models or serializer fields.
+    """
+    requested = requested_fields(request)
+    fields = [name for name in USER_VALUE_FIELDS if requested is None or name in requested]
+    storage = User._meta.get_field('profile_picture').storage
+    for row in queryset.values(*fields):
+        if 'profile_picture' in row:
+            row['profile_picture'] = absolute_media_url(request, row['profile_picture'], storage)
+        yield row
@@ -0,0 +1,126 @@
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from posts.models import Post
+from users.models import User, UserStats
+
+COUNTER_FIELDS = ('followers_count', 'following_count', 'posts_count', 'likes_received')
+RECONCILE_CHUNK_SIZE = 5000
+
+
+def count_stats(user_ids):
+    """
+    Exact counters for `user_ids`, one GROUP BY query per counter. Rows that
+    involve a soft-deleted user or post are left out, as they are hidden.
+    """
+    follows = User.followers.through.objects.filter(
+        from_user__deleted_at__isnull=True, to_user__deleted_at__isnull=True
+    )
+    passes = {
+        # `from_user` is the followed account, `to_user` the follower
+        'followers_count': follows.filter(from_user_id__in=user_ids).values_list('from_user_id'),
+        'following_count': follows.filter(to_user_id__in=user_ids).values_list('to_user_id'),
+        'posts_count': Post.objects.filter(author_id__in=user_ids).values_list('author_id'),
+        'likes_received': Post.likers.through.objects.filter(
+            post__author_id__in=user_ids, post__deleted_at__isnull=True, user__deleted_at__isnull=True
+        ).values_list('post__author_id'),
+    }
+    counts = {user_id: dict.fromkeys(COUNTER_FIELDS, 0) for user_id in user_ids}
+    for field, queryset in passes.items():
+        for user_id, count in queryset.annotate(count=Count('pk')).order_by():
+            counts[user_id][field] = count
+    return counts
+
+
+def stats_for(user):
+    """ The stats row of `user`, computed on first access """
+    stats = UserStats.objects.filter(user_id=user.id).first()
+    if stats is None:
+        UserStats.objects.bulk_create(
+            [UserStats(user_id=user.id, **count_stats([user.id])[user.id])], ignore_conflicts=True
+        )
+        stats = UserStats.objects.get(user_id=user.id)
+    return stats
+
+
+def adjust(user_id, **deltas):
+    """
+    Add `deltas` to the counters of `user_id` with a single UPDATE. A user
+    without a stats row gets one counted from scratch, which already
+    includes the change being recorded.
+    """
+    updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if not updates:
+        return
+    if not UserStats.objects.filter(user_id=user_id).update(updated_at=timezone.now(), **updates):
+        UserStats.objects.bulk_create(
+            [UserStats(user_id=user_id, **count_stats([user_id])[user_id])], ignore_conflicts=True
+        )
+
+
+def record_follow(follower_id, followed_id, delta):
+    adjust(followed_id, followers_count=delta)
+    adjust(follower_id, following_count=delta)
+
+
+def record_post(author_id, delta):
+    adjust(author_id, posts_count=delta)
+
+
+def record_post_like(author_id, delta):
+    adjust(author_id, likes_received=delta)
+
+
+def record_post_deleted(post):
+    record_post(post.author_id, -1)
+    # Likes of deleted accounts already left the count with record_user_deleted()
+    record_post_like(post.author_id, -post.likers.filter(deleted_at__isnull=True).count())
+
+
+def record_user_deleted(user):
+    """ Take a deleted account out of the counters of the accounts around it """
+    now = timezone.now()
+    UserStats.objects.filter(user__followers=user).update(followers_count=F('followers_count') - 1, updated_at=now)
+    UserStats.objects.filter(user__following=user).update(following_count=F('following_count') - 1, updated_at=now)
+    liked = (
+        Post.likers.through.objects.filter(user_id=user.id, post__deleted_at__isnull=True)
+        .exclude(post__author_id=user.id)
+        .values_list('post__author_id')
+        .annotate(count=Count('pk'))
+        .order_by()
+    )
+    for author_id, count in liked:
+        record_post_like(author_id, -count)
+
+
+def reconcile(chunk_size=RECONCILE_CHUNK_SIZE):
+    """
+    Recount every user's stats in chunks of user ids and rewrite the rows
+    that drifted. Returns the number of rows corrected or created.
+    """
+    corrected = 0
+    last_id = 0
+    while True:
+        user_ids = list(
+            User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not user_ids:
+            return corrected
+        last_id = user_ids[-1]
+
+        counts = count_stats(user_ids)
+        current = {
+            row[0]: dict(zip(COUNTER_FIELDS, row[1:]))
+            for row in UserStats.objects.filter(user_id__in=user_ids).values_list('user_id', *COUNTER_FIELDS)
+        }
+        drifted = [
+            UserStats(user_id=user_id, **values)
+            for user_id, values in counts.items()
+            if current.get(user_id) != values
+        ]
+        with transaction.atomic():
+            UserStats.objects.bulk_create(
+                drifted, update_conflicts=True, unique_fields=['user'], update_fields=[*COUNTER_FIELDS, 'updated_at']
+            )
+        corrected += len(drifted)
@@ -0,0 +1,174 @@
+from itertools import chain
+
+import numpy as np
+from django.db import transaction
+
+from users.models import User, SuggestedUser
+
+EDGE_CHUNK_SIZE = 10000
+WRITE_BATCH_SIZE = 1000
+
+
+class FollowGraph:
+    """
+    A directed graph in compressed sparse row form.
+
+    Nodes are positions in `ids` (sorted user ids); the neighbours of node i
+    are `indices[indptr[i]:indptr[i + 1]]`.
+    """
+
+    def __init__(self, ids, indptr, indices):
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def from_edges(cls, sources, targets, ids=None):
+        """
+        Build the graph from parallel arrays of user ids, one edge per position.
+        Edges touching an id that is not in `ids` are dropped.
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        if ids is None:
+            ids = np.unique(np.concatenate([sources, targets]))
+        ids = np.asarray(ids, dtype=np.int64)
+
+        known = np.isin(sources, ids) & np.isin(targets, ids)
+        src = np.searchsorted(ids, sources[known])
+        dst = np.searchsorted(ids, targets[known])
+
+        order = np.lexsort((dst, src))
+        src, dst = src[order], dst[order]
+
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(ids)), out=indptr[1:])
+        return cls(ids, indptr, dst.astype(np.int32))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def node(self, user_id):
+        """ Position of `user_id` in the graph, or None if it is unknown """
+        pos = np.searchsorted(self.ids, user_id)
+        if pos < len(self.ids) and self.ids[pos] == user_id:
+            return int(pos)
+        return None
+
+    def neighbours(self, node):
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def second_degree(self, node):
+        """
+        Return (candidates, counts): every node reachable in two hops and the
+        number of distinct paths leading to it.
+        """
+        first = self.neighbours(node)
+        starts = self.indptr[first]
+        lengths = self.indptr[first + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+
+        # Gather all neighbour slices in one vectorized indexing operation
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(total)
+        return np.unique(self.indices[offsets], return_counts=True)
+
+
+def _edge_array(queryset):
+    flat = chain.from_iterable(queryset.iterator(chunk_size=EDGE_CHUNK_SIZE))
+    return np.fromiter(flat, dtype=np.int64).reshape(-1, 2)
+
+
+def load_follow_graph():
+    """ Graph with an edge from every user to each account they follow """
+    ids = np.fromiter(User.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+    # `from_user` is the followed account, `to_user` the follower
+    edges = _edge_array(User.followers.through.objects.values_list('to_user_id', 'from_user_id'))
+    return FollowGraph.from_edges(edges[:, 0], edges[:, 1], ids)
+
+
+def load_block_graph(ids):
+    """ Symmetric graph linking every pair of users where one blocked the other """
+    edges = _edge_array(User.blocked_users.through.objects.values_list('from_user_id', 'to_user_id'))
+    sources = np.concatenate([edges[:, 0], edges[:, 1]])
+    targets = np.concatenate([edges[:, 1], edges[:, 0]])
+    return FollowGraph.from_edges(sources, targets, ids)
+
+
+def score_candidates(graph, blocks, node, top_n):
+    """
+    Rank second-degree accounts for `node` by how many of the accounts it
+    follows also follow them. Returns (user_ids, scores), best first.
+    """
+    candidates, counts = graph.second_degree(node)
+    if not len(candidates):
+        return candidates, counts
+
+    keep = candidates != node
+    keep &= ~np.isin(candidates, graph.neighbours(node))
+    keep &= ~np.isin(candidates, blocks.neighbours(node))
+    candidates, counts = candidates[keep], counts[keep]
+
+    if len(candidates) > top_n:
+        best = np.argpartition(-counts, top_n - 1)[:top_n]
+        candidates, counts = candidates[best], counts[best]
+
+    order = np.lexsort((candidates, -counts))
+    return graph.ids[candidates[order]], counts[order]
+
+
+def build_suggestions(top_n=20, user_ids=None):
+    """
+    Recompute and store the top `top_n` suggestions for every user, or only
+    for `user_ids` when given. Returns the number of users refreshed.
+    """
+    graph = load_follow_graph()
+    blocks = load_block_graph(graph.ids)
+
+    if user_ids is None:
+        nodes = range(len(graph))
+    else:
+        nodes = [n for n in (graph.node(user_id) for user_id in user_ids) if n is not None]
+
+    refreshed = 0
+    batch_users, batch_rows = [], []
+    for node in nodes:
+        user_id = int(graph.ids[node])
+        suggested, scores = score_candidates(graph, blocks, node, top_n)
+        batch_users.append(user_id)
+        batch_rows.extend(
+            SuggestedUser(user_id=user_id, suggested_id=int(s), score=int(c))
+            for s, c in zip(suggested, scores)
+        )
+        if len(batch_rows) >= WRITE_BATCH_SIZE or len(batch_users) >= WRITE_BATCH_SIZE:
+            _store(batch_users, batch_rows)
+            refreshed += len(batch_users)
+            batch_users, batch_rows = [], []
+
+    if batch_users:
+        _store(batch_users, batch_rows)
+        refreshed += len(batch_users)
+    return refreshed
+
+
+def _store(user_ids, rows):
+    with transaction.atomic():
+        SuggestedUser.objects.filter(user_id__in=user_ids).delete()
+        SuggestedUser.objects.bulk_create(rows)
+
+
+def suggested_users_for(user, first=10):
+    """
+    Stored suggestions for `user`, skipping accounts followed or blocked since
+    the last build.
+    """
+    suggestions = (
+        SuggestedUser.objects.filter(user=user)
+        .exclude(suggested__followers=user)
+        .exclude(suggested__blocked_users=user)
+        .exclude(suggested__blocking=user)
+        .select_related('suggested')[:first]
+    )
+    return [s.suggested for s in suggestions]
@@ -1,7 +1,32 @@
-from rest_framework.test import APITestCase
+import tempfile
+import threading
+import time
+import zipfile
+from io import StringIO
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.utils import timezone
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, APITestCase
 from rest_framework import status
-from users.models import User
+from users.models import User, SuggestedUser, UserStats, DataExport, hash_phone
+from users.stats import reconcile, stats_for
+from posts.models import Post, PostFile, Comment
+from posts.purge import soft_delete
+from users.suggestions import build_suggestions
+from users.avatars import build_avatars, rendition_name
 from django.urls import reverse
+from helpers.throttling import LocalBucketStore, TokenBucketThrottle, get_store
+from helpers.events import ALL_EVENTS, get_writer, read_events, rollup_day
+from helpers.loadtest import seed, summarize
+from helpers.cache import TwoTierCache
+from users.autocomplete import PrefixIndex, autocomplete_users, get_index, reset_index
+from users import exports
+from users.exports import run_export, stale_exports
+from posts.purge import run_purge_job
 from helpers.util import *
 
 class UserTests(APITestCase):
@@ -33,6 +58,27 @@ class UserTests(APITestCase):
         self.assertEqual(User.objects.count(), 2)
         self.assertEqual(User.objects.get(username='newuser').email, 'newuser@example.com')
 
+    def test_create_user_hashes_the_password_once(self):
+        data = {'username': 'newuser', 'password': 'newpassword123'}
+        # The unique username check, then a single INSERT
+        with mock.patch('users.passwords.make_password', wraps=make_password) as hasher, \
+                self.assertNumQueries(2):
+            response = self.client.post(self.url, data, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(hasher.call_count, 1)
+        self.assertTrue(User.objects.get(username='newuser').check_password('newpassword123'))
+
+    def test_update_hashes_the_new_password(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.user))
+        url = reverse('user-details', kwargs={'id': self.user.id})
+        response = self.client.put(url, {'username': 'testuser', 'password': 'changed123'}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertNotEqual(self.user.password, 'changed123')
+        self.assertTrue(self.user.check_password('changed123'))
+
     def test_get_user(self):
         """
         Test retrieving a user by ID (GET request).
@@ -44,6 +90,42 @@ class UserTests(APITestCase):
         self.assertEqual(response.data['username'], self.user.username)
         self.assertEqual(response.data['email'], self.user.email)
 
+    def test_get_user_never_exposes_password(self):
+        url = reverse('user-details', kwargs={'id': self.user.id})
+        response = self.client.get(url)
+
+        self.assertNotIn('password', response.data)
+        self.assertTrue(response.data['profile_picture'].startswith('http://testserver/media/profile_pictures/'))
+
+    def test_get_user_sparse_fieldset(self):
+        url = reverse('user-details', kwargs={'id': self.user.id})
+        response = self.client.get(url, {'fields': 'id,username'})
+
+        self.assertEqual(response.data, {'id': self.user.id, 'username': 'testuser'})
+
+    def test_get_user_conditional(self):
+        url = reverse('user-details', kwargs={'id': self.user.id})
+        first = self.client.get(url)
+        self.assertTrue(first['ETag'].startswith('W/'))
+        self.assertIn('Last-Modified', first)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Logging in saves last_login alone: one query, same version
+        self.user.last_login = timezone.now()
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=['last_login'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.user.bio = "changed"
+        self.user.save(update_fields=['bio'])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
     def test_get_user_not_found(self):
         """
         Test retrieving a user that does not exist (GET request).
@@ -170,6 +252,14 @@ class FollowUnfollowUserTest(APITestCase):
         self.user2.refresh_from_db()
         self.assertIn(self.user1, self.user2.followers.all())
 
+    def test_blocked_user_cannot_follow(self):
+        self.user2.blocked_users.add(self.user1)
+
+        response = self.client.post(self.follow_url)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(self.user2.followers.exists())
+
     def test_unfollow_user(self):
         """Test unfollowing a user."""
         # First, follow user2
@@ -238,4 +328,620 @@ class BlockUnblockUserTest(APITestCase):
         response = self.client.post(invalid_url)
 
         # Check that the response is a 404 Not Found
-        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class SuggestionTests(APITestCase):
+    def setUp(self):
+        self.alice, self.bob, self.carol, self.dave, self.erin = [
+            User.objects.create_user(username=name, password="password")
+            for name in ("alice", "bob", "carol", "dave", "erin")
+        ]
+        # alice follows bob and carol, who both follow dave; bob also follows erin
+        self.bob.followers.add(self.alice)
+        self.carol.followers.add(self.alice)
+        self.dave.followers.add(self.bob, self.carol)
+        self.erin.followers.add(self.bob)
+
+    def test_candidates_ranked_by_mutual_follows(self):
+        """Second-degree accounts are scored by the number of mutual follows."""
+        build_suggestions(top_n=10)
+
+        suggestions = list(SuggestedUser.objects.filter(user=self.alice).values_list('suggested__username', 'score'))
+        self.assertEqual(suggestions, [('dave', 2), ('erin', 1)])
+
+    def test_followed_and_blocked_accounts_are_excluded(self):
+        """Accounts already followed or blocked in either direction are never suggested."""
+        self.dave.followers.add(self.alice)
+        self.erin.blocked_users.add(self.alice)
+        build_suggestions(top_n=10)
+
+        self.assertFalse(SuggestedUser.objects.filter(user=self.alice).exists())
+
+    def test_incremental_refresh_only_touches_given_users(self):
+        """Refreshing a subset of users leaves other stored suggestions alone."""
+        build_suggestions(top_n=10)
+        self.erin.followers.remove(self.bob)
+        build_suggestions(top_n=10, user_ids=[self.bob.id])
+
+        self.assertEqual(SuggestedUser.objects.filter(user=self.alice).count(), 2)
+
+
+def throttle_rates(**rates):
+    """ REST_FRAMEWORK settings with only the given throttle rates """
+    return {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}
+
+
+class ThrottleTest(APITestCase):
+    def setUp(self):
+        get_store().clear()
+        self.user1 = User.objects.create_user(username="user1", password="password")
+        self.user2 = User.objects.create_user(username="user2", password="password")
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.user1))
+        self.follow_url = reverse('follow', kwargs={'id': self.user2.id})
+
+    def tearDown(self):
+        get_store().clear()
+
+    def test_user_bucket_throttles_bursts(self):
+        with override_settings(REST_FRAMEWORK=throttle_rates(follows='2/min')):
+            self.assertEqual(self.client.post(self.follow_url).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.post(self.follow_url).status_code, status.HTTP_200_OK)
+            response = self.client.post(self.follow_url)
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+    def test_ip_bucket_is_shared_across_users(self):
+        with override_settings(REST_FRAMEWORK=throttle_rates(blocks_ip='1/min')):
+            first = self.client.post(reverse('block', kwargs={'id': self.user2.id}))
+            self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.user2))
+            second = self.client.post(reverse('block', kwargs={'id': self.user1.id}))
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_base_bucket_is_keyed_by_client_address(self):
+        request = APIRequestFactory().post('/', REMOTE_ADDR='10.0.0.7')
+        self.assertEqual(TokenBucketThrottle().get_ident_key(request), '10.0.0.7')
+
+        view = type('View', (), {'throttle_scope': 'follows'})()
+        with override_settings(REST_FRAMEWORK=throttle_rates(follows='1/min')):
+            self.assertTrue(TokenBucketThrottle().allow_request(request, view))
+            self.assertFalse(TokenBucketThrottle().allow_request(request, view))
+
+    def test_bucket_refills_over_time(self):
+        store = LocalBucketStore()
+        self.assertEqual(store.consume('key', 1, 1000.0), (True, 0.0))
+        self.assertFalse(store.consume('key', 1, 1000.0)[0])
+
+        time.sleep(0.01)
+        self.assertTrue(store.consume('key', 1, 1000.0)[0])
+
+    def test_local_store_size_is_capped(self):
+        store = LocalBucketStore(shards=1, max_keys_per_shard=3)
+        store.consume('kept', 1, 0.001)
+        for i in range(100):
+            store.consume(f'spray-{i}', 1, 0.001)
+            store.consume('kept', 1, 0.001)
+
+        buckets = store._shards[0][0]
+        self.assertEqual(len(buckets), 3)
+        # Recently used buckets survive the spray, still empty
+        self.assertFalse(store.consume('kept', 1, 0.001)[0])
+
+
+class AvatarTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="avatar", password="password", profile_picture=create_dummy_image())
+
+    def test_build_avatars_stores_square_renditions(self):
+        stored = build_avatars(self.user.id)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_renditions, stored)
+        self.assertEqual(set(stored), {'48', '96', '256'})
+        storage = self.user.profile_picture.storage
+        for size, formats in stored.items():
+            self.assertEqual(set(formats), {'webp', 'jpeg'})
+            with Image.open(storage.open(formats['webp'])) as image:
+                self.assertEqual(image.size, (int(size), int(size)))
+                self.assertEqual(image.format, 'WEBP')
+        self.assertEqual(len(self.user.picture_blurhash), 28)
+        self.assertEqual(self.user.picture_color, '#fe0000')
+
+    def test_rendition_choice(self):
+        build_avatars(self.user.id)
+        self.user.refresh_from_db()
+
+        self.assertTrue(rendition_name(self.user, 60).endswith('_96.webp'))
+        self.assertTrue(rendition_name(self.user, 48, 'jpeg').endswith('_48.jpg'))
+        self.assertTrue(rendition_name(self.user, 1024).endswith('_256.webp'))
+
+    def test_upload_schedules_build_after_commit(self):
+        build_avatars(self.user.id)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.user))
+        url = reverse('user-details', kwargs={'id': self.user.id})
+        data = {'username': 'avatar', 'password': 'password', 'profile_picture': create_dummy_image()}
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.put(url, data, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The avatar build and the cache invalidation of the saved user
+        self.assertEqual(len(callbacks), 2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_renditions, {})
+        self.assertEqual(self.user.picture_blurhash, '')
+
+
+class UserStatsTest(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice", password="password")
+        self.bob = User.objects.create_user(username="bob", password="password")
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.bob))
+
+    def counters(self, user):
+        stats = UserStats.objects.get(user=user)
+        return stats.followers_count, stats.following_count, stats.posts_count, stats.likes_received
+
+    def test_write_paths_update_counters(self):
+        stats_for(self.alice), stats_for(self.bob)
+        follow_url = reverse('follow', kwargs={'id': self.alice.id})
+        self.client.post(follow_url)
+        self.client.post(follow_url)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.alice))
+        response = self.client.post(reverse('post-details'), {'content': 'hi'}, format='multipart')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.bob))
+        self.client.post(reverse('post-like', kwargs={'id': response.data['id']}))
+
+        self.assertEqual(self.counters(self.alice), (1, 0, 1, 1))
+        self.assertEqual(self.counters(self.bob), (0, 1, 0, 0))
+
+        self.client.delete(reverse('post-like', kwargs={'id': response.data['id']}))
+        self.client.delete(follow_url)
+        self.client.delete(follow_url)
+        self.assertEqual(self.counters(self.alice), (0, 0, 1, 0))
+        self.assertEqual(self.counters(self.bob), (0, 0, 0, 0))
+
+    def test_missing_row_is_counted_from_scratch(self):
+        Post.objects.create(author=self.alice, content="one").likers.add(self.bob)
+        self.alice.followers.add(self.bob)
+
+        stats = stats_for(self.alice)
+        self.assertEqual((stats.followers_count, stats.posts_count, stats.likes_received), (1, 1, 1))
+
+    def test_deleting_an_account_updates_its_neighbours(self):
+        post = Post.objects.create(author=self.alice, content="one")
+        stats_for(self.alice), stats_for(self.bob)
+        self.client.post(reverse('follow', kwargs={'id': self.alice.id}))
+        self.client.post(reverse('post-like', kwargs={'id': post.id}))
+
+        with self.captureOnCommitCallbacks():
+            self.client.delete(reverse('user-details', kwargs={'id': self.bob.id}))
+
+        self.assertEqual(self.counters(self.alice), (0, 0, 1, 0))
+
+    def test_deleting_a_post_after_its_liker(self):
+        post = Post.objects.create(author=self.alice, content="one")
+        carol = User.objects.create_user(username="carol", password="password")
+        stats_for(self.alice)
+        self.client.post(reverse('post-like', kwargs={'id': post.id}))
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(carol))
+        self.client.post(reverse('post-like', kwargs={'id': post.id}))
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.bob))
+        with self.captureOnCommitCallbacks():
+            self.client.delete(reverse('user-details', kwargs={'id': self.bob.id}))
+        self.assertEqual(self.counters(self.alice)[3], 1)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.alice))
+        with self.captureOnCommitCallbacks():
+            self.client.delete(reverse('post-details', kwargs={'id': post.id}))
+        # Bob's like left the count with his account, so only Carol's goes now
+        self.assertEqual(self.counters(self.alice), (0, 0, 0, 0))
+
+    def test_reconcile_only_rewrites_drifted_rows(self):
+        Post.objects.create(author=self.alice, content="one")
+        stats_for(self.alice), stats_for(self.bob)
+        UserStats.objects.filter(user=self.alice).update(posts_count=7, likes_received=-2)
+
+        self.assertEqual(reconcile(chunk_size=1), 1)
+        self.assertEqual(self.counters(self.alice), (0, 0, 1, 0))
+        self.assertEqual(reconcile(), 0)
+
+
+class ActivityEventTest(APITestCase):
+    def setUp(self):
+        self.events_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.events_dir.cleanup)
+        override = override_settings(EVENTS_DIR=self.events_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.alice = User.objects.create_user(username="alice", password="password")
+        self.bob = User.objects.create_user(username="bob", password="password", is_staff=True)
+        self.post = Post.objects.create(author=self.alice, content="post")
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.bob))
+
+    def write_activity(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('follow', kwargs={'id': self.alice.id}))
+            self.client.post(reverse('follow', kwargs={'id': self.alice.id}))
+            self.client.post(reverse('post-like', kwargs={'id': self.post.id}))
+            self.client.post(reverse('post-details'), {'content': 'hello'}, format='multipart')
+        self.assertTrue(get_writer().flush())
+
+    def test_writes_are_appended_to_the_daily_file(self):
+        self.write_activity()
+
+        events = list(read_events(timezone.now().date()))
+        self.assertEqual([(e['kind'], e['actor']) for e in events], [('follow', self.bob.id), ('like', self.bob.id), ('post', self.bob.id)])
+        self.assertEqual(events[1]['target'], self.post.id)
+
+    def test_rolled_back_writes_leave_no_event(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post-like', kwargs={'id': 999999}))
+        get_writer().flush()
+
+        self.assertEqual(list(read_events(timezone.now().date())), [])
+
+    def test_hourly_rollup_and_admin_endpoint(self):
+        self.write_activity()
+        rollup_day(timezone.now().date())
+        self.assertEqual(rollup_day(timezone.now().date()), 4)
+
+        response = self.client.get(reverse('event-rollups'), {'kind': f'like,{ALL_EVENTS}'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(r['kind'], r['events'], r['actors']) for r in response.data], [(ALL_EVENTS, 3, 1), ('like', 1, 1)])
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.alice))
+        self.assertEqual(self.client.get(reverse('event-rollups')).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class LoadTestTest(APITestCase):
+    def test_seeded_tokens_authenticate(self):
+        fixtures = seed(users=5, posts=10, follows=2, likes=3)
+        self.assertEqual(len(fixtures['users']), 5)
+        self.assertEqual(len(fixtures['posts']), 10)
+
+        user = fixtures['users'][0]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {user['token']}")
+        response = self.client.post(reverse('follow', kwargs={'id': fixtures['users'][1]['id']}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_summarize(self):
+        samples = [('like', 201, float(ms), 1.0, 3, 0) for ms in range(1, 101)]
+        samples += [('like', 500, 200.0, 5.0, 2, 1), ('follow', 429, 1.0, 0.0, 0, 0)]
+        rows = {row['endpoint']: row for row in summarize(samples, elapsed=2)}
+
+        self.assertEqual(rows['like']['requests'], 101)
+        self.assertEqual(rows['like']['p50'], 51.0)
+        self.assertEqual(rows['like']['p99'], 100.0)
+        self.assertAlmostEqual(rows['like']['errors'], 1 / 101)
+        self.assertEqual(rows['like']['locked'], 1)
+        self.assertEqual(rows['follow']['throttled'], 1)
+        self.assertEqual(rows['total']['requests'], 102)
+        self.assertEqual(rows['total']['rps'], 51)
+
+
+class TwoTierCacheTest(APITestCase):
+    def setUp(self):
+        self.cache = TwoTierCache(max_entries=2)
+        self.cache.clear()
+
+    def test_values_and_none_are_cached_until_invalidated(self):
+        loads = []
+        loader = lambda: loads.append(1) or None
+
+        self.assertIsNone(self.cache.get_or_set('post', 1, loader))
+        self.assertIsNone(self.cache.get_or_set('post', 1, loader))
+        self.assertEqual(len(loads), 1)
+
+        self.cache.invalidate('post', 1)
+        self.assertEqual(self.cache.get_or_set('post', 1, lambda: 'fresh'), 'fresh')
+
+    def test_invalidation_reaches_other_processes(self):
+        other = TwoTierCache(max_entries=2, local_ttl=0)
+        self.cache.get_or_set('user', 1, lambda: 'old')
+        self.assertEqual(other.get_or_set('user', 1, lambda: 'unused'), 'old')
+
+        self.cache.invalidate('user', 1)
+        self.assertEqual(other.get_or_set('user', 1, lambda: 'new'), 'new')
+
+    def test_local_tier_is_bounded(self):
+        for key in range(3):
+            self.cache.get_or_set('post', key, lambda: key)
+        self.assertEqual(list(self.cache._local), ['post:1', 'post:2'])
+
+    def test_concurrent_misses_load_once(self):
+        loads = []
+        started = threading.Event()
+
+        def loader():
+            loads.append(1)
+            started.set()
+            time.sleep(0.1)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_or_set('post', 7, loader))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(results, ['value'] * 8)
+
+
+class ContactSyncTest(APITestCase):
+    def setUp(self):
+        get_store().clear()
+        self.viewer = User.objects.create_user(username='viewer', password='password', phone_number='+15550000000')
+        self.friend = User.objects.create_user(username='friend', password='password', phone_number='+1 555 000 0001')
+        self.private = User.objects.create_user(username='private', password='password', phone_number='15550000002', private_account=True)
+        self.blocker = User.objects.create_user(username='blocker', password='password', phone_number='+15550000003')
+        self.blocker.blocked_users.add(self.viewer)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.viewer))
+        self.url = reverse('contact-sync')
+
+    def sync(self, numbers):
+        return self.client.post(self.url, {'hashes': [hash_phone(n) for n in numbers]}, format='json')
+
+    def test_hash_is_kept_by_save(self):
+        self.assertEqual(self.friend.phone_hash, hash_phone('+15550000001'))
+        self.friend.phone_number = '+15550000009'
+        self.friend.save(update_fields=['phone_number'])
+        self.friend.refresh_from_db()
+        self.assertEqual(self.friend.phone_hash, hash_phone('+1 (555) 000-0009'))
+
+    def test_matches_visible_users(self):
+        response = self.sync(['+1 (555) 000-0000', '+15550000001', '+15550000002', '+15550000003', '+15559999999'])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(m['username'], m['hash']) for m in response.data['matches']],
+            [('friend', hash_phone('+15550000001'))],
+        )
+
+        self.private.followers.add(self.viewer)
+        response = self.sync(['+15550000002'])
+        self.assertEqual([m['username'] for m in response.data['matches']], ['private'])
+
+    def test_matches_across_chunks(self):
+        numbers = [f'+1555100{i:04d}' for i in range(1200)]
+        User.objects.bulk_create(
+            User(username=f'contact{i}', phone_number=number, phone_hash=hash_phone(number))
+            for i, number in enumerate(numbers)
+        )
+        with self.assertNumQueries(4):
+            # The token user, then three chunks of 500
+            response = self.sync(numbers)
+        self.assertEqual(len(response.data['matches']), 1200)
+
+    def test_rejects_bad_input(self):
+        response = self.client.post(self.url, {'hashes': ['+15550000001']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(self.url, {'hashes': [hash_phone('1')] * 10_001}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProvisionUsersTest(APITestCase):
+    def test_provision_from_csv(self):
+        User.objects.create_user(username='taken', password='password')
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write("username,password,email,phone_number,private_account\n")
+            file.write("alice,secret1,alice@example.com,+15550001111,true\n")
+            file.write("bob,,,,\n")
+            file.write("taken,other,,,\n")
+
+        out = StringIO()
+        call_command('provision_users', file.name, processes=1, stdout=out)
+
+        self.assertIn("created 2 users, skipped 1", out.getvalue())
+        alice = User.objects.get(username='alice')
+        self.assertTrue(alice.check_password('secret1'))
+        self.assertTrue(alice.private_account)
+        self.assertEqual(alice.phone_hash, hash_phone('+15550001111'))
+        self.assertFalse(User.objects.get(username='bob').has_usable_password())
+        self.assertTrue(User.objects.get(username='taken').check_password('password'))
+
+
+    def test_conflicts_are_not_counted_as_created(self):
+        User.objects.create_user(username='taken', password='password')
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as file:
+            file.write('{"username": "new"}\n{"username": "taken"}\n')
+
+        # As if "taken" were inserted between the lookup and the insert,
+        # while someone else signed up
+        def new_rows(command, batch):
+            User.objects.create_user(username='signup', password='password')
+            return batch
+
+        out = StringIO()
+        with mock.patch('users.management.commands.provision_users.Command.new_rows', new_rows):
+            call_command('provision_users', file.name, processes=1, stdout=out)
+
+        self.assertIn("created 1 users, skipped 1", out.getvalue())
+
+
+class AutocompleteTest(APITestCase):
+    def setUp(self):
+        reset_index()
+        self.viewer = User.objects.create_user(username='viewer', password='password')
+        self.popular = User.objects.create_user(username='annabel', password='password')
+        self.quiet = User.objects.create_user(username='anna', password='password', first_name='Anna', last_name='Smith')
+        self.other = User.objects.create_user(username='bob', password='password', first_name='Robert', last_name='Annan')
+        for follower in (self.viewer, self.quiet, self.other):
+            self.popular.followers.add(follower)
+        reconcile()
+
+    def names(self, prefix, first=10):
+        return [user.username for user in autocomplete_users(prefix, self.viewer, first)]
+
+    def test_prefix_index(self):
+        index = PrefixIndex([(1, 'Anna', '', '', 1), (2, 'annabel', '', '', 5), (3, 'bob', 'Ann', 'Lee', 0)])
+        self.assertEqual(index.search('ANN', 10), [2, 1, 3])
+        self.assertEqual(index.search('ann', 1), [2])
+        self.assertEqual(index.search('lee', 10), [3])
+        self.assertEqual(index.search('z', 10), [])
+
+    def test_prefix_index_writes_are_merged_in_batches(self):
+        index = PrefixIndex([(1, 'anna', '', '', 1), (2, 'bob', '', '', 5)])
+        ids = index.ids
+        index.add(3, {'annie'}, 9)
+        index.remove(1)
+        # Held aside until a batch is full, not inserted into the arrays
+        self.assertIs(index.ids, ids)
+        self.assertEqual(index.search('ann', 10), [3])
+
+        for user_id in range(4, 3 + PrefixIndex.MERGE_EVERY):
+            index.add(user_id, {f'zed{user_id}'}, 0)
+        self.assertEqual((index.recent, index.removed), ([], set()))
+        self.assertEqual(index.keys, sorted(index.keys))
+        self.assertEqual(len(index), 1 + PrefixIndex.MERGE_EVERY)
+        self.assertEqual(index.search('ann', 10), [3])
+        self.assertEqual(index.search('b', 10), [2])
+
+    def test_ranked_by_followers_across_names(self):
+        self.assertEqual(self.names('Ann'), ['annabel', 'anna', 'bob'])
+        self.assertEqual(self.names('ann', first=1), ['annabel'])
+        self.assertEqual(self.names('smi'), ['anna'])
+
+    def test_follows_writes(self):
+        self.names('a')
+        self.other.username = 'carol'
+        self.other.save()
+        User.objects.create_user(username='carlos', password='password')
+        soft_delete(self.quiet)
+
+        self.assertEqual(self.names('car'), ['carlos', 'carol'])
+        self.assertEqual(self.names('bob'), [])
+        self.assertEqual(self.names('ann'), ['annabel', 'carol'])
+
+    def test_deleted_users_leave_the_index(self):
+        self.names('a')
+        soft_delete(self.quiet)
+        self.other.delete()
+
+        self.assertEqual(get_index().search('ann', 10), [self.popular.id])
+
+    def test_blocked_users_are_left_out(self):
+        self.popular.blocked_users.add(self.viewer)
+        self.assertEqual(self.names('ann'), ['anna', 'bob'])
+
+
+class DataExportTest(APITestCase):
+    def setUp(self):
+        get_store().clear()
+        self.media = tempfile.TemporaryDirectory()
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(self.media.cleanup)
+
+        self.user = User.objects.create_user(username='exporter', password='password', profile_picture=create_dummy_image())
+        self.fan = User.objects.create_user(username='fan', password='password')
+        self.post = Post.objects.create(author=self.user, content='first')
+        PostFile.objects.create(post=self.post, file=create_dummy_image())
+        Comment.objects.create(author=self.user, post=self.post, content='nice')
+        self.post.likers.add(self.user)
+        self.user.followers.add(self.fan)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.user))
+
+    def request_export(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('exports'))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        return response, callbacks
+
+    def test_archive_holds_rows_and_media(self):
+        response, _ = self.request_export()
+        export = run_export(response.data['id'])
+        self.assertEqual(export.status, DataExport.Status.DONE)
+
+        with export.archive.open('rb') as file, zipfile.ZipFile(file) as archive:
+            names = set(archive.namelist())
+            self.assertIn('posts.jsonl', names)
+            self.assertIn(f'media/{self.user.profile_picture.name}', names)
+            self.assertIn(f'media/{self.post.files.get().file.name}', names)
+            self.assertEqual(archive.read('posts.jsonl').decode().count('\n'), 1)
+            self.assertIn('"username": "fan"', archive.read('followers.jsonl').decode())
+            self.assertIn(f'"post_id": {self.post.id}', archive.read('post_likes.jsonl').decode())
+            self.assertNotIn('password', archive.read('profile.jsonl').decode())
+
+    def test_download_is_streamed_to_the_owner_only(self):
+        response, callbacks = self.request_export()
+        self.assertEqual(len(callbacks), 1)
+        export_id = response.data['id']
+        # A second request while the first is pending returns the same export
+        self.assertEqual(self.request_export()[0].data['id'], export_id)
+
+        download = reverse('export-download', kwargs={'id': export_id})
+        self.assertEqual(self.client.get(download).status_code, status.HTTP_409_CONFLICT)
+        run_export(export_id)
+
+        response = self.client.get(reverse('export-detail', kwargs={'id': export_id}))
+        self.assertEqual(response.data['status'], DataExport.Status.DONE)
+        response = self.client.get(download)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content)[:2], b'PK')
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + get_jwt_token(self.fan))
+        self.assertEqual(self.client.get(download).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_new_export_replaces_the_old_archive(self):
+        first = run_export(self.request_export()[0].data['id'])
+        second = run_export(self.request_export()[0].data['id'])
+
+        self.assertFalse(DataExport.objects.filter(id=first.id).exists())
+        self.assertFalse(first.archive.storage.exists(first.archive.name))
+        self.assertTrue(second.archive.storage.exists(second.archive.name))
+
+    def test_stale_exports_are_restarted(self):
+        export_id = self.request_export()[0].data['id']
+        DataExport.objects.filter(id=export_id).update(status=DataExport.Status.RUNNING)
+        # Still running within the timeout: the same export, not queued again
+        response, callbacks = self.request_export()
+        self.assertEqual((response.data['id'], len(callbacks)), (export_id, 0))
+
+        DataExport.objects.filter(id=export_id).update(updated_at=timezone.now() - timedelta(hours=2))
+        response, callbacks = self.request_export()
+        self.assertEqual((response.data['id'], response.data['status'], len(callbacks)), (export_id, 'pending', 1))
+
+        DataExport.objects.filter(id=export_id).update(updated_at=timezone.now() - timedelta(hours=2))
+        out = StringIO()
+        call_command('resume_exports', stdout=out)
+        self.assertIn(f"Export {export_id}", out.getvalue())
+        self.assertEqual(DataExport.objects.get(id=export_id).status, DataExport.Status.DONE)
+
+    @override_settings(EXPORT_HEARTBEAT_INTERVAL=0, EXPORT_CHUNK_SIZE=1)
+    def test_long_export_is_not_taken_as_stale(self):
+        export_id = self.request_export()[0].data['id']
+        real_write_archive = exports.write_archive
+        seen_stale = []
+
+        def slow_write_archive(user_id, target, **kwargs):
+            # As if the export had been running for longer than the timeout
+            DataExport.objects.filter(id=export_id).update(updated_at=timezone.now() - timedelta(hours=2))
+            rows = real_write_archive(user_id, target, **kwargs)
+            seen_stale.append(stale_exports().filter(id=export_id).exists())
+            return rows
+
+        with mock.patch.object(exports, 'write_archive', slow_write_archive):
+            export = run_export(export_id)
+
+        self.assertEqual(seen_stale, [False])
+        self.assertEqual(export.status, DataExport.Status.DONE)
+
+    def test_purge_removes_archives(self):
+        export = run_export(self.request_export()[0].data['id'])
+        with self.captureOnCommitCallbacks():
+            job = soft_delete(self.user)
+        run_purge_job(job.id)
+
+        self.assertFalse(DataExport.objects.exists())
+        self.assertFalse(export.archive.storage.exists(export.archive.name))
@@ -1,12 +1,16 @@
 from django.urls import path
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from helpers.startup import lazy_view
 from .views import *
 
 urlpatterns = [
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/', lazy_view('rest_framework_simplejwt.views.TokenObtainPairView'), name='token_obtain_pair'),
+    path('token/refresh/', lazy_view('rest_framework_simplejwt.views.TokenRefreshView'), name='token_refresh'),
     path('', BasicUserView.as_view(), name='user-details'),
     path('<int:id>/', BasicUserView.as_view(), name='user-details'),
     path('follow/<int:id>', FollowUserView.as_view(), name='follow'),
-    path('block/<int:id>', BlockView.as_view(), name='block')
+    path('block/<int:id>', BlockView.as_view(), name='block'),
+    path('contacts/', ContactSyncView.as_view(), name='contact-sync'),
+    path('exports/', ExportView.as_view(), name='exports'),
+    path('exports/<int:id>/', ExportDetailView.as_view(), name='export-detail'),
+    path('exports/<int:id>/download/', ExportDownloadView.as_view(), name='export-download'),
 ]
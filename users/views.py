@@ -1,11 +1,18 @@
+from django.http import FileResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser
-from users.models import User
-from users.serializer import UserSerializer
+from users.models import User, DataExport
+from users.serializer import UserSerializer, user_rows
+from posts.purge import soft_delete
+from users.avatars import schedule_avatar_build
+from users.relations import set_block, set_follow
+from users.contacts import HASH_RE, MAX_CONTACTS, match_contacts
+from users.exports import request_export
+from helpers.conditional import Validators
 
 class BasicUserView(APIView):
     permission_classes = [AllowAny]
@@ -15,29 +22,36 @@ class BasicUserView(APIView):
         """
         Create a new User.
         """
-        serializer = UserSerializer(data=request.data)
+        serializer = UserSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
+            # Hashes the password once, on the hashing pool
             user = serializer.save()
 
-            # Set password securely after user creation
-            user.set_password(request.data.get('password'))
-            user.save()
+            if user.profile_picture:
+                schedule_avatar_build(user)
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     def get(self, request, *args, **kwargs):
         """
-        Retrieve an user by ID.
+        Retrieve an user by ID. Conditional requests are answered from the
+        version columns alone, without loading the profile.
         """
         user_id = kwargs.get('id')
-        try:
-            user = User.objects.get(id=user_id)
-        except User.DoesNotExist:
+        state = User.objects.filter(id=user_id).values_list('version', 'updated_at').first()
+        if state is None:
             raise NotFound(detail="user not found")
-        
-        serializer = UserSerializer(user)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        validators = Validators([state[0]], state[1])
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+
+        user = next(user_rows(User.objects.filter(id=user_id), request), None)
+        if user is None:
+            raise NotFound(detail="user not found")
+
+        return Response(user, status=status.HTTP_200_OK, headers=validators.headers)
 
     def put(self, request, *args, **kwargs):
         """
@@ -55,9 +69,11 @@ class BasicUserView(APIView):
         if request.user.id != user.id:
             return Response({'error': 'You do not have permission to edit this profile'}, status=status.HTTP_403_FORBIDDEN)
 
-        serializer = UserSerializer(user, data=request.data)
+        serializer = UserSerializer(user, data=request.data, context={'request': request})
         if serializer.is_valid():
             serializer.save()
+            if 'profile_picture' in request.FILES:
+                schedule_avatar_build(user)
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -74,7 +90,7 @@ class BasicUserView(APIView):
             user = User.objects.get(id=user_id)
             if request.user.id != user.id:
                 return Response({'error': 'You do not have permission to delete this profile'}, status=status.HTTP_403_FORBIDDEN)
-            user.delete()
+            soft_delete(user)
             
             return Response(status=status.HTTP_204_NO_CONTENT)
         except User.DoesNotExist:
@@ -84,17 +100,18 @@ class BasicUserView(APIView):
         
 class FollowUserView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = 'follows'
 
     def post(self, request, *args, **kwargs):
         """Follow a user"""
         id = kwargs.get('id')
 
         try:
-            user_to_follow = User.objects.get(id=id)
+            user_to_follow = User.objects.visible_to(request.user).get(id=id)
         except User.DoesNotExist:
             raise NotFound
         
-        user_to_follow.followers.add(request.user)
+        set_follow(request.user, user_to_follow)
         return Response({'message': 'User followed successfully'}, status=status.HTTP_200_OK)
 
     def delete(self, request, *args, **kwargs):
@@ -106,11 +123,13 @@ class FollowUserView(APIView):
         except User.DoesNotExist:
             raise NotFound
         
-        user_to_unfollow.followers.remove(request.user)
+        set_follow(request.user, user_to_unfollow, following=False)
         return Response({'message': 'User unfollowed successfully'}, status=status.HTTP_204_NO_CONTENT)
 
 
 class BlockView(APIView):
+    throttle_scope = 'blocks'
+
     def post(self, request, *args, **kwargs):
         """ Block a user """
         id = kwargs.get('id')
@@ -120,7 +139,7 @@ class BlockView(APIView):
         except User.DoesNotExist:
             raise NotFound
         
-        request.user.blocked_users.add(user_to_block)
+        set_block(request.user, user_to_block)
         return Response({'message': 'User blocked successfully'}, status=status.HTTP_200_OK)
     
     def delete(self, request, *args,**kwargs):
@@ -132,5 +151,63 @@ class BlockView(APIView):
         except User.DoesNotExist:
             raise NotFound
         
-        request.user.blocked_users.remove(user_to_unblock)
+        set_block(request.user, user_to_unblock, blocked=False)
         return Response({'message': 'User unblocked successfully'}, status=status.HTTP_204_NO_CONTENT)
+
+
+class ContactSyncView(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'contacts'
+
+    def post(self, request, *args, **kwargs):
+        """
+        Find friends from an address book sent as {"hashes": [...]}: the
+        SHA-256 hex digests of the E.164 numbers ('+' and digits).
+        """
+        hashes = request.data.get('hashes')
+        if not isinstance(hashes, list) or not all(isinstance(h, str) and HASH_RE.fullmatch(h.lower()) for h in hashes):
+            raise ValidationError({'hashes': "Expected a list of SHA-256 hex digests."})
+        if len(hashes) > MAX_CONTACTS:
+            raise ValidationError({'hashes': f"At most {MAX_CONTACTS} contacts per request."})
+        return Response({'matches': match_contacts(request.user, hashes, request)}, status=status.HTTP_200_OK)
+
+
+def export_data(export):
+    return {'id': export.id, 'status': export.status, 'size': export.size, 'created_at': export.created_at}
+
+
+class ExportView(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = 'exports'
+
+    def post(self, request, *args, **kwargs):
+        """
+        Start building an archive of the user's data, or return the one in
+        progress. Poll the export until it is done, then download it.
+        """
+        export = request_export(request.user)
+        return Response(export_data(export), status=status.HTTP_202_ACCEPTED)
+
+
+class ExportDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_export(self, request, id):
+        export = DataExport.objects.filter(id=id, user=request.user).first()
+        if export is None:
+            raise NotFound(detail="export not found")
+        return export
+
+    def get(self, request, *args, **kwargs):
+        return Response(export_data(self.get_export(request, kwargs['id'])), status=status.HTTP_200_OK)
+
+
+class ExportDownloadView(ExportDetailView):
+    def get(self, request, *args, **kwargs):
+        """ The finished archive, streamed from storage in chunks """
+        export = self.get_export(request, kwargs['id'])
+        if export.status != DataExport.Status.DONE:
+            return Response({'error': 'The export is not ready'}, status=status.HTTP_409_CONFLICT)
+        return FileResponse(
+            export.archive.open('rb'), as_attachment=True, filename=f'{request.user.username}-data.zip',
+        )